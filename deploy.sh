@@ -93,6 +93,8 @@ ssh -t "$REMOTE_USER@$REMOTE_HOST" << 'EOF'
     # Start service
     echo "Starting service..."
     sudo systemctl start mail-admin
+    # Pick up new mail_monitor code (no-op on hosts still using the cron job)
+    sudo systemctl restart mail-monitor 2>/dev/null || true
 
     # Quick health check
     sleep 2
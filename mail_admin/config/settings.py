@@ -122,12 +122,51 @@ DATABASES = {
         'PASSWORD': MAIL_DB_PASS,
         'HOST': MAIL_DB_HOST,
         'PORT': '3306',
+        # Same database as 'default', so tests must not create it twice
+        'TEST': {'MIRROR': 'default'},
     }
 }
 
 DATABASE_ROUTERS = ['core.router.MailRouter']
 
 
+# Cache
+# With REDIS_URL (e.g. redis://127.0.0.1:6379/3) the gunicorn workers share
+# one cache, so invalidations reach all of them at once. Without it each
+# worker keeps its own and sees changes when its cached entries expire.
+REDIS_URL = os.environ.get("REDIS_URL", "")
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'mail_admin',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'mail-admin',
+        }
+    }
+
+
+# Dovecot doveadm HTTP API (service doveadm { inet_listener http }), used for
+# reloads and live quota usage. Without an API key quota usage is off and
+# reloads fall back to `sudo doveadm reload`. setup_server.sh generates the key
+# into /etc/mail-admin/doveadm.env.
+DOVEADM_URL = os.environ.get("DOVEADM_URL", "http://127.0.0.1:8080/doveadm/v1")
+DOVEADM_API_KEY = os.environ.get("DOVEADM_API_KEY", "")
+
+# Day-partitioned full-text index of mail log events, written by log_index.py
+LOG_INDEX_DIR = os.environ.get("LOG_INDEX_DIR", "/var/lib/mail-admin/logindex")
+
+# Unix socket of provisiond.py, the root helper that creates maildirs owned by vmail
+PROVISION_SOCKET = os.environ.get("PROVISION_SOCKET", "/run/mail-admin/provision.sock")
+
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -0,0 +1,87 @@
+"""
+Per-request authorization snapshot.
+
+Which domains a user may manage and which mail accounts are protected
+(belong to Django superusers) are computed once, kept on the request, and
+cached across requests under a global version key. Changes made through the
+app (assignments, users, domains) bump the version from signal handlers
+(see core.signals); anything changed outside the app is picked up once
+SNAPSHOT_TIMEOUT expires.
+"""
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from .models import DomainAssignment, MailDomain
+
+SNAPSHOT_TIMEOUT = 60
+VERSION_KEY = 'authz:version'
+
+
+class AuthzSnapshot:
+    """
+    What one user may do. Superusers manage every domain, so their domain
+    set is left empty rather than loading every domain name.
+    """
+
+    def __init__(self, user_id, is_superuser, domains, protected):
+        self.user_id = user_id
+        self.is_superuser = is_superuser
+        self.domains = frozenset(domains)
+        self.protected = frozenset(protected)
+
+    def can_manage(self, domain_name):
+        return self.is_superuser or domain_name in self.domains
+
+    def is_protected(self, email):
+        """True if email belongs to a Django superuser (off limits to domain admins)."""
+        return email in self.protected
+
+    @property
+    def managed_domains(self):
+        """Sorted domain names for non-superusers; superusers should query MailDomain directly."""
+        return sorted(self.domains)
+
+
+def build_snapshot(user):
+    """Compute a snapshot from the database: one to three queries."""
+    domains = []
+    if not user.is_superuser:
+        domains = list(DomainAssignment.objects.filter(user=user).values_list('domain_name', flat=True))
+        if not domains:
+            # Legacy fallback: infer the domain from the login email
+            domain_part = user.username.partition('@')[2]
+            if domain_part and MailDomain.objects.using('mail_data').filter(name=domain_part).exists():
+                domains = [domain_part]
+    protected = User.objects.filter(is_superuser=True).values_list('username', flat=True)
+    return AuthzSnapshot(user.pk, user.is_superuser, domains, protected)
+
+
+def current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Evicted or never set: start a new version so nothing older is reused
+        version = invalidate()
+    return version
+
+
+def invalidate():
+    """Discard every cached snapshot. Returns the new version."""
+    # Time-based rather than incr(), so a lost key never brings back an old version
+    version = time.time_ns()
+    cache.set(VERSION_KEY, version, None)
+    return version
+
+
+def get_authz(request):
+    """The snapshot for request.user, computed at most once per request."""
+    snapshot = getattr(request, '_authz', None)
+    if snapshot is None:
+        key = f"authz:{current_version()}:{request.user.pk}"
+        snapshot = cache.get(key)
+        if snapshot is None:
+            snapshot = build_snapshot(request.user)
+            cache.set(key, snapshot, SNAPSHOT_TIMEOUT)
+        request._authz = snapshot
+    return snapshot
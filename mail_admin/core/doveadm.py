@@ -0,0 +1,172 @@
+"""
+Client for Dovecot's doveadm HTTP API.
+
+Commands are sent as JSON batches over one keep-alive requests.Session per
+process, so quotas for a whole page of mailboxes cost a single round trip.
+Quota readings are cached for QUOTA_TTL seconds: the usage bars only need to
+be roughly current, and Dovecot walks the maildir when its quota is cold.
+Configured by DOVEADM_URL and DOVEADM_API_KEY (doveadm_api_key in Dovecot).
+Without a key only reload() works, through `sudo doveadm reload`.
+"""
+import base64
+import logging
+import subprocess
+import threading
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+QUOTA_TTL = 60
+BATCH_SIZE = 100
+TIMEOUT = (2, 10)  # (connect, read) seconds
+RELOAD_COMMAND = ('/usr/bin/sudo', '/usr/sbin/doveadm', 'reload')
+
+_session = None
+
+
+class DoveadmError(Exception):
+    """The API is unconfigured or unreachable, or a command failed."""
+
+
+def is_configured():
+    return bool(settings.DOVEADM_API_KEY)
+
+
+def get_session():
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+    return _session
+
+
+def run(commands):
+    """
+    Send [(command, parameters), ...] in one request.
+    Returns: one entry per command, in order: its result rows, or a
+    DoveadmError if that command failed. Raises DoveadmError if the request
+    as a whole fails.
+    """
+    if not is_configured():
+        raise DoveadmError("DOVEADM_API_KEY is not set")
+    body = [[name, parameters, f"c{i}"] for i, (name, parameters) in enumerate(commands)]
+    key = base64.b64encode(settings.DOVEADM_API_KEY.encode()).decode()
+    try:
+        response = get_session().post(settings.DOVEADM_URL, json=body, timeout=TIMEOUT,
+                                      headers={'Authorization': f"X-Dovecot-API {key}"})
+        response.raise_for_status()
+        replies = response.json()
+    except (requests.RequestException, ValueError) as e:
+        raise DoveadmError(f"doveadm API request failed: {e}") from e
+
+    results = [DoveadmError("no reply")] * len(commands)
+    for reply in replies:
+        try:
+            kind, payload, tag = reply
+            index = int(tag[1:])
+            name = commands[index][0]
+        except (TypeError, ValueError, IndexError):
+            raise DoveadmError(f"Unexpected doveadm API reply: {reply!r}")
+        results[index] = payload if kind == 'doveadmResponse' else DoveadmError(f"{name} failed: {payload}")
+    return results
+
+
+def run_batched(commands):
+    """run() in chunks of BATCH_SIZE commands."""
+    results = []
+    for start in range(0, len(commands), BATCH_SIZE):
+        results += run(commands[start:start + BATCH_SIZE])
+    return results
+
+
+def reload():
+    """Reload Dovecot's configuration (and drop its auth cache)."""
+    if not is_configured():
+        try:
+            subprocess.run(RELOAD_COMMAND, check=True, capture_output=True, timeout=10)
+        except (OSError, subprocess.SubprocessError) as e:
+            raise DoveadmError(f"doveadm reload failed: {e}") from e
+        return
+    result, = run([('reload', {})])
+    if isinstance(result, DoveadmError):
+        raise result
+
+
+def parse_quota(rows):
+    """
+    The STORAGE row of a quotaGet result (values in KiB).
+    Returns: {'used', 'limit', 'percent'} with sizes in bytes (limit None
+    when unlimited), or None if the mailbox has no storage quota.
+    """
+    for row in rows:
+        if row.get('type') == 'STORAGE':
+            limit = row.get('limit')
+            return {
+                'used': int(row.get('value') or 0) * 1024,
+                'limit': int(limit) * 1024 if limit not in (None, '', '-') else None,
+                'percent': min(100, int(row.get('percent') or 0)),
+            }
+    return None
+
+
+def quota_key(email):
+    return f"doveadm:quota:{email}"
+
+
+def get_quotas(emails):
+    """
+    Current quota usage for each mailbox, from the cache where possible and
+    otherwise in one batched request. Mailboxes Dovecot could not answer for
+    are left out; raises DoveadmError only if the API itself is unavailable.
+    Returns: dict of email -> parse_quota() result.
+    """
+    cached = cache.get_many([quota_key(email) for email in emails])
+    quotas = {email: cached[quota_key(email)] for email in emails if quota_key(email) in cached}
+    missing = [email for email in emails if email not in quotas]
+    if missing:
+        fetched = {}
+        for email, result in zip(missing, run_batched([('quotaGet', {'user': email}) for email in missing])):
+            if isinstance(result, DoveadmError):
+                logger.warning(f"Quota lookup failed for {email}: {result}")
+                continue
+            fetched[email] = parse_quota(result)
+        cache.set_many({quota_key(email): quota for email, quota in fetched.items()}, QUOTA_TTL)
+        quotas.update(fetched)
+    return quotas
+
+
+def recalc_quotas(emails):
+    """
+    Recalculate quota usage from the mailboxes and drop the cached readings.
+    Returns: list of emails whose recalculation failed.
+    """
+    results = run_batched([('quotaRecalc', {'user': email}) for email in emails])
+    cache.delete_many([quota_key(email) for email in emails])
+    failed = [email for email, result in zip(emails, results) if isinstance(result, DoveadmError)]
+    for email in failed:
+        logger.warning(f"Quota recalculation failed for {email}")
+    return failed
+
+
+def recalc_quotas_later(emails):
+    """
+    recalc_quotas() on a background thread, so a large domain does not hold
+    up the request. Cached readings are dropped now and again when it is done.
+    """
+    cache.delete_many([quota_key(email) for email in emails])
+    if not is_configured() or not emails:
+        return None
+
+    def recalc():
+        try:
+            recalc_quotas(emails)
+        except DoveadmError as e:
+            logger.warning(f"Quota recalculation for {len(emails)} mailbox(es) failed: {e}")
+    thread = threading.Thread(target=recalc, name='doveadm-recalc', daemon=True)
+    thread.start()
+    return thread
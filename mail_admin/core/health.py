@@ -0,0 +1,117 @@
+"""
+Non-blocking server health sampling.
+
+Plain Python (no Django imports) so mail_monitor.py can use it. Samples are
+kept per metric in fixed-size array('d') ring buffers and summarised as
+min/avg/max/p95 over each reporting period.
+"""
+import math
+import os
+import time
+from array import array
+
+import psutil
+
+METRICS = ('cpu', 'ram', 'disk', 'load', 'iowait')
+SUMMARY_STATS = ('min', 'avg', 'max', 'p95')
+
+
+class RingBuffer:
+    """Fixed-capacity float buffer; once full, each append overwrites the oldest value."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = array('d', bytes(8 * capacity))
+        self.pos = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, value):
+        self.data[self.pos] = value
+        self.pos = (self.pos + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def last(self, n):
+        """The newest n values (at most len(self)), oldest first."""
+        n = min(n, self.count)
+        start = (self.pos - n) % self.capacity
+        if start + n <= self.capacity:
+            return self.data[start:start + n]
+        return self.data[start:] + self.data[:self.pos]
+
+
+def summarise(values):
+    """min/avg/max/p95 (nearest rank) of a sequence, or None when empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    n = len(ordered)
+    return {
+        'min': ordered[0],
+        'avg': sum(ordered) / n,
+        'max': ordered[-1],
+        'p95': ordered[math.ceil(0.95 * n) - 1],
+    }
+
+
+class HealthSampler:
+    """
+    Collects CPU, memory, disk, load and I/O-wait samples at a fixed cadence.
+
+    CPU and I/O-wait come from psutil.cpu_times_percent(interval=None), which
+    measures since the previous call instead of sleeping, so the sampler is
+    primed on construction and each sample() returns immediately.
+    summary() covers the samples taken since the previous summary() call.
+    """
+
+    def __init__(self, interval=5.0, capacity=720, disk_path='/'):
+        self.interval = interval
+        self.disk_path = disk_path
+        self.buffers = {metric: RingBuffer(capacity) for metric in METRICS}
+        self.pending = 0
+        self.last_sample = None
+        self.period_start = time.monotonic()
+        psutil.cpu_times_percent(interval=None)
+
+    def due(self, now=None):
+        now = time.monotonic() if now is None else now
+        return self.last_sample is None or now - self.last_sample >= self.interval
+
+    def sample(self, now=None):
+        times = psutil.cpu_times_percent(interval=None)
+        values = {
+            'cpu': 100.0 - times.idle,
+            'ram': psutil.virtual_memory().percent,
+            'disk': psutil.disk_usage(self.disk_path).percent,
+            'load': os.getloadavg()[0],
+            'iowait': getattr(times, 'iowait', 0.0),
+        }
+        for metric, value in values.items():
+            self.buffers[metric].append(value)
+        self.pending += 1
+        self.last_sample = time.monotonic() if now is None else now
+        return values
+
+    def maybe_sample(self, now=None):
+        if self.due(now):
+            self.sample(now)
+
+    def summary(self, now=None):
+        """
+        Returns: {'samples', 'seconds', 'cpu': {'min', 'avg', 'max', 'p95'}, ...}
+        for the current period, and starts a new one. Takes a sample first if
+        the period has none.
+        """
+        now = time.monotonic() if now is None else now
+        if not self.pending:
+            self.sample(now)
+        count = min(self.pending, self.buffers['cpu'].capacity)
+        result = {'samples': count, 'seconds': now - self.period_start}
+        for metric, buffer in self.buffers.items():
+            result[metric] = summarise(buffer.last(count))
+        self.pending = 0
+        self.period_start = now
+        return result
@@ -0,0 +1,261 @@
+"""
+Structured systemd-journal reading.
+
+Entries come from the python-systemd binding (systemd.journal) when it is
+installed, otherwise from a single streaming `journalctl --output=json`
+process per read. A JSON-lines export (journalctl -o json > file) can stand
+in for the live journal, which is how the tests run.
+
+Plain Python (no Django imports) so mail_monitor.py and the report scripts
+can use it.
+"""
+import datetime
+import json
+import os
+import subprocess
+from collections import namedtuple
+
+try:
+    from systemd import journal as systemd_journal
+except ImportError:
+    systemd_journal = None
+
+# Journal matches are exact, so "postfix/*" is spelled out per daemon.
+POSTFIX_IDENTIFIERS = (
+    'postfix/anvil', 'postfix/bounce', 'postfix/cleanup', 'postfix/error',
+    'postfix/lmtp', 'postfix/local', 'postfix/pickup', 'postfix/pipe',
+    'postfix/postscreen', 'postfix/qmgr', 'postfix/smtp', 'postfix/smtpd',
+    'postfix/submission/smtpd', 'postfix/virtual',
+)
+
+JOURNALCTL = ('journalctl',)
+EPOCH = datetime.datetime(1970, 1, 1)
+
+JournalEntry = namedtuple('JournalEntry', 'time identifier pid unit hostname message cursor')
+JournalEntry.__doc__ = "One journal record; time is naive UTC."
+
+
+class JournalError(Exception):
+    pass
+
+
+def _text(value):
+    """Journal fields arrive as str, bytes, or (JSON export) lists of byte values."""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        value = bytes(value)
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    return '' if value is None else str(value)
+
+
+def entry_from_record(record):
+    """Build a JournalEntry from a journalctl JSON object or a systemd.journal.Reader dict."""
+    stamp = record.get('__REALTIME_TIMESTAMP')
+    if isinstance(stamp, datetime.datetime):
+        # python-systemd converts to naive local time
+        time = stamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    else:
+        time = EPOCH + datetime.timedelta(microseconds=int(stamp or 0))
+    pid = record.get('SYSLOG_PID') or record.get('_PID')
+    return JournalEntry(
+        time=time,
+        identifier=_text(record.get('SYSLOG_IDENTIFIER') or record.get('_COMM')),
+        pid=_text(pid) or None,
+        unit=_text(record.get('_SYSTEMD_UNIT')) or None,
+        hostname=_text(record.get('_HOSTNAME')),
+        message=_text(record.get('MESSAGE')),
+        cursor=_text(record.get('__CURSOR')),
+    )
+
+
+def syslog_line(entry):
+    """Render an entry like `journalctl --output=short` does, in server local time."""
+    local = entry.time.replace(tzinfo=datetime.timezone.utc).astimezone()
+    pid = f"[{entry.pid}]" if entry.pid else ""
+    return f"{local:%b %d %H:%M:%S} {entry.hostname} {entry.identifier}{pid}: {entry.message}"
+
+
+class JournalReader:
+    """
+    Reads journal entries matching identifiers (SYSLOG_IDENTIFIER) and units
+    (_SYSTEMD_UNIT). Values of one field are ORed, the two fields ANDed.
+
+    With a cursor, reading resumes after that entry; otherwise since/until
+    (naive local datetimes, as journalctl takes them) bound the range.
+    self.cursor follows the last entry yielded, so callers can persist it
+    once what they read has been committed.
+
+    fixture: path to a `journalctl -o json` export to read instead of the
+    live journal. command: the journalctl invocation for the subprocess
+    fallback (e.g. with sudo in front).
+    """
+
+    def __init__(self, identifiers=(), units=(), cursor=None, since=None, until=None,
+                 fixture=None, command=JOURNALCTL):
+        self.identifiers = tuple(identifiers)
+        self.units = tuple(units)
+        self.cursor = cursor
+        self.since = since
+        self.until = until
+        self.fixture = fixture
+        self.command = tuple(command)
+        self.count = 0
+
+    @property
+    def backend(self):
+        if self.fixture:
+            return 'fixture'
+        return 'systemd' if systemd_journal is not None else 'journalctl'
+
+    @property
+    def is_fresh(self):
+        return self.cursor is None
+
+    def entries(self):
+        """Yield matching JournalEntry records, oldest first."""
+        source = {
+            'fixture': self._fixture_records,
+            'systemd': self._binding_records,
+            'journalctl': self._journalctl_records,
+        }[self.backend]
+        for record in source():
+            entry = entry_from_record(record)
+            self.cursor = entry.cursor or self.cursor
+            self.count += 1
+            yield entry
+
+    def tail(self, count):
+        """The newest count matching entries, oldest first. Does not move self.cursor."""
+        if self.backend == 'journalctl':
+            return [entry_from_record(record) for record in self._journalctl_records(tail=count)]
+        if self.backend == 'systemd':
+            return [entry_from_record(record) for record in self._binding_tail(count)]
+        entries = list(entry_from_record(record) for record in self._fixture_records())
+        return entries[-count:] if count else []
+
+    # --- Backends ---
+
+    def _matches(self, record):
+        if self.identifiers and _text(record.get('SYSLOG_IDENTIFIER')) not in self.identifiers:
+            return False
+        if self.units and _text(record.get('_SYSTEMD_UNIT')) not in self.units:
+            return False
+        return True
+
+    def _fixture_records(self):
+        since = self.since and self.since.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        until = self.until and self.until.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        skipping = self.cursor is not None
+        with open(self.fixture, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if skipping:
+                    skipping = record.get('__CURSOR') != self.cursor
+                    continue
+                if not self._matches(record):
+                    continue
+                time = entry_from_record(record).time
+                if self.cursor is None and since and time < since:
+                    continue
+                if until and time >= until:
+                    return
+                yield record
+
+    def _binding_reader(self):
+        reader = systemd_journal.Reader()
+        for identifier in self.identifiers:
+            reader.add_match(SYSLOG_IDENTIFIER=identifier)
+        for unit in self.units:
+            reader.add_match(_SYSTEMD_UNIT=unit)
+        return reader
+
+    def _binding_records(self):
+        reader = self._binding_reader()
+        try:
+            if self.cursor:
+                reader.seek_cursor(self.cursor)
+                # seek_cursor lands on the entry itself; resume after it
+                first = reader.get_next()
+                if first and first.get('__CURSOR') != self.cursor:
+                    yield first
+            elif self.since:
+                reader.seek_realtime(self.since)
+            until = self.until and self.until.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+            for record in reader:
+                if until and entry_from_record(record).time >= until:
+                    return
+                yield record
+        finally:
+            reader.close()
+
+    def _binding_tail(self, count):
+        reader = self._binding_reader()
+        try:
+            reader.seek_tail()
+            records = []
+            while len(records) < count:
+                record = reader.get_previous()
+                if not record:
+                    break
+                records.append(record)
+            records.reverse()
+            return records
+        finally:
+            reader.close()
+
+    def journalctl_args(self, tail=None):
+        # Units first: sudoers rules are written as "journalctl -u <unit> *"
+        args = list(self.command)
+        for unit in self.units:
+            args += ['-u', unit]
+        for identifier in self.identifiers:
+            args += ['-t', identifier]
+        if tail is not None:
+            args += ['-n', str(tail)]
+        elif self.cursor:
+            args.append(f'--after-cursor={self.cursor}')
+        elif self.since:
+            args.append(f'--since={self.since:%Y-%m-%d %H:%M:%S}')
+        if self.until and tail is None:
+            args.append(f'--until={self.until:%Y-%m-%d %H:%M:%S}')
+        args += ['--output=json', '--no-pager']
+        return args
+
+    def _journalctl_records(self, tail=None):
+        proc = subprocess.Popen(self.journalctl_args(tail), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            for line in proc.stdout:
+                if line.strip():
+                    yield json.loads(line)
+            stderr = proc.stderr.read().decode('utf-8', errors='replace').strip()
+            if proc.wait() != 0:
+                raise JournalError(stderr or f"journalctl exited with status {proc.returncode}")
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+            proc.stderr.close()
+
+
+def load_cursor(path):
+    """Cursor saved by save_cursor(), or None."""
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def save_cursor(path, cursor):
+    """Atomically persist a journal cursor (same idea as journalctl --cursor-file)."""
+    if not cursor:
+        return
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        f.write(cursor + '\n')
+    os.replace(tmp, path)
@@ -0,0 +1,351 @@
+"""
+Full-text index of mail log events in SQLite FTS5, one database per day.
+
+EventParser turns Postfix, Dovecot and Rspamd log lines into LogEvents
+carrying queue ID, message-id, sender, recipient, client IP and status;
+Postfix lines are joined by queue ID (core.maillog.QueueCorrelator) so a
+delivery line is findable by its sender and message-id too. LogIndex
+writes them into <directory>/<YYYY-MM-DD>.db (UTC days), so retention is
+deleting whole files and a search only opens the days it covers, newest
+first, stopping once it has enough rows.
+
+Plain Python (no Django imports): log_index.py writes the index and the
+web views only read it.
+"""
+import datetime
+import json
+import os
+import re
+import sqlite3
+from collections import defaultdict, namedtuple
+
+from .maillog import CLIENT_RE, LINE_RE, QUEUE_RE, REJECT_MARKERS, QueueCorrelator, parse_fields, strip_brackets
+
+RETENTION_DAYS = 30
+SEARCH_LIMIT = 200
+
+# Searchable columns; time, source, program and the raw message are stored for display only
+INDEXED_FIELDS = ('queue_id', 'message_id', 'sender', 'recipient', 'client', 'status')
+# Short prefixes accepted in queries: "from:alice@example.com qid:4Xyz..."
+FIELD_ALIASES = {
+    'qid': 'queue_id', 'queue': 'queue_id', 'msgid': 'message_id', 'from': 'sender', 'to': 'recipient',
+    'ip': 'client', **{name: name for name in INDEXED_FIELDS},
+}
+
+LogEvent = namedtuple('LogEvent', ['time', 'source', 'program', *INDEXED_FIELDS, 'message'])
+LogEvent.__doc__ = "One indexed log line; time is naive UTC. For Dovecot events recipient is the mailbox."
+
+SCHEMA = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS events USING fts5(
+    time UNINDEXED, source UNINDEXED, program UNINDEXED,
+    {', '.join(INDEXED_FIELDS)},
+    message UNINDEXED
+)
+"""
+COLUMNS = ', '.join(LogEvent._fields)
+INSERT = f"INSERT INTO events ({COLUMNS}) VALUES ({', '.join('?' * len(LogEvent._fields))})"
+INSERT_BATCH = 5000
+DAY_FILE_RE = re.compile(r'^(\d{4}-\d\d-\d\d)\.db$')
+
+# Rspamd's own log (/var/log/rspamd/rspamd.log); one rspamd_task_write_log line per scanned message
+RSPAMD_RE = re.compile(
+    r'^(?P<ts>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)\S* #\d+\([^)]*\) <[^>]*>; \w+; rspamd_task_write_log: (?P<msg>.*)$'
+)
+RSPAMD_FIELD_RE = re.compile(r'(?:^|, )(id|qid|ip|from|rcpts): (<[^>]*>(?:,<[^>]*>)*|[^,\s]*)')
+RSPAMD_ACTION_RE = re.compile(r'\(default: [TF] \((?P<action>[^)]+)\): \[(?P<score>[-\d.]+)/')
+# "lmtp(alice@example.com)<1234><sess>: msgid=<...>: saved mail to INBOX", "imap-login: Login: user=<...>, rip=..."
+DOVECOT_RE = re.compile(r'^(?P<service>[\w-]+)(?:\((?P<user>[^)]*)\))?(?:<[^>]*>)*: (?P<rest>.*)$')
+
+
+class EventParser:
+    """
+    Turns log lines into LogEvents (None for lines with nothing to index).
+    Traditional syslog lines carry Postfix and Dovecot; Rspamd's own log
+    format is recognised too, so one parser serves every source file.
+    """
+
+    def __init__(self, correlator=None):
+        self.correlator = correlator or QueueCorrelator()
+        self.parse_time = self.correlator.parse_time
+
+    def feed(self, line):
+        line = line.rstrip('\n')
+        match = LINE_RE.match(line)
+        if match:
+            prog, message = match.group('prog'), match.group('msg')
+            if prog.startswith('postfix'):
+                return self._postfix(self.parse_time(match.group('ts')), prog, message)
+            if prog.startswith('dovecot'):
+                return self._dovecot(self.parse_time(match.group('ts')), message)
+            return None
+        match = RSPAMD_RE.match(line)
+        if match:
+            return self._rspamd(self.parse_time(match.group('ts')), match.group('msg'))
+        return None
+
+    def feed_lines(self, lines):
+        """Yield the LogEvents for an iterable of lines."""
+        for line in lines:
+            event = self.feed(line)
+            if event is not None:
+                yield event
+
+    def _postfix(self, time, prog, message):
+        queued = QUEUE_RE.match(message)
+        if not queued:
+            return None
+        qid, rest = queued.group('qid'), queued.group('rest')
+        # Keeps the per-queue-ID context (sender, message-id, client) up to date
+        self.correlator.feed_record(time, prog, message)
+        entry = self.correlator.pending.get(qid, {}) if qid != 'NOQUEUE' else {}
+        fields = parse_fields(rest)
+        client = CLIENT_RE.search(rest) if (rest.startswith('client=') or rest.startswith(REJECT_MARKERS)) else None
+        status = fields.get('status')
+        if rest.startswith(REJECT_MARKERS):
+            status = 'rejected'
+        elif rest == 'removed':
+            status = 'removed'
+        recipient = ' '.join(filter(None, (fields.get('to'), fields.get('orig_to'))))
+        return LogEvent(
+            time=time,
+            source='postfix',
+            program=prog,
+            queue_id=qid if qid != 'NOQUEUE' else None,
+            message_id=entry.get('message_id'),
+            sender=fields.get('from', entry.get('sender')),
+            recipient=recipient or None,
+            client=client.group(1) if client else entry.get('client'),
+            status=status,
+            message=message,
+        )
+
+    def _dovecot(self, time, message):
+        match = DOVECOT_RE.match(message)
+        if not match:
+            return None
+        rest = match.group('rest')
+        fields = parse_fields(rest)
+        user = match.group('user') or fields.get('user')
+        if not (user or fields.get('msgid') or fields.get('rip')):
+            return None
+        if 'saved mail to' in rest:
+            status = 'saved'
+        elif 'auth failed' in rest or 'Authentication failed' in rest:
+            status = 'auth-failed'
+        elif rest.startswith('Login:'):
+            status = 'login'
+        elif rest.startswith('Disconnected'):
+            status = 'disconnected'
+        else:
+            status = None
+        return LogEvent(
+            time=time,
+            source='dovecot',
+            program=f"dovecot/{match.group('service')}",
+            queue_id=None,
+            message_id=fields.get('msgid'),
+            sender=None,
+            recipient=user,
+            client=fields.get('rip'),
+            status=status,
+            message=message,
+        )
+
+    def _rspamd(self, time, message):
+        fields = {key: value for key, value in RSPAMD_FIELD_RE.findall(message)}
+        action = RSPAMD_ACTION_RE.search(message)
+        recipients = ' '.join(strip_brackets(rcpt) for rcpt in fields.get('rcpts', '').split(',') if rcpt)
+        return LogEvent(
+            time=time,
+            source='rspamd',
+            program='rspamd',
+            queue_id=strip_brackets(fields.get('qid', '')) or None,
+            message_id=strip_brackets(fields.get('id', '')) or None,
+            sender=strip_brackets(fields.get('from', '')) or None,
+            recipient=recipients or None,
+            client=fields.get('ip') or None,
+            status=action.group('action') if action else None,
+            message=message,
+        )
+
+
+def fts_query(text):
+    """
+    FTS5 MATCH expression for a search box: every word must match. Words are
+    quoted as phrases, so "alice@example.com" or an IP match as written
+    rather than as FTS syntax; "field:value" restricts a word to a column
+    (see FIELD_ALIASES). Returns None when nothing searchable is left.
+    """
+    terms = []
+    for word in text.split():
+        field, sep, value = word.partition(':')
+        column = FIELD_ALIASES.get(field.lower()) if sep else None
+        if column:
+            word = value
+        if not re.search(r'\w', word):
+            continue
+        terms.append(f"{column} : {fts_phrase(word)}" if column else fts_phrase(word))
+    return ' AND '.join(terms) or None
+
+
+def fts_phrase(value):
+    return '"' + value.replace('"', '""') + '"'
+
+
+def any_of(pairs):
+    """FTS5 MATCH expression for events with any of the (column, value) pairs, or None."""
+    terms = [f"{column} : {fts_phrase(value)}" for column, value in pairs if re.search(r'\w', value)]
+    return ' OR '.join(terms) or None
+
+
+class LogIndex:
+    """
+    Day-partitioned FTS5 event store under directory.
+    add() buffers writes in one open transaction per day until commit().
+    """
+
+    def __init__(self, directory, retention_days=RETENTION_DAYS):
+        self.directory = directory
+        self.retention_days = retention_days
+        self.writers = {}
+
+    def path_for(self, day):
+        return os.path.join(self.directory, f"{day.isoformat()}.db")
+
+    def days(self):
+        """Days with a partition on disk, newest first."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        found = [datetime.date.fromisoformat(match.group(1)) for match in map(DAY_FILE_RE.match, names) if match]
+        return sorted(found, reverse=True)
+
+    def _writer(self, day):
+        conn = self.writers.get(day)
+        if conn is None:
+            os.makedirs(self.directory, exist_ok=True)
+            conn = sqlite3.connect(self.path_for(day))
+            # WAL: searches from the web workers never wait for the indexer
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(SCHEMA)
+            self.writers[day] = conn
+        return conn
+
+    def add(self, events):
+        """
+        Insert LogEvents, INSERT_BATCH rows at a time; events older than the
+        retention window are dropped. Returns: rows added.
+        """
+        oldest = datetime.datetime.utcnow().date() - datetime.timedelta(days=self.retention_days)
+        by_day = defaultdict(list)
+        pending = added = 0
+        for event in events:
+            day = event.time.date()
+            if day < oldest:
+                continue
+            by_day[day].append((event.time.isoformat(sep=' '), *event[1:]))
+            pending += 1
+            if pending >= INSERT_BATCH:
+                added += self._insert(by_day)
+                pending = 0
+        return added + self._insert(by_day)
+
+    def _insert(self, by_day):
+        added = 0
+        for day, rows in by_day.items():
+            self._writer(day).executemany(INSERT, rows)
+            added += len(rows)
+        by_day.clear()
+        return added
+
+    def commit(self):
+        for conn in self.writers.values():
+            conn.commit()
+
+    def close(self):
+        for conn in self.writers.values():
+            conn.commit()
+            conn.close()
+        self.writers = {}
+
+    def prune(self, today=None):
+        """Delete partitions older than retention_days. Returns: the days removed."""
+        today = today or datetime.datetime.utcnow().date()
+        cutoff = today - datetime.timedelta(days=self.retention_days)
+        removed = []
+        for day in self.days():
+            if day >= cutoff:
+                continue
+            conn = self.writers.pop(day, None)
+            if conn is not None:
+                conn.close()
+            path = self.path_for(day)
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.unlink(path + suffix)
+                except FileNotFoundError:
+                    pass
+            removed.append(day)
+        return removed
+
+    def clear(self):
+        """Drop every partition (ahead of a rebuild)."""
+        self.close()
+        for day in self.days():
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.unlink(self.path_for(day) + suffix)
+                except FileNotFoundError:
+                    pass
+
+    def search(self, text, days=RETENTION_DAYS, limit=SEARCH_LIMIT, today=None):
+        """
+        Newest-first events over the last `days` days matching text (see fts_query).
+        Returns: list of LogEvents with time as a naive UTC datetime.
+        Raises: sqlite3.Error for an unreadable partition.
+        """
+        return self.match(fts_query(text), days, limit, today)
+
+    def match(self, query, days=RETENTION_DAYS, limit=SEARCH_LIMIT, today=None):
+        """Like search(), for a ready FTS5 MATCH expression (None matches nothing)."""
+        if query is None:
+            return []
+        today = today or datetime.datetime.utcnow().date()
+        oldest = today - datetime.timedelta(days=days - 1)
+        found = []
+        for day in self.days():
+            if day < oldest or len(found) >= limit:
+                break
+            if day > today:
+                continue
+            conn = sqlite3.connect(f"file:{self.path_for(day)}?mode=ro", uri=True)
+            try:
+                rows = conn.execute(
+                    f"SELECT {COLUMNS} FROM events WHERE events MATCH ? ORDER BY rowid DESC LIMIT ?",
+                    (query, limit - len(found)),
+                ).fetchall()
+            finally:
+                conn.close()
+            # rowid follows indexing order, which interleaves sources; time order within the day
+            events = [LogEvent(datetime.datetime.fromisoformat(row[0]), *row[1:]) for row in rows]
+            found.extend(sorted(events, key=lambda event: event.time, reverse=True))
+        return found
+
+
+def load_checkpoints(path):
+    """Per-source positions saved by save_checkpoints(): {log path: {'inode', 'offset', 'pending'}}."""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_checkpoints(path, checkpoints):
+    """Atomically persist checkpoints (written after the index commit, so a crash repeats rather than loses lines)."""
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(checkpoints, f)
+    os.replace(tmp, path)
@@ -0,0 +1,189 @@
+"""
+Server-Sent Events log following for the system_logs page.
+
+A follower reads only what was appended after its cursor: (inode, offset)
+for log files, a journal cursor for the mail-admin journal. Each event
+carries the cursor as its id, so an EventSource that reconnects (with
+Last-Event-ID) resumes exactly where it left off. Streams end after
+STREAM_LIFETIME seconds and the browser reconnects; that keeps a stream
+from pinning a gunicorn thread indefinitely and bounds what a vanished
+client can hold.
+
+Back-pressure comes from the WSGI server: the generator only reads more
+once the previous event was written to the socket, and at most MAX_BATCH
+lines are read per event, so a slow client slows its own reading instead
+of growing a buffer. Concurrent streams are capped at MAX_STREAMS across
+all workers by cache slots: each is held under a token of its own and
+renewed every HEARTBEAT, so a slot expires soon after its worker dies and a
+stream can only ever release the claim it made.
+"""
+import os
+import secrets
+import time
+
+from django.core.cache import cache
+
+from .journal import JournalError, JournalReader, syslog_line
+from .logtail import LogCursor, LogWatcher
+
+MAX_STREAMS = 4
+STREAM_LIFETIME = 20
+HEARTBEAT = 5
+MAX_BATCH = 200
+RETRY_MS = 1000
+BUSY_RETRY_MS = 10000
+JOURNAL_POLL = 1.0
+
+SLOT_KEY = 'logstream:slot:{}'
+# Renewed every HEARTBEAT while the stream runs
+SLOT_TTL = 3 * HEARTBEAT
+
+
+class StreamSlot:
+    """A claim on one of the MAX_STREAMS slots, identified by a random token."""
+
+    def __init__(self, number, token):
+        self.number = number
+        self.key = SLOT_KEY.format(number)
+        self.token = token
+
+    def held(self):
+        return cache.get(self.key) == self.token
+
+    def refresh(self):
+        """Renew the claim. Returns: False if it lapsed and the slot may be someone else's."""
+        return self.held() and cache.touch(self.key, SLOT_TTL)
+
+    def release(self):
+        # Only our own claim; one that lapsed may already belong to another stream
+        if self.held():
+            cache.delete(self.key)
+
+
+def acquire_slot():
+    """Claim one of MAX_STREAMS stream slots. Returns: a StreamSlot or None."""
+    token = secrets.token_hex(8)
+    for number in range(MAX_STREAMS):
+        if cache.add(SLOT_KEY.format(number), token, SLOT_TTL):
+            return StreamSlot(number, token)
+    return None
+
+
+class FileFollower:
+    """Lines appended to a log file after cursor ("inode:offset"; default: the current end)."""
+
+    def __init__(self, path, cursor=None):
+        inode, _, offset = (cursor or '').partition(':')
+        st = os.stat(path)
+        if not (inode.isdigit() and offset.isdigit()):
+            inode, offset = st.st_ino, st.st_size
+        # Fail before the first event, not mid-stream, if the log is unreadable
+        open(path, 'rb').close()
+        self.log = LogCursor(path, int(inode), int(offset))
+        self.watcher = LogWatcher(path, poll_interval=1.0)
+
+    @property
+    def cursor(self):
+        return f"{self.log.inode}:{self.log.offset}"
+
+    def read(self, limit):
+        lines = []
+        for line in self.log.read_lines():
+            lines.append(line.rstrip('\r\n'))
+            if len(lines) >= limit:
+                break
+        return lines
+
+    def wait(self, timeout):
+        self.watcher.wait(timeout)
+
+    def close(self):
+        self.watcher.close()
+
+
+class JournalFollower:
+    """Journal entries of units after cursor (default: the newest entry)."""
+
+    def __init__(self, units, cursor=None, command=('/usr/bin/sudo', '/usr/bin/journalctl')):
+        self.units = tuple(units)
+        self.command = command
+        if not cursor:
+            newest = JournalReader(units=self.units, command=command).tail(1)
+            cursor = newest[0].cursor if newest else None
+        self.cursor = cursor
+
+    def read(self, limit):
+        reader = JournalReader(units=self.units, cursor=self.cursor, command=self.command)
+        lines = []
+        for entry in reader.entries():
+            lines.append(syslog_line(entry))
+            self.cursor = entry.cursor or self.cursor
+            if len(lines) >= limit:
+                break
+        return lines
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, JOURNAL_POLL))
+
+    def close(self):
+        pass
+
+
+def sse(event=None, data=(), event_id=None, retry=None):
+    """One SSE message; each item of data becomes a data: line."""
+    parts = []
+    if retry is not None:
+        parts.append(f"retry: {retry}")
+    if event_id is not None:
+        parts.append(f"id: {event_id}")
+    if event:
+        parts.append(f"event: {event}")
+    parts += [f"data: {line}" for line in data]
+    return "\n".join(parts) + "\n\n"
+
+
+def event_stream(open_follower, needle='', lifetime=STREAM_LIFETIME, slot=None, on_close=None):
+    """
+    Yield SSE messages: a 'lines' event per batch of new lines containing
+    needle (case-insensitive), a bare id when a batch had no matches (so a
+    reconnect skips it), and a comment every HEARTBEAT seconds when idle so
+    a gone client is noticed.
+
+    The follower comes from open_follower() once streaming starts, so
+    everything it holds is released (and on_close called) in one place when
+    the stream ends or the client disconnects. If the log cannot be read, a
+    'failure' event carries the reason. A StreamSlot is renewed every
+    HEARTBEAT and released at the end; the stream stops early if it lapsed.
+    """
+    needle = needle.lower()
+    follower = None
+    try:
+        follower = open_follower()
+        yield sse(retry=RETRY_MS)
+        deadline = time.monotonic() + lifetime
+        last_sent = last_renewed = time.monotonic()
+        while time.monotonic() < deadline:
+            if slot is not None and time.monotonic() - last_renewed >= HEARTBEAT:
+                if not slot.refresh():
+                    return
+                last_renewed = time.monotonic()
+            lines = follower.read(MAX_BATCH)
+            if lines:
+                matched = [line for line in lines if needle in line.lower()] if needle else lines
+                yield sse('lines' if matched else None, matched, event_id=follower.cursor)
+                last_sent = time.monotonic()
+                if len(lines) == MAX_BATCH:
+                    continue  # More is waiting
+            elif time.monotonic() - last_sent >= HEARTBEAT:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+            follower.wait(min(HEARTBEAT, max(0, deadline - time.monotonic())))
+    except (OSError, JournalError) as e:
+        yield sse('failure', [str(e)], retry=BUSY_RETRY_MS)
+    finally:
+        if follower is not None:
+            follower.close()
+        if slot is not None:
+            slot.release()
+        if on_close:
+            on_close()
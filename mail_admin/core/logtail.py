@@ -0,0 +1,245 @@
+"""
+Incremental log reading with rotation detection.
+
+A LogCursor remembers (inode, byte offset) for a log path so each run only
+reads bytes appended since the previous one. tail_lines() goes the other
+way: it reads backward from the end of the file for the newest lines.
+"""
+import ctypes
+import ctypes.util
+import glob
+import logging
+import os
+import re
+import select
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+ROTATED_SUFFIXES = ('.1', '.0')
+# Every rotated copy: mail.log.1, mail.log.2.gz, mail.log.3.zst, ...
+ROTATED_RE = re.compile(r'\.(\d+)(?:\.gz|\.zst)?$')
+
+BLOCK_SIZE = 1 << 16
+# tail_lines() gives up after this many bytes without finding enough matches
+SCAN_LIMIT = 512 << 20
+
+
+class LogCursor:
+    """
+    Reads complete lines appended to a log file since the last checkpoint.
+
+    inode/offset describe the position after the last consumed line. A
+    trailing line without a newline is left for the next read, so a line
+    being written while we read is never split.
+    """
+
+    def __init__(self, path, inode=None, offset=0):
+        self.path = path
+        self.inode = inode
+        self.offset = offset
+        self.bytes_read = 0
+
+    @property
+    def is_fresh(self):
+        """True when there was no previous checkpoint for this path."""
+        return self.inode is None
+
+    def find_rotated(self, inode):
+        """Return the rotated file that still carries our old inode, if any."""
+        for suffix in ROTATED_SUFFIXES:
+            candidate = self.path + suffix
+            try:
+                if os.stat(candidate).st_ino == inode:
+                    return candidate
+            except OSError:
+                continue
+        return None
+
+    def read_lines(self):
+        """
+        Yield new lines as text.
+        If the file was rotated since the checkpoint, the remainder of the
+        old file is yielded first, then the new file from the beginning.
+        """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+
+        if self.inode is not None and st.st_ino != self.inode:
+            rotated = self.find_rotated(self.inode)
+            if rotated:
+                # inode stays the old one while draining, so a checkpoint
+                # saved mid-way still points into the rotated file.
+                yield from self._read_from(rotated, final=True)
+            self.offset = 0
+        elif st.st_size < self.offset:
+            # Truncated in place (copytruncate): start over.
+            self.offset = 0
+
+        self.inode = st.st_ino
+        yield from self._read_from(self.path)
+
+    def _read_from(self, path, final=False):
+        with open(path, 'rb') as f:
+            f.seek(self.offset)
+            for raw in f:
+                # A rotated file gets no more writes, so its unterminated
+                # last line is complete; in the live file it may not be.
+                if not raw.endswith(b'\n') and not final:
+                    break
+                self.bytes_read += len(raw)
+                self.offset += len(raw)
+                yield raw.decode('utf-8', errors='replace')
+
+
+def rotated_logs(path):
+    """Rotated copies of path, oldest first (mail.log.7.gz ... mail.log.1)."""
+    found = []
+    for candidate in glob.glob(glob.escape(path) + '.*'):
+        match = ROTATED_RE.search(candidate[len(path):])
+        if match and candidate[len(path):] == match.group(0):
+            found.append((int(match.group(1)), candidate))
+    return [candidate for _, candidate in sorted(found, reverse=True)]
+
+
+class LogWatcher:
+    """
+    Blocks until a log file (or its rotation) changes.
+    Uses inotify on the containing directory when available, so rotation
+    (rename + create) wakes us too; otherwise falls back to polling.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, path, poll_interval=2.0):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.names = {os.path.basename(path).encode()} | {
+            (os.path.basename(path) + suffix).encode() for suffix in ROTATED_SUFFIXES
+        }
+        self.fd = None
+        try:
+            self.fd = self._inotify(os.path.dirname(path) or '.')
+        except (OSError, AttributeError) as e:
+            logger.info("inotify unavailable (%s); polling %s every %ss", e, path, poll_interval)
+
+    @property
+    def mode(self):
+        return 'inotify' if self.fd is not None else 'polling'
+
+    def _inotify(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_CREATE
+        if libc.inotify_add_watch(fd, directory.encode(), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, f"inotify_add_watch failed for {directory}")
+        return fd
+
+    def wait(self, timeout):
+        """Return True if our log changed within timeout seconds (always True when polling)."""
+        if self.fd is None:
+            time.sleep(min(timeout, self.poll_interval))
+            return True
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        return bool(ready) and self._drain()
+
+    def _drain(self):
+        """Read queued events; report whether any concerned our files."""
+        relevant = False
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return relevant
+            pos = 0
+            while pos + self.EVENT_HEADER.size <= len(buf):
+                _wd, _mask, _cookie, length = self.EVENT_HEADER.unpack_from(buf, pos)
+                pos += self.EVENT_HEADER.size
+                name = buf[pos:pos + length].rstrip(b'\0')
+                pos += length
+                if name in self.names:
+                    relevant = True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def complete_end(fd, size, block_size=BLOCK_SIZE):
+    """Offset just past the last newline before size (0 if there is none)."""
+    pos = size
+    while pos > 0:
+        start = max(0, pos - block_size)
+        newline = os.pread(fd, pos - start, start).rfind(b'\n')
+        if newline >= 0:
+            return start + newline + 1
+        pos = start
+    return 0
+
+
+def reverse_lines(fd, end, pattern=None, block_size=BLOCK_SIZE, max_bytes=None):
+    """
+    Yield the lines of fd before offset end (which follows a newline), newest
+    first, as bytes without the newline. Reads fixed-size blocks backward with
+    pread, so the cost depends on how far back we go, not on the file size.
+    With a compiled bytes pattern only matching lines are yielded, and a block
+    without a match anywhere is skipped without being split into lines.
+    """
+    stop = max(0, end - max_bytes) if max_bytes else 0
+    pos = max(stop, end - 1)  # Leave out the final newline
+    carry = b''
+    while pos > stop:
+        start = max(stop, pos - block_size)
+        block = os.pread(fd, pos - start, start) + carry
+        pos = start
+        if pattern is not None and not pattern.search(block):
+            # The first (possibly partial) line may still match once joined with what precedes it
+            newline = block.find(b'\n')
+            carry = block if newline < 0 else block[:newline]
+            continue
+        lines = block.split(b'\n')
+        carry = lines[0]
+        for line in reversed(lines[1:]):
+            if pattern is None or pattern.search(line):
+                yield line
+    # Past max_bytes the carry is a fragment of a longer line
+    if pos == 0 and end > 0 and (pattern is None or pattern.search(carry)):
+        yield carry
+
+
+def tail_lines(path, count, needle='', max_bytes=SCAN_LIMIT, block_size=BLOCK_SIZE):
+    """
+    The last count complete lines of path containing needle (case-insensitive;
+    every line when empty), oldest first. Lines older than max_bytes from the
+    end are not searched.
+    Returns: (lines, (inode, end)); end is the offset after the newest
+    complete line, where a LogCursor picks up from.
+    """
+    pattern = re.compile(re.escape(needle.encode()), re.IGNORECASE) if needle else None
+    fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        st = os.fstat(fd)
+        end = complete_end(fd, st.st_size, block_size)
+        lines = []
+        if count > 0:
+            for raw in reverse_lines(fd, end, pattern, block_size, max_bytes):
+                lines.append(raw.decode('utf-8', errors='replace'))
+                if len(lines) >= count:
+                    break
+    finally:
+        os.close(fd)
+    lines.reverse()
+    return lines, (st.st_ino, end)
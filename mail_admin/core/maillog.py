@@ -0,0 +1,514 @@
+"""
+Streaming Postfix mail.log parsing.
+
+Plain Python (no Django imports) so it can be shared by mail_monitor.py
+and the web views.
+"""
+import datetime
+import gzip
+import io
+import re
+import subprocess
+from collections import OrderedDict, defaultdict, namedtuple
+
+from .sketch import SpaceSaving
+
+# Syslog prefix: traditional "Jan 28 07:18:01" or RFC 3339 timestamps,
+# then host, then program[pid].
+LINE_RE = re.compile(
+    r'^(?P<ts>[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d|\d{4}-\d\d-\d\dT\S+) '
+    r'(?P<host>\S+) (?P<prog>[^\s\[:]+)(?:\[(?P<pid>\d+)\])?: (?P<msg>.*)$'
+)
+# Short (hex) and long (base-52) Postfix queue IDs, plus NOQUEUE.
+QUEUE_RE = re.compile(r'^(?P<qid>NOQUEUE|[0-9A-F]{6,12}|[0-9B-DF-HJ-NP-TV-Zb-df-hj-np-tv-z]{10,20}): (?P<rest>.*)$')
+# key=value pairs; values are either <bracketed> or run to the next comma/space.
+FIELD_RE = re.compile(r'([a-z_-]+)=(<[^>]*>|[^,\s;]+)')
+CLIENT_RE = re.compile(r'\[([0-9a-fA-F:.]+)\]')
+
+MONTHS = {name: number for number, name in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), start=1)}
+
+DELIVERY_AGENTS = frozenset(('smtp', 'lmtp', 'virtual', 'local', 'pipe', 'error', 'discard', 'relay'))
+REJECT_MARKERS = ('reject:', 'milter-reject:')
+
+# Counter columns of the traffic_hourly / traffic_daily rollup tables.
+ROLLUP_COLUMNS = ('sent', 'received', 'bounced', 'deferred', 'rejected')
+SENT, RECEIVED, BOUNCED, DEFERRED, REJECTED = range(len(ROLLUP_COLUMNS))
+STATUS_COLUMNS = {'bounced': BOUNCED, 'expired': BOUNCED, 'deferred': DEFERRED, 'rejected': REJECTED}
+
+# Heavy-hitter sketches kept per domain (see DomainAggregator.add_event)
+SKETCHES = ('senders', 'recipients', 'relays', 'clients')
+SKETCH_CAPACITY = 64
+
+DeliveryEvent = namedtuple('DeliveryEvent', [
+    'time', 'queue_id', 'sender', 'recipient', 'orig_recipient', 'status',
+    'dsn', 'relay', 'delay', 'size', 'client', 'message_id', 'agent',
+])
+DeliveryEvent.__doc__ = "One recipient outcome (sent, deferred, bounced, rejected, ...) for one message."
+
+
+def strip_brackets(value):
+    if value and value[0] == '<' and value[-1] == '>':
+        return value[1:-1]
+    return value
+
+
+def relay_host(relay):
+    """'mx.example.net[192.0.2.1]:25' -> 'mx.example.net'; None for local/none relays."""
+    if not relay:
+        return None
+    host = relay.split('[', 1)[0]
+    if not host or host == 'none' or host.startswith('private/'):
+        return None
+    return host.lower()
+
+
+def parse_fields(text):
+    """Return the key=value pairs of a Postfix log message as a dict (brackets removed)."""
+    return {key: strip_brackets(value) for key, value in FIELD_RE.findall(text)}
+
+
+class TimestampParser:
+    """
+    Converts syslog timestamps to naive UTC datetimes.
+    Traditional syslog stamps carry no year or zone: they are read as server
+    local time in the year that puts them closest to (and not after) now.
+    Consecutive lines usually share a stamp, so the last result is memoised.
+    """
+
+    def __init__(self, now=None):
+        self.now = now or datetime.datetime.now()
+        self._last = (None, None)
+
+    def __call__(self, stamp):
+        if stamp == self._last[0]:
+            return self._last[1]
+        if stamp[0].isdigit():
+            value = datetime.datetime.fromisoformat(stamp)
+            if value.tzinfo is None:
+                value = value.astimezone()
+        else:
+            # Hand-rolled: strptime dominates the profile on busy logs.
+            value = datetime.datetime(
+                self.now.year, MONTHS[stamp[:3]], int(stamp[4:6]),
+                int(stamp[7:9]), int(stamp[10:12]), int(stamp[13:15]),
+            )
+            if value > self.now + datetime.timedelta(days=1):
+                value = value.replace(year=value.year - 1)
+            value = value.astimezone()
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        self._last = (stamp, value)
+        return value
+
+
+class QueueCorrelator:
+    """
+    Joins Postfix log lines by queue ID and emits one DeliveryEvent per recipient.
+
+    smtpd/pickup/cleanup/qmgr lines fill in client, message-id, sender and
+    size for a queue ID; each smtp/lmtp/virtual/local status line then emits
+    an event carrying all of it. NOQUEUE and milter rejects emit 'rejected'
+    events directly.
+
+    Pending queue IDs live in an LRU bounded by max_entries, and entries not
+    touched for ttl seconds of log time are dropped, so messages that never
+    complete (lost lines, rotation gaps) cannot grow memory without bound.
+    """
+
+    SWEEP_EVERY = 10000
+
+    def __init__(self, max_entries=50000, ttl=3 * 86400, now=None):
+        self.max_entries = max_entries
+        self.ttl = datetime.timedelta(seconds=ttl)
+        self.pending = OrderedDict()
+        self.parse_time = TimestampParser(now)
+        self.lines = 0
+        # Only queue-ID lines count towards SWEEP_EVERY; most of mail.log is not postfix
+        self.queue_lines = 0
+        self.evicted = 0
+        self.expired = 0
+        self._clock = None
+
+    def feed(self, line):
+        """Consume one log line. Returns a (possibly empty) list of DeliveryEvents."""
+        self.lines += 1
+        # Dovecot, rspamd, kernel, cron... never carry a queue ID.
+        if 'postfix' not in line:
+            return []
+        match = LINE_RE.match(line.rstrip('\n'))
+        if not match:
+            return []
+        prog = match.group('prog')
+        if not prog.startswith('postfix'):
+            return []
+        queued = QUEUE_RE.match(match.group('msg'))
+        if not queued:
+            return []
+        return self._queued(self.parse_time(match.group('ts')), prog, queued)
+
+    def feed_record(self, time, prog, message):
+        """
+        Consume one structured record, e.g. a journal entry: naive UTC time,
+        program as in syslog ('postfix/smtp') and the bare message.
+        """
+        self.lines += 1
+        if not prog.startswith('postfix'):
+            return []
+        queued = QUEUE_RE.match(message)
+        if not queued:
+            return []
+        return self._queued(time, prog, queued)
+
+    def _queued(self, now, prog, queued):
+        self._clock = now
+        self.queue_lines += 1
+        if self.queue_lines % self.SWEEP_EVERY == 0:
+            self.sweep(now)
+
+        agent = prog.rpartition('/')[2]
+        qid, rest = queued.group('qid'), queued.group('rest')
+        if qid == 'NOQUEUE':
+            return self._reject(now, None, agent, rest, {}) if rest.startswith(REJECT_MARKERS) else []
+
+        entry = self._touch(qid, now)
+        if agent in DELIVERY_AGENTS and 'status=' in rest:
+            return [self._delivery(now, qid, agent, rest, entry)]
+        if rest.startswith(REJECT_MARKERS):
+            events = self._reject(now, qid, agent, rest, entry)
+            self.pending.pop(qid, None)
+            return events
+
+        if rest == 'removed':
+            self.pending.pop(qid, None)
+        elif agent == 'qmgr' and rest.startswith('from='):
+            fields = parse_fields(rest)
+            entry['sender'] = fields.get('from', '')
+            entry['size'] = int(fields['size']) if fields.get('size', '').isdigit() else None
+        elif agent == 'cleanup' and rest.startswith('message-id='):
+            entry['message_id'] = strip_brackets(rest[len('message-id='):].strip())
+        elif agent == 'smtpd' and rest.startswith('client='):
+            client = CLIENT_RE.search(rest)
+            entry['client'] = client.group(1) if client else None
+        elif agent == 'pickup':
+            entry['client'] = 'local'
+        return []
+
+    def feed_lines(self, lines):
+        """Yield DeliveryEvents for an iterable of lines."""
+        for line in lines:
+            yield from self.feed(line)
+
+    def _touch(self, qid, now):
+        entry = self.pending.get(qid)
+        if entry is None:
+            entry = {'seen': now}
+            self.pending[qid] = entry
+            if len(self.pending) > self.max_entries:
+                self.pending.popitem(last=False)
+                self.evicted += 1
+        else:
+            entry['seen'] = now
+            self.pending.move_to_end(qid)
+        return entry
+
+    def _delivery(self, now, qid, agent, rest, entry):
+        fields = parse_fields(rest)
+        delay = fields.get('delay')
+        return DeliveryEvent(
+            time=now,
+            queue_id=qid,
+            sender=entry.get('sender'),
+            recipient=fields.get('to'),
+            orig_recipient=fields.get('orig_to'),
+            status=fields.get('status'),
+            dsn=fields.get('dsn'),
+            relay=fields.get('relay'),
+            delay=float(delay) if delay else None,
+            size=entry.get('size'),
+            client=entry.get('client'),
+            message_id=entry.get('message_id'),
+            agent=agent,
+        )
+
+    def _reject(self, now, qid, agent, rest, entry):
+        fields = parse_fields(rest)
+        client = CLIENT_RE.search(rest)
+        return [DeliveryEvent(
+            time=now,
+            queue_id=qid,
+            sender=fields.get('from', entry.get('sender')),
+            recipient=fields.get('to'),
+            orig_recipient=None,
+            status='rejected',
+            dsn=None,
+            relay=None,
+            delay=None,
+            size=entry.get('size'),
+            client=client.group(1) if client else entry.get('client'),
+            message_id=entry.get('message_id'),
+            agent=agent,
+        )]
+
+    def sweep(self, now=None):
+        """Drop queue IDs not seen for ttl (log time). Oldest entries sit at the front."""
+        now = now or self._clock
+        if now is None:
+            return
+        cutoff = now - self.ttl
+        while self.pending:
+            qid, entry = next(iter(self.pending.items()))
+            if entry['seen'] >= cutoff:
+                break
+            del self.pending[qid]
+            self.expired += 1
+
+    def export_state(self):
+        """Pending queue IDs as JSON-safe data, so the next run can finish joining them."""
+        state = []
+        for qid, entry in self.pending.items():
+            item = dict(entry, qid=qid)
+            item['seen'] = entry['seen'].isoformat()
+            state.append(item)
+        return state
+
+    def import_state(self, state):
+        for item in state or []:
+            item = dict(item)
+            qid = item.pop('qid')
+            item['seen'] = datetime.datetime.fromisoformat(item['seen'])
+            self.pending[qid] = item
+        while len(self.pending) > self.max_entries:
+            self.pending.popitem(last=False)
+
+
+class DomainTable:
+    """
+    Precompiled domain lookup table.
+    Maps lower-cased domain names to a slot index so per-domain counters
+    can live in flat lists instead of dicts of dicts.
+    """
+
+    def __init__(self, names):
+        self.names = sorted({name.lower() for name in names})
+        self.index = {name: slot for slot, name in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def lookup(self, address):
+        """Return the slot for the domain part of an address, or None."""
+        if not address:
+            return None
+        at = address.rfind('@')
+        if at < 0:
+            return None
+        return self.index.get(address[at + 1:].lower())
+
+
+class DomainAggregator:
+    """
+    Single-pass sent/received/heavy-hitter counter for all domains at once.
+
+    Lines go through a QueueCorrelator, so a delivery is attributed to the
+    sender's domain via the qmgr from= line that shares its queue ID.
+    A delivery counts as sent for the sender's domain and as received for
+    the (original, pre-alias) recipient's domain when its status is sent.
+
+    Alongside the run totals it keeps hourly rollup buckets (see
+    ROLLUP_COLUMNS): one row per domain with mailbox '' and, when
+    per_mailbox is set, one row per local mailbox. Bounced, deferred and
+    rejected outcomes count once for each local domain involved.
+    """
+
+    def __init__(self, domains, correlator=None, per_mailbox=True):
+        self.table = DomainTable(domains)
+        self.correlator = correlator or QueueCorrelator()
+        self.per_mailbox = per_mailbox
+        size = len(self.table)
+        self.sent = [0] * size
+        self.received = [0] * size
+        self.sketches = [None] * size
+        self.buckets = defaultdict(lambda: [0] * len(ROLLUP_COLUMNS))
+        self.events = 0
+
+    @property
+    def lines(self):
+        return self.correlator.lines
+
+    def feed(self, line):
+        for event in self.correlator.feed(line):
+            self.add_event(event)
+
+    def feed_lines(self, lines):
+        for line in lines:
+            self.feed(line)
+        return self
+
+    def feed_entries(self, entries):
+        """Like feed_lines, for structured records such as core.journal.JournalEntry."""
+        feed_record = self.correlator.feed_record
+        for entry in entries:
+            for event in feed_record(entry.time, entry.identifier, entry.message):
+                self.add_event(event)
+        return self
+
+    def add_event(self, event):
+        self.events += 1
+        lookup = self.table.lookup
+        delivered = event.status == 'sent'
+        recipient = event.orig_recipient or event.recipient
+        sender_slot = lookup(event.sender)
+        recipient_slot = lookup(recipient)
+        hour = event.time.replace(minute=0, second=0, microsecond=0)
+
+        # Heavy hitters, whatever the outcome: the domain's senders and the
+        # remote relays they use; its recipients and the clients sending to them.
+        if sender_slot is not None:
+            self._count(sender_slot, 'senders', event.sender.lower())
+            if event.agent == 'smtp':
+                host = relay_host(event.relay)
+                if host:
+                    self._count(sender_slot, 'relays', host)
+        if recipient_slot is not None:
+            self._count(recipient_slot, 'recipients', recipient.lower())
+            if event.client and event.client != 'local':
+                self._count(recipient_slot, 'clients', event.client)
+
+        if delivered:
+            if sender_slot is not None:
+                self.sent[sender_slot] += 1
+                self._bump(sender_slot, event.sender, hour, SENT)
+            if recipient_slot is not None:
+                self.received[recipient_slot] += 1
+                self._bump(recipient_slot, recipient, hour, RECEIVED)
+            return
+
+        column = STATUS_COLUMNS.get(event.status)
+        if column is None:
+            return
+        if sender_slot is not None:
+            self._bump(sender_slot, event.sender, hour, column)
+        if recipient_slot is not None and recipient_slot != sender_slot:
+            self._bump(recipient_slot, recipient, hour, column)
+
+    def _count(self, slot, name, item):
+        sketches = self.sketches[slot]
+        if sketches is None:
+            sketches = self.sketches[slot] = {}
+        sketch = sketches.get(name)
+        if sketch is None:
+            sketch = sketches[name] = SpaceSaving(SKETCH_CAPACITY)
+        sketch.add(item)
+
+    def _bump(self, slot, address, hour, column):
+        self.buckets[(slot, '', hour)][column] += 1
+        if self.per_mailbox:
+            self.buckets[(slot, address.lower(), hour)][column] += 1
+
+    def rollup_rows(self):
+        """
+        Returns: list of (domain_name, mailbox, bucket, sent, received, bounced, deferred, rejected)
+        tuples for the hourly rollup table, sorted for deterministic writes.
+        """
+        names = self.table.names
+        rows = [
+            (names[slot], mailbox, hour, *counts)
+            for (slot, mailbox, hour), counts in self.buckets.items()
+        ]
+        rows.sort(key=lambda row: row[:3])
+        return rows
+
+    def export_counts(self):
+        """
+        Picklable per-domain totals (not the rollup buckets), for merging
+        partial aggregates built in other processes with merge_counts().
+        """
+        return {
+            'names': list(self.table.names),
+            'sent': self.sent,
+            'received': self.received,
+            'sketches': self.sketches,
+            'events': self.events,
+        }
+
+    def merge_counts(self, counts):
+        """Add totals from another aggregator's export_counts() over the same domains."""
+        if counts['names'] != self.table.names:
+            raise ValueError("merge_counts needs aggregators built from the same domain list")
+        for slot in range(len(self.sent)):
+            self.sent[slot] += counts['sent'][slot]
+            self.received[slot] += counts['received'][slot]
+            for name, sketch in (counts['sketches'][slot] or {}).items():
+                if self.sketches[slot] is None:
+                    self.sketches[slot] = {}
+                mine = self.sketches[slot].get(name)
+                if mine is None:
+                    self.sketches[slot][name] = mine = SpaceSaving(SKETCH_CAPACITY)
+                mine.merge(sketch)
+        self.events += counts['events']
+
+    def active_domains(self):
+        """Lower-cased names of the domains at least one event was counted for."""
+        return {name for slot, name in enumerate(self.table.names) if self.sketches[slot]}
+
+    def results(self, top_n=5):
+        """
+        Returns: dict of domain name -> {'sent', 'received', 'top_sender', 'top_senders', 'sketches'}.
+        top_senders is a list of {'count', 'email'} dicts, highest first;
+        sketches maps each SKETCHES name seen for the domain to its SpaceSaving,
+        for merging into stored totals.
+        """
+        stats = {}
+        for slot, name in enumerate(self.table.names):
+            sketches = self.sketches[slot] or {}
+            senders = sketches.get('senders')
+            top_senders = [
+                {'count': count, 'email': email}
+                for email, count, _error in (senders.top(top_n) if senders else [])
+            ]
+            stats[name] = {
+                'sent': self.sent[slot],
+                'received': self.received[slot],
+                'top_sender': top_senders[0]['email'] if top_senders else "N/A",
+                'top_senders': top_senders,
+                'sketches': sketches,
+            }
+        return stats
+
+
+def open_log(path):
+    """
+    Open a log file for line iteration, tolerating non-UTF-8 bytes.
+    Rotated .gz and .zst files are decompressed as a stream, never in full.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    if path.endswith('.zst'):
+        return _open_zstd(path)
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+
+def _open_zstd(path):
+    """Use the zstandard module when installed, else stream through the zstd binary."""
+    try:
+        import zstandard
+    except ImportError:
+        proc = subprocess.Popen(['zstd', '-dcq', '--', path], stdout=subprocess.PIPE)
+        return _PipeLog(proc)
+    raw = open(path, 'rb')
+    stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+    return io.TextIOWrapper(stream, encoding='utf-8', errors='replace')
+
+
+class _PipeLog(io.TextIOWrapper):
+    """Text stream over a decompressor's stdout; closing it reaps the process."""
+
+    def __init__(self, proc):
+        super().__init__(proc.stdout, encoding='utf-8', errors='replace')
+        self.proc = proc
+
+    def close(self):
+        super().close()
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
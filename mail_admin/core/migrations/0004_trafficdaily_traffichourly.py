@@ -0,0 +1,49 @@
+# Generated by Django 6.0.1 on 2026-10-17 15:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_domainassignment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrafficDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('domain_name', models.CharField(max_length=255)),
+                ('mailbox', models.CharField(blank=True, default='', max_length=255)),
+                ('sent', models.IntegerField(default=0)),
+                ('received', models.IntegerField(default=0)),
+                ('bounced', models.IntegerField(default=0)),
+                ('deferred', models.IntegerField(default=0)),
+                ('rejected', models.IntegerField(default=0)),
+                ('day', models.DateField()),
+            ],
+            options={
+                'db_table': 'traffic_daily',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='TrafficHourly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('domain_name', models.CharField(max_length=255)),
+                ('mailbox', models.CharField(blank=True, default='', max_length=255)),
+                ('sent', models.IntegerField(default=0)),
+                ('received', models.IntegerField(default=0)),
+                ('bounced', models.IntegerField(default=0)),
+                ('deferred', models.IntegerField(default=0)),
+                ('rejected', models.IntegerField(default=0)),
+                ('bucket', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'traffic_hourly',
+                'managed': False,
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 6.0.1 on 2026-10-17 16:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_trafficdaily_traffichourly'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DomainUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('domain_name', models.CharField(max_length=255, unique=True)),
+                ('mailboxes', models.IntegerField(default=0)),
+                ('aliases', models.IntegerField(default=0)),
+                ('platform_aliases', models.IntegerField(default=0)),
+                ('quota_kb', models.BigIntegerField(default=0)),
+                ('version', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'domain_usage',
+                'managed': False,
+            },
+        ),
+    ]
@@ -94,12 +94,89 @@ class DomainStats(models.Model):
         db_table = 'domain_stats'
         app_label = 'core'
 
+class DomainUsage(models.Model):
+    """
+    Per-domain counters, adjusted in the same transaction as the platform's
+    own user/alias writes (core.usage) and reconciled by mail_monitor.
+    version changes whenever any counter does.
+    """
+    domain_name = models.CharField(max_length=255, unique=True)
+    mailboxes = models.IntegerField(default=0)
+    aliases = models.IntegerField(default=0)
+    platform_aliases = models.IntegerField(default=0)
+    quota_kb = models.BigIntegerField(default=0)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        managed = False
+        db_table = 'domain_usage'
+        app_label = 'core'
+
+class TrafficRollup(models.Model):
+    """
+    Traffic counters for one time bucket, written by mail_monitor.
+    mailbox is '' for the domain total, otherwise a local address.
+    """
+    domain_name = models.CharField(max_length=255)
+    mailbox = models.CharField(max_length=255, blank=True, default='')
+    sent = models.IntegerField(default=0)
+    received = models.IntegerField(default=0)
+    bounced = models.IntegerField(default=0)
+    deferred = models.IntegerField(default=0)
+    rejected = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+class TrafficHourly(TrafficRollup):
+    bucket = models.DateTimeField()
+
+    class Meta:
+        managed = False
+        db_table = 'traffic_hourly'
+        app_label = 'core'
+        unique_together = ('domain_name', 'mailbox', 'bucket')
+
+class TrafficDaily(TrafficRollup):
+    day = models.DateField()
+
+    class Meta:
+        managed = False
+        db_table = 'traffic_daily'
+        app_label = 'core'
+        unique_together = ('domain_name', 'mailbox', 'day')
+
 class ServerHealth(models.Model):
     cpu_usage = models.FloatField()
     ram_usage = models.FloatField()
     disk_usage = models.FloatField()
     uptime = models.CharField(max_length=50)
     updated_at = models.DateTimeField(auto_now=True)
+
+    # Summary of the samples taken over period_seconds (see core.health.HealthSampler)
+    sample_count = models.IntegerField(null=True)
+    period_seconds = models.IntegerField(null=True)
+    cpu_min = models.FloatField(null=True)
+    cpu_avg = models.FloatField(null=True)
+    cpu_max = models.FloatField(null=True)
+    cpu_p95 = models.FloatField(null=True)
+    ram_min = models.FloatField(null=True)
+    ram_avg = models.FloatField(null=True)
+    ram_max = models.FloatField(null=True)
+    ram_p95 = models.FloatField(null=True)
+    disk_min = models.FloatField(null=True)
+    disk_avg = models.FloatField(null=True)
+    disk_max = models.FloatField(null=True)
+    disk_p95 = models.FloatField(null=True)
+    load_min = models.FloatField(null=True)
+    load_avg = models.FloatField(null=True)
+    load_max = models.FloatField(null=True)
+    load_p95 = models.FloatField(null=True)
+    iowait_min = models.FloatField(null=True)
+    iowait_avg = models.FloatField(null=True)
+    iowait_max = models.FloatField(null=True)
+    iowait_p95 = models.FloatField(null=True)
     
     class Meta:
         managed = False
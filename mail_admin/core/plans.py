@@ -0,0 +1,80 @@
+"""
+Cached MailPlan catalog.
+
+Every plan plus the domain -> plan allocations, loaded in two queries and
+kept both in this process and in the shared cache under a version key.
+Resolving a domain's plan then costs one cache read (the version check) and
+no queries. Changes go through invalidate_plan_catalog(), called from the
+MailPlan/DomainAllocation signal handlers and after queryset updates.
+
+The version key expires after VERSION_TIMEOUT, so a process whose cache is
+not shared (LocMemCache, no REDIS_URL) still picks up changes made in
+another process within that time.
+"""
+import time
+
+from django.core.cache import cache
+
+from .models import DomainAllocation, MailPlan
+
+VERSION_KEY = 'plans:version'
+FALLBACK_PLAN = "Standard"
+# How stale another process's catalog can be when the cache is not shared
+VERSION_TIMEOUT = 60
+# Old versions are never read again; this only bounds how long they linger
+CATALOG_TIMEOUT = 24 * 3600
+
+# (version, PlanCatalog) for this process
+_local = None
+
+
+class PlanCatalog:
+    def __init__(self, plans, allocations):
+        self.plans = list(plans)
+        self.by_id = {plan.id: plan for plan in self.plans}
+        self.allocations = dict(allocations)  # domain name -> plan id
+        self.fallback = next((plan for plan in self.plans if plan.name == FALLBACK_PLAN), None)
+
+    def plan_for(self, domain_name):
+        """The allocated MailPlan, else the Standard plan, else None."""
+        plan_id = self.allocations.get(domain_name)
+        return self.by_id[plan_id] if plan_id in self.by_id else self.fallback
+
+    def plans_for(self, domain_names):
+        """Returns: dict of domain name -> MailPlan (or None)."""
+        return {name: self.plan_for(name) for name in domain_names}
+
+
+def build_catalog():
+    return PlanCatalog(
+        MailPlan.objects.order_by('id'),
+        DomainAllocation.objects.values_list('domain_name', 'plan_id'),
+    )
+
+
+def current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = invalidate_plan_catalog()
+    return version
+
+
+def invalidate_plan_catalog():
+    """Drop the catalog in every process. Returns the new version."""
+    version = time.time_ns()
+    cache.set(VERSION_KEY, version, VERSION_TIMEOUT)
+    return version
+
+
+def get_plan_catalog():
+    global _local
+    version = current_version()
+    if _local is not None and _local[0] == version:
+        return _local[1]
+    key = f"plans:catalog:{version}"
+    catalog = cache.get(key)
+    if catalog is None:
+        catalog = build_catalog()
+        cache.set(key, catalog, CATALOG_TIMEOUT)
+    _local = (version, catalog)
+    return catalog
@@ -0,0 +1,196 @@
+"""
+Maildir provisioning through a privileged helper on a Unix socket.
+
+The web app runs unprivileged, so it used to shell out to `sudo mkdir -p`
+and `sudo chown -R vmail:vmail /var/vmail/<domain>`, walking every message
+of every mailbox in the domain for each new user. provisiond.py runs as
+root instead and creates <base>/<domain>/<user>/{cur,new,tmp} owned by
+vmail, touching only those directories.
+
+Requests are JSON lines, {"maildirs": [["example.com", "alice"], ...]},
+answered with {"created": ["alice@example.com"], "errors": {...}}; a
+maildir that already exists is neither created nor an error. Requests
+from concurrent clients queue up for a single worker, which handles
+everything queued in one pass (a maildir asked for twice in a batch is
+made once).
+
+Plain Python (no Django imports), shared by provisiond.py, the views and
+the migration scripts.
+"""
+import json
+import os
+import pwd
+import queue
+import re
+import socket
+import socketserver
+import stat
+import threading
+from concurrent.futures import Future
+
+VMAIL_BASE = '/var/vmail'
+SOCKET_PATH = '/run/mail-admin/provision.sock'
+OWNER = 'vmail'
+MAILDIR_SUBDIRS = ('cur', 'new', 'tmp')
+# Same character set add_user accepts for usernames; domains add nothing else
+NAME_RE = re.compile(r'^[a-zA-Z0-9_-][a-zA-Z0-9._-]*$')
+MAX_BATCH = 1000
+TIMEOUT = 10
+
+
+class ProvisionError(Exception):
+    pass
+
+
+def maildir_path(base, domain, user):
+    """Raises: ProvisionError for names that could leave base."""
+    for name in (domain, user):
+        if not isinstance(name, str) or not NAME_RE.match(name) or '..' in name:
+            raise ProvisionError(f"invalid maildir name {name!r}")
+    return os.path.join(base, domain, user)
+
+
+def ensure_dir(path, uid, gid):
+    """
+    mkdir path (0700) owned by uid:gid, or fix the owner of an existing one.
+    Never follows a symlink. Returns: True when the directory was created.
+    """
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        st = os.lstat(path)
+        if not stat.S_ISDIR(st.st_mode):
+            raise ProvisionError(f"{path} exists and is not a directory")
+        if (st.st_uid, st.st_gid) != (uid, gid):
+            os.lchown(path, uid, gid)
+        return False
+    os.lchown(path, uid, gid)
+    return True
+
+
+def make_maildir(base, domain, user, uid, gid):
+    """Create base/domain/user/{cur,new,tmp}. Returns: True when anything was created."""
+    path = maildir_path(base, domain, user)
+    created = False
+    for directory in (os.path.dirname(path), path, *(os.path.join(path, sub) for sub in MAILDIR_SUBDIRS)):
+        created = ensure_dir(directory, uid, gid) or created
+    return created
+
+
+def provision(base, maildirs, uid, gid, done=None):
+    """
+    make_maildir() for each (domain, user) pair. done caches outcomes by
+    address across the requests of one batch.
+    Returns: the reply dict ('created', 'errors').
+    """
+    done = {} if done is None else done
+    reply = {'created': [], 'errors': {}}
+    for domain, user in maildirs:
+        address = f"{user}@{domain}"
+        if address not in done:
+            try:
+                done[address] = make_maildir(base, domain, user, uid, gid)
+            except (ProvisionError, OSError) as e:
+                done[address] = e
+        outcome = done[address]
+        if isinstance(outcome, Exception):
+            reply['errors'][address] = str(outcome)
+        elif outcome:
+            reply['created'].append(address)
+    return reply
+
+
+class Provisioner:
+    """One worker thread creating queued maildirs, a batch at a time."""
+
+    def __init__(self, base=VMAIL_BASE, owner=OWNER):
+        account = pwd.getpwnam(owner)
+        self.base = base
+        self.uid, self.gid = account.pw_uid, account.pw_gid
+        self.queue = queue.Queue()
+        self.batches = 0
+        threading.Thread(target=self._run, name='provisioner', daemon=True).start()
+
+    def submit(self, maildirs):
+        """Queue (domain, user) pairs. Returns: a Future for the reply dict."""
+        future = Future()
+        self.queue.put((maildirs, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.batches += 1
+            done = {}
+            for maildirs, future in batch:
+                future.set_result(provision(self.base, maildirs, self.uid, self.gid, done))
+
+
+class ProvisionHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                maildirs = [(str(domain), str(user)) for domain, user in request['maildirs']]
+            except (ValueError, KeyError, TypeError) as e:
+                reply = {'created': [], 'errors': {'request': f"malformed request: {e}"}}
+            else:
+                reply = self.server.provisioner.submit(maildirs).result()
+            self.wfile.write(json.dumps(reply).encode() + b'\n')
+
+
+class ProvisionServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, provisioner, group=None):
+        """Listen on socket_path (mode 0660, group-owned by group when given)."""
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, ProvisionHandler)
+        self.provisioner = provisioner
+        os.chmod(socket_path, 0o660)
+        if group is not None:
+            os.chown(socket_path, -1, group)
+
+
+def request_maildirs(maildirs, socket_path=SOCKET_PATH, timeout=TIMEOUT):
+    """
+    Ask provisiond to create maildirs for (domain, user) pairs, in one request.
+    Returns: the reply dict ('created', 'errors').
+    Raises: ProvisionError when the service cannot be reached or does not
+    answer with a JSON reply.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            sock.sendall(json.dumps({'maildirs': [list(pair) for pair in maildirs]}).encode() + b'\n')
+            with sock.makefile('rb') as replies:
+                reply = replies.readline()
+    except OSError as e:
+        raise ProvisionError(f"provisioning service unavailable at {socket_path}: {e}") from e
+    if not reply:
+        raise ProvisionError("provisioning service closed the connection without replying")
+    try:
+        return json.loads(reply)
+    except ValueError as e:
+        raise ProvisionError(f"malformed reply from provisioning service: {e}") from e
+
+
+def create_maildirs(maildirs, socket_path=SOCKET_PATH, base=VMAIL_BASE, owner=OWNER):
+    """
+    For scripts: request_maildirs(), or when no service is listening and we
+    are root, the same work in-process.
+    """
+    try:
+        return request_maildirs(maildirs, socket_path)
+    except ProvisionError:
+        if os.geteuid() != 0:
+            raise
+    account = pwd.getpwnam(owner)
+    return provision(base, maildirs, account.pw_uid, account.pw_gid)
@@ -0,0 +1,160 @@
+"""
+Cached systemd service status for the server health page.
+
+A background thread asks systemd about every unit in SERVICES with a single
+`systemctl show` and stores the result in the cache; views only read that
+cache, so no request ever waits on (or forks) systemctl. With several
+gunicorn workers, a short cache lock lets one of them probe per interval.
+The thread starts on the first read and stops after IDLE_TIMEOUT seconds
+without one, so nothing is probed while nobody is looking.
+"""
+import datetime
+import logging
+import subprocess
+import threading
+import time
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# (display name, systemd unit)
+SERVICES = (
+    ('Postfix (MTA)', 'postfix'),
+    ('Dovecot (IMAP/POP)', 'dovecot'),
+    ('MariaDB (Database)', 'mariadb'),
+    ('Nginx (Web Server)', 'nginx'),
+    ('Mail Admin (Gunicorn)', 'mail-admin'),
+    ('Rspamd (Spam Filter)', 'rspamd'),
+    ('Redis (Cache)', 'redis-server'),
+    ('SOGo (Webmail)', 'sogo'),
+)
+PROPERTIES = ('Id', 'LoadState', 'ActiveState', 'SubState', 'StateChangeTimestamp')
+# ActiveState (or not-found/unknown) -> label; anything else is Offline
+STATE_LABELS = {
+    'active': 'Online',
+    'reloading': 'Reloading',
+    'activating': 'Starting',
+    'deactivating': 'Stopping',
+    'not-found': 'Not Installed',
+    'unknown': 'Unknown',
+    # Not probed yet (poller just started), rendered neutrally rather than as down
+    'checking': 'Checking…',
+}
+
+POLL_INTERVAL = 10
+# Readers see "Checking…" rather than a reading this old
+STATUS_TTL = 3 * POLL_INTERVAL
+IDLE_TIMEOUT = 600
+PROBE_TIMEOUT = 5
+
+STATUS_KEY = 'services:status'
+LOCK_KEY = 'services:probe-lock'
+
+
+def parse_show(output):
+    """
+    Parse `systemctl show` output for several units (blank-line separated
+    blocks of Key=Value lines).
+    Returns: dict of unit id -> {property: value}.
+    """
+    units = {}
+    for block in output.strip().split('\n\n'):
+        props = dict(line.split('=', 1) for line in block.splitlines() if '=' in line)
+        if 'Id' in props:
+            units[props['Id']] = props
+    return units
+
+
+def parse_timestamp(value):
+    """'@1700000000' (systemctl --timestamp=unix) -> aware UTC datetime, else None."""
+    if not value or not value.startswith('@'):
+        return None
+    try:
+        return datetime.datetime.fromtimestamp(int(value[1:]), datetime.timezone.utc)
+    except ValueError:
+        return None
+
+
+def probe(services=SERVICES):
+    """
+    One `systemctl show` for every unit.
+    Returns: list of {'name', 'unit', 'state', 'status', 'sub_state', 'active', 'since'}.
+    """
+    units = [f"{unit}.service" for _, unit in services]
+    result = subprocess.run(
+        ['/usr/bin/systemctl', 'show', '--timestamp=unix', f"--property={','.join(PROPERTIES)}", '--', *units],
+        capture_output=True, text=True, timeout=PROBE_TIMEOUT,
+    )
+    shown = parse_show(result.stdout)
+    statuses = []
+    for (name, unit), unit_id in zip(services, units):
+        props = shown.get(unit_id, {})
+        state = props.get('ActiveState', 'unknown')
+        if props.get('LoadState') == 'not-found':
+            state = 'not-found'
+        statuses.append({
+            'name': name,
+            'unit': unit,
+            'state': state,
+            'status': STATE_LABELS.get(state, 'Offline'),
+            'sub_state': props.get('SubState', ''),
+            'active': state == 'active',
+            'since': parse_timestamp(props.get('StateChangeTimestamp')),
+        })
+    return statuses
+
+
+def refresh():
+    """Probe and cache, unless another worker already did this interval."""
+    if not cache.add(LOCK_KEY, True, POLL_INTERVAL - 1):
+        return
+    try:
+        statuses = probe()
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"Service status probe failed: {e}")
+        return
+    cache.set(STATUS_KEY, {'checked_at': datetime.datetime.now(datetime.timezone.utc), 'services': statuses},
+              STATUS_TTL)
+
+
+class ServicePoller:
+    def __init__(self, interval=POLL_INTERVAL, idle_timeout=IDLE_TIMEOUT):
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.last_read = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def touch(self):
+        """Note a reader, starting the polling thread if it is not running."""
+        self.last_read = time.monotonic()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.run, name='service-poller', daemon=True)
+                self._thread.start()
+
+    def run(self):
+        while time.monotonic() - self.last_read < self.idle_timeout:
+            refresh()
+            time.sleep(self.interval)
+
+
+poller = ServicePoller()
+
+
+def get_status():
+    """
+    The cached service statuses, without probing.
+    Returns: {'checked_at': datetime or None, 'services': [...]}; until the
+    first probe lands every service is reported with state 'checking'.
+    """
+    poller.touch()
+    status = cache.get(STATUS_KEY)
+    if status is None:
+        status = {
+            'checked_at': None,
+            'services': [{'name': name, 'unit': unit, 'state': 'checking', 'status': STATE_LABELS['checking'],
+                          'sub_state': '', 'active': False, 'since': None} for name, unit in SERVICES],
+        }
+    return status
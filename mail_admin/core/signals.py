@@ -0,0 +1,30 @@
+"""
+Cache invalidation hooks, connected in CoreConfig.ready().
+"""
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import authz
+from .models import DomainAllocation, DomainAssignment, MailDomain, MailPlan
+from .plans import invalidate_plan_catalog
+
+
+@receiver([post_save, post_delete], sender=DomainAssignment)
+@receiver([post_save, post_delete], sender=MailDomain)
+def domain_access_changed(sender, **kwargs):
+    authz.invalidate()
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, update_fields=None, **kwargs):
+    # Every login saves last_login; that changes nobody's access
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    authz.invalidate()
+
+
+@receiver([post_save, post_delete], sender=MailPlan)
+@receiver([post_save, post_delete], sender=DomainAllocation)
+def plans_changed(sender, **kwargs):
+    invalidate_plan_catalog()
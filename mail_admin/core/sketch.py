@@ -0,0 +1,150 @@
+"""
+Bounded-memory heavy-hitter counting.
+
+SpaceSaving (Metwally, Agrawal & El Abbadi, 2005) keeps at most `capacity`
+counters. For a stream of N updates every reported count c satisfies
+true <= c <= true + N / capacity, and any item whose true count exceeds
+N / capacity is guaranteed to be present. Sketches merge (Agarwal et al.,
+"Mergeable Summaries") with the same bound over the combined stream, so
+partial results from workers and earlier runs can be folded together.
+
+Plain Python (no Django imports) so mail_monitor.py can use it.
+"""
+
+
+class SpaceSaving:
+    """
+    Top-k counter with a fixed number of slots.
+
+    Items are grouped by count (a simplified stream-summary), so the common
+    add(item) is O(1) even when it evicts. Ties are broken by insertion
+    order, which keeps results reproducible across processes.
+    """
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.total = 0
+        self.counts = {}
+        self.errors = {}
+        self.buckets = {}  # count -> {item: None}, insertion ordered
+        self.min_count = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self, item):
+        return item in self.counts
+
+    @property
+    def full(self):
+        return len(self.counts) >= self.capacity
+
+    @property
+    def max_error(self):
+        """Upper bound on any count's overestimate (and on any absent item's true count)."""
+        return self.min_count if self.full else 0
+
+    def add(self, item, count=1):
+        self.total += count
+        current = self.counts.get(item)
+        if current is not None:
+            self._move(item, current, current + count)
+            return
+        if not self.full:
+            self.counts[item] = count
+            self.errors[item] = 0
+            self.buckets.setdefault(count, {})[item] = None
+            if len(self.counts) == 1 or count < self.min_count:
+                self.min_count = count
+            return
+        # Evict the oldest item holding the minimum count; the newcomer
+        # inherits that count as its possible overestimate.
+        floor = self.min_count
+        victim = next(iter(self.buckets[floor]))
+        self._remove(victim)
+        self.counts[item] = floor
+        self.errors[item] = floor
+        self.buckets.setdefault(floor, {})[item] = None
+        self._move(item, floor, floor + count)
+
+    def _remove(self, item):
+        count = self.counts.pop(item)
+        del self.errors[item]
+        bucket = self.buckets[count]
+        del bucket[item]
+        if not bucket:
+            del self.buckets[count]
+
+    def _move(self, item, old, new):
+        bucket = self.buckets[old]
+        del bucket[item]
+        if not bucket:
+            del self.buckets[old]
+        self.counts[item] = new
+        self.buckets.setdefault(new, {})[item] = None
+        if old == self.min_count and old not in self.buckets:
+            self.min_count = new if new - old == 1 else min(self.buckets)
+
+    def estimate(self, item):
+        """Upper bound on item's true count."""
+        return self.counts.get(item, self.max_error)
+
+    def guaranteed(self, item):
+        """Lower bound on item's true count."""
+        if item not in self.counts:
+            return 0
+        return self.counts[item] - self.errors[item]
+
+    def top(self, n=None):
+        """(item, count, error) tuples, highest count first."""
+        ranked = sorted(self.counts.items(), key=lambda pair: (-pair[1], pair[0]))
+        if n is not None:
+            ranked = ranked[:n]
+        return [(item, count, self.errors[item]) for item, count in ranked]
+
+    def merge(self, other):
+        """Fold another sketch into this one, keeping this sketch's capacity."""
+        mine, theirs = self.max_error, other.max_error
+        merged = {}
+        for item in self.counts.keys() | other.counts.keys():
+            merged[item] = (
+                self.counts.get(item, mine) + other.counts.get(item, theirs),
+                self.errors.get(item, mine) + other.errors.get(item, theirs),
+            )
+        total = self.total + other.total
+        self._load(sorted(merged.items(), key=lambda pair: (-pair[1][0], pair[0]))[:self.capacity])
+        self.total = total
+        return self
+
+    def _load(self, ranked):
+        self.counts, self.errors, self.buckets = {}, {}, {}
+        # Lowest counts first, so eviction order within a count is stable
+        for item, (count, error) in reversed(ranked):
+            self.counts[item] = count
+            self.errors[item] = error
+            self.buckets.setdefault(count, {})[item] = None
+        self.min_count = min(self.buckets) if self.buckets else 0
+
+    def to_dict(self):
+        """JSON-safe form, stored in domain_stats.metrics_json."""
+        return {
+            'capacity': self.capacity,
+            'total': self.total,
+            'items': [[item, count, error] for item, count, error in self.top()],
+        }
+
+    @classmethod
+    def from_dict(cls, data, capacity=None):
+        sketch = cls(capacity or data.get('capacity', 64))
+        ranked = [(item, (count, error)) for item, count, error in data.get('items', [])]
+        sketch._load(ranked[:sketch.capacity])
+        sketch.total = data.get('total', 0)
+        return sketch
+
+    @classmethod
+    def from_counts(cls, counts, capacity=64):
+        """Exact counts (e.g. a Counter) as a sketch; beyond capacity the tail is folded in as error."""
+        sketch = cls(capacity)
+        for item, count in sorted(counts.items(), key=lambda pair: (-pair[1], pair[0])):
+            sketch.add(item, count)
+        return sketch
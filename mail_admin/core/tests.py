@@ -1,3 +1,1250 @@
-from django.test import TestCase
+import datetime
+import gzip
+import json
+import os
+import pwd
+import random
+import shutil
+import socketserver
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+import pymysql
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection, connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+import mail_monitor
+from . import doveadm, health, logindex, logstream, logtail, plans, provision, services, trace, views
+from .journal import POSTFIX_IDENTIFIERS, JournalReader, load_cursor, save_cursor, syslog_line
+from .maillog import DomainAggregator, QueueCorrelator
+from .models import DomainAllocation, DomainAssignment, DomainStats, DomainUsage, MailAlias, MailDomain, MailPlan, MailUser, ServerHealth, TrafficDaily, TrafficHourly
+from .plans import get_plan_catalog
+from .sketch import SpaceSaving
+from .usage import count_usage, get_usage
+
+JOURNAL_FIXTURE = os.path.join(os.path.dirname(__file__), 'testdata', 'journal_postfix.jsonl')
+
+
+class UnmanagedTablesMixin:
+    """
+    Creates the tables of managed=False models (normally provisioned outside
+    Django) around a test class.
+
+    'mail_data' is a test mirror of 'default' with its own connection, which
+    TestCase does not wrap in a transaction, so classes using this are
+    TransactionTestCases.
+    """
+    unmanaged_models = ()
+
+    @classmethod
+    def setUpClass(cls):
+        with connection.schema_editor() as editor:
+            for model in cls.unmanaged_models:
+                editor.create_model(model)
+        super().setUpClass()
+
+    def tearDown(self):
+        # flush only empties managed tables; children before parents
+        for model in reversed(self.unmanaged_models):
+            model.objects.using('mail_data').all().delete()
+        super().tearDown()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.schema_editor() as editor:
+            for model in reversed(cls.unmanaged_models):
+                editor.delete_model(model)
+
+
+class JournalReaderTests(SimpleTestCase):
+    def postfix_reader(self, **kwargs):
+        return JournalReader(identifiers=POSTFIX_IDENTIFIERS, fixture=JOURNAL_FIXTURE, **kwargs)
+
+    def test_identifier_match_skips_other_programs(self):
+        entries = list(self.postfix_reader().entries())
+        self.assertEqual(len(entries), 11)
+        self.assertTrue(all(entry.identifier.startswith('postfix/') for entry in entries))
+        self.assertEqual(entries[0].time, datetime.datetime(2026, 1, 28, 7, 18, 1))
+
+    def test_resumes_after_cursor(self):
+        reader = self.postfix_reader()
+        first = [entry for _, entry in zip(range(5), reader.entries())]
+        resumed = list(self.postfix_reader(cursor=reader.cursor).entries())
+        self.assertEqual(reader.cursor, first[-1].cursor)
+        self.assertEqual(len(first) + len(resumed), 11)
+        self.assertEqual(resumed[0].message, "4Dq2xk1Zc3z9: removed")
+
+    def test_cursor_file_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'postfix.cursor')
+            self.assertIsNone(load_cursor(path))
+            reader = self.postfix_reader()
+            list(reader.entries())
+            save_cursor(path, reader.cursor)
+            self.assertEqual(load_cursor(path), reader.cursor)
+            self.assertEqual(list(self.postfix_reader(cursor=load_cursor(path)).entries()), [])
+
+    def test_entries_feed_the_aggregator(self):
+        aggregator = DomainAggregator(['example.com']).feed_entries(self.postfix_reader().entries())
+        stats = aggregator.results()['example.com']
+        self.assertEqual((stats['sent'], stats['received']), (2, 1))
+        self.assertEqual(stats['top_sender'], 'billing@example.com')
+
+    def test_unit_tail_decodes_byte_messages(self):
+        reader = JournalReader(units=('mail-admin.service',), fixture=JOURNAL_FIXTURE)
+        entries = reader.tail(1)
+        self.assertEqual([entry.message for entry in entries], ["caf\ufffd menu"])
+        self.assertIn("gunicorn[555]: caf", syslog_line(entries[0]))
+        self.assertIsNone(reader.cursor)
+
+    def test_journalctl_args_put_unit_first_for_sudoers(self):
+        reader = JournalReader(units=('mail-admin.service',), command=('/usr/bin/sudo', '/usr/bin/journalctl'))
+        self.assertEqual(reader.journalctl_args(tail=50)[:4],
+                         ['/usr/bin/sudo', '/usr/bin/journalctl', '-u', 'mail-admin.service'])
+        resumed = JournalReader(identifiers=('postfix/qmgr',), cursor='s=1;i=2')
+        self.assertIn('--after-cursor=s=1;i=2', resumed.journalctl_args())
+
+
+def postfix_line(clock, program, message):
+    return f"2026-01-28T{clock}+00:00 mail postfix/{program}[100]: {message}\n"
+
+
+class QueueCorrelatorTests(SimpleTestCase):
+    MESSAGE = [
+        postfix_line('07:00:00', 'smtpd', "4Xyz1BcDfGh: client=mx.example.net[192.0.2.7]"),
+        postfix_line('07:00:00', 'cleanup', "4Xyz1BcDfGh: message-id=<m1@example.net>"),
+        postfix_line('07:00:01', 'qmgr', "4Xyz1BcDfGh: from=<bob@example.net>, size=2048, nrcpt=2 (queue active)"),
+    ]
+    DELIVERIES = [
+        postfix_line('07:00:02', 'lmtp', "4Xyz1BcDfGh: to=<alice@example.com>, orig_to=<info@example.com>, "
+                     "relay=mail.example.com[private/dovecot-lmtp], delay=2.1, dsn=2.0.0, status=sent (250 2.0.0 Saved)"),
+        postfix_line('07:00:02', 'smtp', "4Xyz1BcDfGh: to=<carol@example.org>, relay=mx.example.org[198.51.100.2]:25, "
+                     "delay=2.3, dsn=4.4.1, status=deferred (connect timed out)"),
+        postfix_line('07:00:03', 'qmgr', "4Xyz1BcDfGh: removed"),
+    ]
+
+    def test_deliveries_are_joined_by_queue_id(self):
+        correlator = QueueCorrelator()
+        events = list(correlator.feed_lines(self.MESSAGE + ["Jan 28 07:00:01 mail dovecot: imap-login: Login\n"] + self.DELIVERIES))
+        self.assertEqual([(event.recipient, event.status, event.agent) for event in events],
+                         [('alice@example.com', 'sent', 'lmtp'), ('carol@example.org', 'deferred', 'smtp')])
+        first = events[0]
+        self.assertEqual(first.time, datetime.datetime(2026, 1, 28, 7, 0, 2))
+        self.assertEqual((first.sender, first.orig_recipient, first.client, first.message_id, first.size, first.delay),
+                         ('bob@example.net', 'info@example.com', '192.0.2.7', 'm1@example.net', 2048, 2.1))
+        self.assertEqual(events[1].relay, 'mx.example.org[198.51.100.2]:25')
+        self.assertEqual(correlator.lines, 7)
+        self.assertEqual(len(correlator.pending), 0)
+
+    def test_rejects_become_events(self):
+        correlator = QueueCorrelator()
+        events = list(correlator.feed_lines([
+            postfix_line('07:01:00', 'smtpd', "NOQUEUE: reject: RCPT from unknown[203.0.113.9]: 554 5.7.1 "
+                         "<spam@example.com>: Relay access denied; from=<x@spam.test> to=<spam@example.com> proto=ESMTP"),
+            postfix_line('07:02:00', 'smtpd', "4Bcd2DfGhJk: client=unknown[203.0.113.10]"),
+            postfix_line('07:02:05', 'cleanup', "4Bcd2DfGhJk: milter-reject: END-OF-MESSAGE from unknown[203.0.113.10]: "
+                         "5.7.1 Spam message rejected; from=<y@spam.test> to=<bob@example.com> proto=ESMTP"),
+        ]))
+        self.assertEqual([(event.queue_id, event.sender, event.recipient, event.client, event.status) for event in events], [
+            (None, 'x@spam.test', 'spam@example.com', '203.0.113.9', 'rejected'),
+            ('4Bcd2DfGhJk', 'y@spam.test', 'bob@example.com', '203.0.113.10', 'rejected'),
+        ])
+        self.assertEqual(len(correlator.pending), 0)
+
+    def test_pending_queue_ids_are_bounded(self):
+        correlator = QueueCorrelator(max_entries=2)
+        for clock, qid in (('07:00:00', 'ABC121'), ('07:00:01', 'ABC122'), ('07:00:02', 'ABC121'), ('07:00:03', 'ABC123')):
+            correlator.feed(postfix_line(clock, 'qmgr', f"{qid}: from=<bob@example.net>, size=1, nrcpt=1 (queue active)"))
+        # ABC121 was touched again, so the least recently seen ABC122 goes
+        self.assertEqual(list(correlator.pending), ['ABC121', 'ABC123'])
+        self.assertEqual(correlator.evicted, 1)
+
+    def test_sweep_expires_by_log_time(self):
+        correlator = QueueCorrelator(ttl=3600)
+        correlator.feed(postfix_line('07:00:00', 'qmgr', "ABC121: from=<bob@example.net>, size=1, nrcpt=1 (queue active)"))
+        correlator.feed(postfix_line('07:45:00', 'qmgr', "ABC122: from=<bob@example.net>, size=1, nrcpt=1 (queue active)"))
+        correlator.sweep()
+        self.assertEqual(len(correlator.pending), 2)
+        correlator.feed(postfix_line('08:30:00', 'qmgr', "ABC123: from=<bob@example.net>, size=1, nrcpt=1 (queue active)"))
+        correlator.sweep()
+        self.assertEqual(list(correlator.pending), ['ABC122', 'ABC123'])
+        self.assertEqual(correlator.expired, 1)
+
+    def test_sweep_runs_every_n_queue_lines_among_other_traffic(self):
+        correlator = QueueCorrelator(ttl=3600)
+        correlator.SWEEP_EVERY = 3
+        noise = "2026-01-28T{}+00:00 mail dovecot: imap-login: Login: user=<alice@example.com>\n"
+        for clock, qid in (('07:00:00', 'ABC121'), ('07:45:00', 'ABC122'), ('08:30:00', 'ABC123')):
+            # Queue lines fall on overall lines 2, 6 and 10, never a multiple of 3
+            correlator.feed(noise.format(clock))
+            correlator.feed(postfix_line(clock, 'qmgr', f"{qid}: from=<bob@example.net>, size=1, nrcpt=1 (queue active)"))
+            correlator.feed(noise.format(clock))
+            correlator.feed(noise.format(clock))
+        self.assertEqual(list(correlator.pending), ['ABC122', 'ABC123'])
+        self.assertEqual(correlator.expired, 1)
+
+    def test_state_round_trip_finishes_the_join(self):
+        first = QueueCorrelator()
+        list(first.feed_lines(self.MESSAGE))
+        state = json.loads(json.dumps(first.export_state()))
+
+        second = QueueCorrelator()
+        second.import_state(state)
+        self.assertEqual(second.pending, first.pending)
+        events = list(second.feed_lines(self.DELIVERIES))
+        self.assertEqual([(event.sender, event.client, event.message_id, event.size) for event in events],
+                         [('bob@example.net', '192.0.2.7', 'm1@example.net', 2048)] * 2)
+
+
+class AggregatorMergeTests(SimpleTestCase):
+    def test_partials_merged_in_file_order_match_one_pass(self):
+        random.seed(7)
+        lines = []
+        for i in range(600):
+            sender = f"user{random.choice([1, 1, 1, 2, 2, 3, random.randrange(100)])}@example.com"
+            recipient = random.choice(["info@example.com", "x@example.org", f"r{i % 70}@example.net"])
+            status = 'sent' if i % 9 else 'bounced'
+            clock = f"{7 + i // 100:02d}:{i % 60:02d}:00"
+            lines.append(postfix_line(clock, 'qmgr', f"ABC{i:04d}: from=<{sender}>, size=10, nrcpt=1 (queue active)"))
+            lines.append(postfix_line(clock, 'smtp', f"ABC{i:04d}: to=<{recipient}>, relay=mx.example.org[198.51.100.2]:25, "
+                                      f"delay=1, dsn=2.0.0, status={status} (250 ok)"))
+        domains = ["example.com", "example.org"]
+        whole = DomainAggregator(domains).feed_lines(lines)
+
+        # One aggregator per "file", as backfill's workers build them
+        merged = DomainAggregator(domains)
+        for start in range(0, len(lines), 400):
+            merged.merge_counts(DomainAggregator(domains).feed_lines(lines[start:start + 400]).export_counts())
+        self.assertEqual(merged.events, whole.events)
+        for name, expected in whole.results().items():
+            result = merged.results()[name]
+            self.assertEqual((result['sent'], result['received']), (expected['sent'], expected['received']))
+            self.assertEqual(result['top_senders'][:3], expected['top_senders'][:3])
+
+        with self.assertRaises(ValueError):
+            merged.merge_counts(DomainAggregator(["other.example"]).export_counts())
+
+
+class LogCursorTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'mail.log')
+
+    def append(self, text, path=None):
+        with open(path or self.path, 'a') as f:
+            f.write(text)
+
+    def test_unterminated_line_waits_for_its_newline(self):
+        self.append("one\ntw")
+        log_cursor = logtail.LogCursor(self.path)
+        self.assertTrue(log_cursor.is_fresh)
+        self.assertEqual(list(log_cursor.read_lines()), ["one\n"])
+        self.assertFalse(log_cursor.is_fresh)
+        self.assertEqual(log_cursor.offset, 4)
+
+        self.append("o\nthree\n")
+        self.assertEqual(list(log_cursor.read_lines()), ["two\n", "three\n"])
+        self.assertEqual(list(log_cursor.read_lines()), [])
+        self.assertEqual(log_cursor.bytes_read, os.path.getsize(self.path))
+
+    def test_rotation_drains_the_old_file_first(self):
+        self.append("one\n")
+        first = logtail.LogCursor(self.path)
+        list(first.read_lines())
+        self.append("two\nthree")
+        os.rename(self.path, self.path + '.1')
+        self.append("four\n")
+
+        # A later run, resuming from the saved checkpoint
+        resumed = logtail.LogCursor(self.path, first.inode, first.offset)
+        self.assertEqual(list(resumed.read_lines()), ["two\n", "three", "four\n"])
+        self.assertEqual((resumed.inode, resumed.offset), (os.stat(self.path).st_ino, 5))
+
+    def test_rotated_file_gone_starts_the_new_one_from_the_top(self):
+        self.append("one\n")
+        first = logtail.LogCursor(self.path)
+        list(first.read_lines())
+        os.rename(self.path, self.path + '.2')
+        self.append("two\n")
+        resumed = logtail.LogCursor(self.path, first.inode, first.offset)
+        self.assertEqual(list(resumed.read_lines()), ["two\n"])
+
+    def test_copytruncate_starts_over(self):
+        self.append("one\ntwo\n")
+        log_cursor = logtail.LogCursor(self.path)
+        list(log_cursor.read_lines())
+        inode = log_cursor.inode
+        with open(self.path, 'r+') as f:
+            f.truncate(0)
+        self.append("new\n")
+        self.assertEqual(list(log_cursor.read_lines()), ["new\n"])
+        self.assertEqual((log_cursor.inode, log_cursor.offset), (inode, 4))
+
+
+class TailLinesTests(SimpleTestCase):
+    def setUp(self):
+        log = tempfile.NamedTemporaryFile('wb', suffix='.log', delete=False)
+        for i in range(5000):
+            status = 'bounced' if i % 997 == 0 else 'sent'
+            log.write(f"Jan 28 07:00:00 mail postfix/smtp[1]: Q{i:05d}: status={status}\n".encode())
+        log.write(b"Jan 28 07:00:01 mail postfix/smtp[1]: PARTIAL")
+        log.close()
+        self.path = log.name
+        self.addCleanup(os.unlink, self.path)
+
+    def test_matches_a_forward_scan(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        complete = data[:data.rfind(b'\n') + 1].decode().splitlines()
+        for needle, count in (('', 3), ('STATUS=BOUNCED', 4), ('Q0000', 20), ('nowhere', 5)):
+            expected = [line for line in complete if needle.lower() in line.lower()][-count:]
+            # Small blocks so lines straddle block boundaries
+            with self.subTest(needle=needle):
+                lines, _ = logtail.tail_lines(self.path, count, needle, block_size=100)
+                self.assertEqual(lines, expected)
+
+    def test_cursor_points_after_the_newest_complete_line(self):
+        lines, (inode, end) = logtail.tail_lines(self.path, 1)
+        self.assertIn("Q04999", lines[0])
+        with open(self.path, 'ab') as f:
+            f.write(b": status=sent\n")
+        follower = logtail.LogCursor(self.path, inode, end)
+        self.assertEqual([line.rstrip() for line in follower.read_lines()],
+                         ["Jan 28 07:00:01 mail postfix/smtp[1]: PARTIAL: status=sent"])
+
+    def test_scan_limit_bounds_the_search(self):
+        lines, _ = logtail.tail_lines(self.path, 10, 'Q00000', max_bytes=4096)
+        self.assertEqual(lines, [])
+
+
+class LogIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        self.today = now.date()
+        stamp = lambda seconds: (now - datetime.timedelta(seconds=seconds)).isoformat()
+        local = lambda seconds: (now - datetime.timedelta(seconds=seconds)).astimezone().strftime('%Y-%m-%d %H:%M:%S')
+        self.lines = [
+            f"{stamp(9)} mail postfix/smtpd[100]: 4Xyz1BcDfGh: client=mx.example.net[192.0.2.10]",
+            f"{stamp(9)} mail postfix/cleanup[101]: 4Xyz1BcDfGh: message-id=<m1@example.net>",
+            f"{stamp(8)} mail postfix/qmgr[900]: 4Xyz1BcDfGh: from=<alice@example.net>, size=2048, nrcpt=1 (queue active)",
+            f"{stamp(7)} mail postfix/lmtp[102]: 4Xyz1BcDfGh: to=<bob@ours.test>, orig_to=<sales@ours.test>, "
+            "relay=mail.ours.test[private/dovecot-lmtp], delay=0.2, dsn=2.0.0, status=sent (250 2.0.0 Saved)",
+            f"{stamp(7)} mail dovecot: lmtp(bob@ours.test)<103><s1>: msgid=<m1@example.net>: saved mail to INBOX",
+            f"{stamp(6)} mail postfix/smtp[104]: 4Xyz1BcDfGh: to=<bob@gmail.com>, orig_to=<sales@ours.test>, "
+            "relay=gmail-smtp-in.l.google.com[142.250.0.27]:25, delay=1.5, dsn=2.0.0, status=sent (250 2.0.0 OK)",
+            f"{stamp(6)} mail postfix/qmgr[900]: 4Xyz1BcDfGh: removed",
+            f"{stamp(6)} mail postfix/smtpd[100]: NOQUEUE: reject: RCPT from bad.example[198.51.100.7]: 554 5.7.1 "
+            "<x@ours.test>: Relay access denied; from=<spam@bad.example> to=<x@ours.test> proto=ESMTP",
+            f"{stamp(5)} mail dovecot: imap-login: Login: user=<bob@ours.test>, method=PLAIN, rip=203.0.113.5, lip=10.0.0.1",
+            f"{local(9)} #1234(rspamd_proxy) <8f2a1c>; proxy; rspamd_task_write_log: id: <m1@example.net>, "
+            "qid: <4Xyz1BcDfGh>, ip: 192.0.2.10, from: <alice@example.net>, (default: F (no action): "
+            "[1.20/15.00] [R_SPF_ALLOW(-0.20){+ip4:192.0.2.0/24;}]), len: 2048, time: 120.5ms, dns req: 12, "
+            "digest: <abc>, rcpts: <sales@ours.test>, mime_rcpts: <sales@ours.test>",
+            f"{stamp(4)} mail kernel: [ 1.0] eth0: link up",
+        ]
+        self.index = logindex.LogIndex(self.directory)
+        self.index.add(logindex.EventParser().feed_lines(self.lines))
+        self.index.close()
+
+    def test_events_are_found_by_every_indexed_field(self):
+        delivery = self.index.search("from:alice@example.net to:bob@ours.test status:sent")
+        self.assertEqual([event.program for event in delivery], ['postfix/lmtp'])
+        self.assertEqual(delivery[0].message_id, 'm1@example.net')
+        self.assertEqual(delivery[0].client, '192.0.2.10')
+
+        by_message = self.index.search("msgid:m1@example.net")
+        self.assertEqual({event.source for event in by_message}, {'postfix', 'dovecot', 'rspamd'})
+        scanned = [event for event in self.index.search("qid:4Xyz1BcDfGh ip:192.0.2.10") if event.source == 'rspamd']
+        self.assertEqual([event.status for event in scanned], ['no action'])
+        self.assertEqual(self.index.search("198.51.100.7")[0].status, 'rejected')
+        self.assertEqual(self.index.search("ip:203.0.113.5")[0].status, 'login')
+        # Newest first; unmatched and unsearchable queries return nothing
+        times = [event.time for event in self.index.search("ours.test")]
+        self.assertEqual(times, sorted(times, reverse=True))
+        self.assertEqual(self.index.search("nobody@nowhere.test"), [])
+        self.assertEqual(self.index.search('" OR @'), [])
+
+    def test_trace_stitches_the_delivery_path(self):
+        for value in ("4Xyz1BcDfGh", "m1@example.net", "alice@example.net"):
+            traces = trace.trace(self.index, value)
+            self.assertEqual(len(traces), 1, value)
+            message = traces[0]
+            self.assertEqual((message.queue_id, message.sender, message.outcome),
+                             ("4Xyz1BcDfGh", "alice@example.net", "delivered"))
+            self.assertEqual([stage.name for stage in message.stages],
+                             ['connect', 'cleanup', 'spam scan', 'queued', 'delivered', 'stored', 'relayed', 'removed'])
+            self.assertEqual(message.stages[-1].since_start, 3.0)
+            self.assertEqual(message.duration, 3.0)
+            self.assertEqual(message.hops, [trace.Hop('sales@ours.test', 'bob@ours.test', 'sent', None),
+                                            trace.Hop('sales@ours.test', 'bob@gmail.com', 'sent', 'gmail-smtp-in.l.google.com')])
+        rejected = trace.trace(self.index, "spam@bad.example")
+        self.assertEqual([(item.queue_id, item.outcome) for item in rejected], [(None, 'rejected')])
+        self.assertEqual(trace.trace(self.index, "example.net"), [])
+
+    def test_old_partitions_are_pruned(self):
+        for age in (5, 40):
+            day = self.today - datetime.timedelta(days=age)
+            open(self.index.path_for(day), 'w').close()
+        self.assertEqual(self.index.prune(self.today), [self.today - datetime.timedelta(days=40)])
+        self.assertEqual(len(self.index.days()), 2)
+        # A search only covers the days asked for
+        self.assertEqual(self.index.search("alice@example.net", days=1, today=self.today + datetime.timedelta(days=1)), [])
+
+
+class ServiceStatusTests(SimpleTestCase):
+    SHOW_OUTPUT = (
+        "Id=postfix.service\nLoadState=loaded\nActiveState=active\nSubState=running\n"
+        "StateChangeTimestamp=@1767225600\n\n"
+        "Id=sogo.service\nLoadState=not-found\nActiveState=inactive\nSubState=dead\nStateChangeTimestamp=\n\n"
+        "Id=rspamd.service\nLoadState=loaded\nActiveState=failed\nSubState=failed\n"
+        "StateChangeTimestamp=@1767229200\n"
+    )
+
+    def test_parses_one_show_for_many_units(self):
+        units = services.parse_show(self.SHOW_OUTPUT)
+        self.assertEqual(set(units), {'postfix.service', 'sogo.service', 'rspamd.service'})
+        self.assertEqual(units['rspamd.service']['ActiveState'], 'failed')
+        self.assertEqual(services.parse_timestamp(units['postfix.service']['StateChangeTimestamp']),
+                         datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc))
+        self.assertIsNone(services.parse_timestamp(units['sogo.service']['StateChangeTimestamp']))
+
+    def test_readers_only_see_the_cache(self):
+        cache.clear()
+        # Hold the probe lock so the poller thread leaves the cache alone
+        cache.set(services.LOCK_KEY, True, 60)
+        # Not probed yet: neutral, not reported as down
+        self.assertEqual({s['state'] for s in services.get_status()['services']}, {'checking'})
+        self.assertEqual(len(services.get_status()['services']), len(services.SERVICES))
+
+        checked = {'checked_at': timezone.now(), 'services': [{'name': "Postfix (MTA)", 'state': 'active'}]}
+        cache.set(services.STATUS_KEY, checked)
+        self.assertEqual(services.get_status(), checked)
+        cache.clear()
+
+
+class LogStreamTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        log = tempfile.NamedTemporaryFile('w', suffix='.log', delete=False)
+        log.write("Jan 28 06:59:59 mail postfix/qmgr[900]: OLD: removed\n")
+        log.close()
+        self.path = log.name
+        self.addCleanup(os.unlink, self.path)
+
+    def append(self, *lines):
+        with open(self.path, 'a') as f:
+            f.writelines(line + "\n" for line in lines)
+
+    def test_streams_only_new_matching_lines_and_resumes(self):
+        st = os.stat(self.path)
+        closed = []
+        stream = logstream.event_stream(lambda: logstream.FileFollower(self.path, f"{st.st_ino}:{st.st_size}"),
+                                        needle="STATUS=BOUNCED", on_close=lambda: closed.append(True))
+        self.assertEqual(next(stream), "retry: 1000\n\n")
+        self.append("Jan 28 07:00:00 mail postfix/smtp[1]: ABC: to=<a@gmail.com>, status=sent",
+                    "Jan 28 07:00:01 mail postfix/smtp[1]: DEF: to=<b@gmail.com>, status=bounced")
+        message = next(stream)
+        self.assertNotIn("OLD", message)
+        self.assertNotIn("ABC", message)
+        self.assertIn("event: lines\ndata: Jan 28 07:00:01 mail postfix/smtp[1]: DEF", message)
+        cursor = message.split("id: ", 1)[1].split("\n", 1)[0]
+        self.assertEqual(cursor, f"{st.st_ino}:{os.path.getsize(self.path)}")
+
+        # A disconnect releases everything
+        stream.close()
+        self.assertEqual(closed, [True])
+
+        # Reconnecting with the last event id picks up after it
+        self.append("Jan 28 07:00:02 mail postfix/smtp[1]: GHI: to=<c@gmail.com>, status=bounced")
+        follower = logstream.FileFollower(self.path, cursor)
+        lines = follower.read(logstream.MAX_BATCH)
+        self.assertEqual(len(lines), 1)
+        self.assertIn("GHI", lines[0])
+        follower.close()
+
+    def test_unreadable_log_reports_failure(self):
+        stream = logstream.event_stream(lambda: logstream.FileFollower(self.path + '.missing'))
+        self.assertTrue(next(stream).startswith("retry: 10000\nevent: failure\n"))
+
+    def test_concurrent_streams_are_capped(self):
+        slots = [logstream.acquire_slot() for _ in range(logstream.MAX_STREAMS)]
+        self.assertNotIn(None, slots)
+        self.assertIsNone(logstream.acquire_slot())
+        slots[0].release()
+        self.assertEqual(logstream.acquire_slot().number, slots[0].number)
+
+    def test_lapsed_slot_does_not_free_its_successor(self):
+        slot = logstream.acquire_slot()
+        self.assertTrue(slot.refresh())
+        # The claim expired and another stream took the slot
+        cache.delete(slot.key)
+        successor = logstream.acquire_slot()
+        self.assertEqual(successor.number, slot.number)
+        self.assertFalse(slot.refresh())
+        slot.release()
+        self.assertTrue(successor.held())
+
+    def test_stream_stops_when_its_slot_lapses(self):
+        slot = logstream.acquire_slot()
+        cache.delete(slot.key)
+        with mock.patch.object(logstream, 'HEARTBEAT', 0):
+            stream = logstream.event_stream(lambda: logstream.FileFollower(self.path), slot=slot)
+            self.assertEqual(list(stream), ["retry: 1000\n\n"])
+
+
+class HealthSamplerTests(SimpleTestCase):
+    def test_ring_buffer_wraps_around(self):
+        ring = health.RingBuffer(4)
+        ring.append(1)
+        ring.append(2)
+        self.assertEqual(list(ring.last(5)), [1, 2])
+        for value in range(3, 7):
+            ring.append(value)
+        self.assertEqual(len(ring), 4)
+        self.assertEqual(list(ring.last(4)), [3, 4, 5, 6])
+        self.assertEqual(list(ring.last(2)), [5, 6])
+        self.assertEqual(list(ring.last(10)), [3, 4, 5, 6])
+
+    def record(self, sampler, *cpu):
+        # As sample() would, without reading the real machine
+        for value in cpu:
+            for metric, buffer in sampler.buffers.items():
+                buffer.append(value if metric == 'cpu' else 0.0)
+            sampler.pending += 1
+
+    def test_summary_covers_each_period_once(self):
+        sampler = health.HealthSampler(capacity=3)
+        start = sampler.period_start
+        self.record(sampler, 1, 2)
+        first = sampler.summary(now=start + 10)
+        self.assertEqual((first['samples'], first['seconds']), (2, 10))
+        self.assertEqual(first['cpu'], {'min': 1, 'avg': 1.5, 'max': 2, 'p95': 2})
+
+        # More samples than the buffer holds: the newest ones are summarised
+        self.record(sampler, 3, 4, 5, 6)
+        second = sampler.summary(now=start + 40)
+        self.assertEqual((second['samples'], second['seconds']), (3, 30))
+        self.assertEqual(second['cpu'], {'min': 4, 'avg': 5, 'max': 6, 'p95': 6})
+
+        # A period without samples takes one
+        self.assertEqual(sampler.summary(now=start + 45)['samples'], 1)
+
+
+class SpaceSavingTests(SimpleTestCase):
+    CAPACITY = 50
+
+    def zipf_stream(self, length, seed):
+        rng = random.Random(seed)
+        return [f"user{int(rng.paretovariate(1.1))}@example.com" for _ in range(length)]
+
+    def assert_within_bounds(self, sketch, exact):
+        bound = sketch.total / sketch.capacity
+        for item, count, error in sketch.top():
+            # Never underestimates, overestimates by at most N/k, and the lower bound holds
+            self.assertGreaterEqual(count, exact[item])
+            self.assertLessEqual(count - exact[item], bound)
+            self.assertLessEqual(count - error, exact[item])
+        # Anything more frequent than N/k must be present
+        for item, count in exact.items():
+            if count > bound:
+                self.assertIn(item, sketch)
+
+    def test_error_bounds_against_exact_counts(self):
+        stream = self.zipf_stream(20000, seed=7)
+        sketch = SpaceSaving(self.CAPACITY)
+        for item in stream:
+            sketch.add(item)
+        exact = Counter(stream)
+        self.assertEqual(sketch.total, len(stream))
+        self.assert_within_bounds(sketch, exact)
+        self.assertEqual([item for item, _, _ in sketch.top(5)], [item for item, _ in exact.most_common(5)])
+
+    def test_merge_keeps_bounds_over_combined_stream(self):
+        parts = [self.zipf_stream(7000, seed=seed) for seed in (1, 2, 3)]
+        merged = SpaceSaving(self.CAPACITY)
+        for part in parts:
+            sketch = SpaceSaving(self.CAPACITY)
+            for item in part:
+                sketch.add(item)
+            merged.merge(SpaceSaving.from_dict(sketch.to_dict()))
+        exact = Counter(item for part in parts for item in part)
+        self.assertEqual(merged.total, sum(map(len, parts)))
+        self.assert_within_bounds(merged, exact)
+
+    def test_aggregator_sketches_merge_across_workers(self):
+        lines = [
+            f"Jan 28 07:00:0{i} mail postfix/qmgr[1]: ABCDE{i}: from=<user{i % 2}@example.com>, size=1, nrcpt=1 (queue active)\n"
+            f"Jan 28 07:00:0{i} mail postfix/smtp[2]: ABCDE{i}: to=<x@gmail.com>, relay=mx.gmail.com[192.0.2.1]:25, "
+            f"delay=1, dsn=2.0.0, status=sent (ok)\n"
+            for i in range(6)
+        ]
+        left = DomainAggregator(['example.com']).feed_lines(''.join(lines[:3]).splitlines(True))
+        right = DomainAggregator(['example.com']).feed_lines(''.join(lines[3:]).splitlines(True))
+        left.merge_counts(right.export_counts())
+        sketches = left.results()['example.com']['sketches']
+        self.assertEqual(sketches['senders'].top(), [('user0@example.com', 3, 0), ('user1@example.com', 3, 0)])
+        self.assertEqual(sketches['relays'].top(), [('mx.gmail.com', 6, 0)])
+
+
+class DashboardQueryCountTests(UnmanagedTablesMixin, TransactionTestCase):
+    databases = {'default', 'mail_data'}
+    unmanaged_models = (MailDomain, DomainStats, ServerHealth, TrafficHourly, TrafficDaily)
+
+    def setUp(self):
+        self.standard = MailPlan.objects.create(name="Standard", max_users=10, max_aliases=20)
+        self.premium = MailPlan.objects.create(name="Premium", max_users=50, max_aliases=100)
+        admin = User.objects.create_superuser('admin@example.com', 'admin@example.com', 'unused')
+        self.client.force_login(admin)
+
+    def add_domains(self, start, count):
+        names = [f"tenant{i}.example.com" for i in range(start, start + count)]
+        MailDomain.objects.using('mail_data').bulk_create(MailDomain(name=name) for name in names)
+        DomainStats.objects.using('mail_data').bulk_create(
+            DomainStats(domain_name=name, sent_count=i, received_count=i, top_sender=f"info@{name}")
+            for i, name in enumerate(names)
+        )
+        # Every other domain has an explicit plan; the rest fall back to Standard
+        DomainAllocation.objects.bulk_create(
+            DomainAllocation(domain_name=name, plan=self.premium) for name in names[::2]
+        )
+
+    def dashboard_queries(self, **params):
+        # Measure the uncached path, where the authorization snapshot is built too
+        cache.clear()
+        with CaptureQueriesContext(connections['default']) as default, \
+                CaptureQueriesContext(connections['mail_data']) as mail_data:
+            response = self.client.get(reverse('dashboard'), params)
+        self.assertEqual(response.status_code, 200)
+        return len(default) + len(mail_data), response
+
+    def test_query_count_is_flat_from_10_to_1000_domains(self):
+        self.add_domains(0, 10)
+        small, response = self.dashboard_queries()
+        self.assertEqual(len(response.context['domains']), 10)
+
+        self.add_domains(10, 990)
+        large, response = self.dashboard_queries()
+        self.assertEqual(len(response.context['domains']), views.DASHBOARD_PAGE_SIZE)
+        self.assertEqual(response.context['domain_count'], 1000)
+        self.assertEqual(small, large)
+
+        plans = {domain['name']: domain['plan_name'] for domain in response.context['domains']}
+        self.assertEqual(plans['tenant0.example.com'], "Premium")
+        self.assertEqual(plans['tenant1.example.com'], "Standard")
+
+    def test_warm_dashboard_reuses_cached_rows(self):
+        self.add_domains(0, 10)
+        cache.clear()
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual([t.name for t in response.templates].count('partials/domain_row.html'), 10)
+
+        response = self.client.get(reverse('dashboard'))
+        self.assertTemplateNotUsed(response, 'partials/domain_row.html')
+        self.assertContains(response, "info@tenant3.example.com")
+
+        # A new domain_stats write re-renders just that row
+        DomainStats.objects.using('mail_data').filter(domain_name="tenant3.example.com").update(
+            top_sender="sales@tenant3.example.com", updated_at=timezone.now() + datetime.timedelta(minutes=5))
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual([t.name for t in response.templates].count('partials/domain_row.html'), 1)
+        self.assertContains(response, "sales@tenant3.example.com")
+        self.assertNotContains(response, "info@tenant3.example.com")
+
+    def test_custom_limit_edits_re_render_the_row(self):
+        # Without a Standard plan, unallocated domains show their own limits
+        self.standard.delete()
+        self.add_domains(0, 4)
+        cache.clear()
+        self.client.get(reverse('dashboard'))
+        MailDomain.objects.using('mail_data').filter(name="tenant1.example.com").update(max_users=7, max_aliases=9)
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual([t.name for t in response.templates].count('partials/domain_row.html'), 1)
+        self.assertContains(response, "7 Users")
+        self.assertContains(response, "9 Aliases")
+
+    def test_keyset_pages_cover_every_match_once_in_order(self):
+        self.add_domains(0, 300)
+        # Ties on sent_count, so paging has to fall back to the name
+        DomainStats.objects.using('mail_data').filter(domain_name__endswith='5.example.com').update(sent_count=7)
+        params = {'sort': 'sent_high', 'q': 'TENANT1'}
+        expected = sorted(
+            DomainStats.objects.using('mail_data').filter(domain_name__startswith='tenant1').values_list('sent_count', 'domain_name'),
+            key=lambda row: (-row[0], row[1]),
+        )
+
+        seen = []
+        _, response = self.dashboard_queries(**params)
+        self.assertEqual(response.context['domain_count'], len(expected))
+        while True:
+            seen += [(domain['sent'], domain['name']) for domain in response.context['domains']]
+            if not response.context['next_query']:
+                break
+            response = self.client.get(f"{reverse('dashboard')}?{response.context['next_query']}", HTTP_HX_REQUEST='true')
+            self.assertTemplateUsed(response, 'partials/domain_rows.html')
+            self.assertTemplateNotUsed(response, 'dashboard_super.html')
+        self.assertEqual(seen, expected)
+
+
+class AuthzSnapshotTests(UnmanagedTablesMixin, TransactionTestCase):
+    databases = {'default', 'mail_data'}
+    unmanaged_models = (MailDomain, MailUser, MailAlias, DomainUsage)
+
+    def setUp(self):
+        cache.clear()
+        self.domain = MailDomain.objects.using('mail_data').create(name="example.com")
+        User.objects.create_superuser('root@example.com', 'root@example.com', 'unused')
+        for email in ('root@example.com', 'info@example.com'):
+            MailUser.objects.using('mail_data').create(uid=email, email=email, password='x', full_name=email, domain=self.domain)
+        self.admin = User.objects.create_user('admin@agency.test', 'admin@agency.test', 'unused')
+        self.assignment = DomainAssignment.objects.create(user=self.admin, domain_name="example.com")
+        self.client.force_login(self.admin)
+
+    def user_list(self):
+        return self.client.get(reverse('user_list', args=[self.domain.id]), HTTP_HX_REQUEST='true')
+
+    def test_fragment_reuses_cached_snapshot(self):
+        self.user_list()
+        with CaptureQueriesContext(connections['default']) as queries:
+            response = self.user_list()
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "info@example.com")
+        self.assertNotContains(response, "root@example.com")
+        # Only the session's own user is loaded; assignments and superusers come from the cache
+        permission_queries = [q['sql'] for q in queries
+                              if 'core_domainassignment' in q['sql'] or 'is_superuser' in q['sql'].partition('WHERE')[2]]
+        self.assertEqual(permission_queries, [])
+
+    def test_changes_invalidate_cached_snapshots(self):
+        self.assertEqual(self.user_list().status_code, 200)
+        self.assignment.delete()
+        self.assertEqual(self.user_list().status_code, 403)
+
+        self.admin.is_superuser = True
+        self.admin.save()
+        # Superusers see protected accounts too
+        self.assertContains(self.user_list(), "root@example.com")
+
+
+class PlanCatalogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.standard = MailPlan.objects.create(name="Standard", max_users=10, max_aliases=20)
+        self.premium = MailPlan.objects.create(name="Premium", max_users=50, max_aliases=100)
+        DomainAllocation.objects.create(domain_name="premium.example.com", plan=self.premium)
+
+    def test_resolution_is_query_free_once_warm(self):
+        get_plan_catalog()
+        with self.assertNumQueries(0):
+            catalog = get_plan_catalog()
+            self.assertEqual(catalog.plan_for("premium.example.com").name, "Premium")
+            self.assertEqual(catalog.plan_for("other.example.com").name, "Standard")
+
+    def test_writes_invalidate_the_catalog(self):
+        get_plan_catalog()
+        DomainAllocation.objects.filter(domain_name="premium.example.com").delete()
+        self.assertEqual(get_plan_catalog().plan_for("premium.example.com").name, "Standard")
+
+        # manage_plans edits through a queryset update(), which sends no signals
+        admin = User.objects.create_superuser('admin@example.com', 'admin@example.com', 'unused')
+        self.client.force_login(admin)
+        self.client.post(reverse('manage_plans'), {
+            'plan_id': self.standard.id, 'name': "Standard", 'quota_mb': 500, 'max_users': 25, 'max_aliases': 50,
+        })
+        self.assertEqual(get_plan_catalog().plan_for("premium.example.com").max_users, 25)
+
+    def test_other_processes_catch_up_without_a_shared_cache(self):
+        # A second worker: its own LocMemCache and its own in-process catalog
+        other_cache = LocMemCache('other-worker', {})
+        other_cache.clear()
+        other_local = None
+
+        def other_worker(now=None):
+            nonlocal other_local
+            clock = mock.patch('django.core.cache.backends.locmem.time.time', return_value=now or time.time())
+            with mock.patch.object(plans, 'cache', other_cache), mock.patch.object(plans, '_local', other_local), clock:
+                catalog = get_plan_catalog()
+                other_local = plans._local
+            return catalog.plan_for("premium.example.com").name
+
+        self.assertEqual(other_worker(), "Premium")
+        # Changed in this worker, whose invalidation never reaches the other cache
+        DomainAllocation.objects.filter(domain_name="premium.example.com").delete()
+        self.assertEqual(get_plan_catalog().plan_for("premium.example.com").name, "Standard")
+        self.assertEqual(other_worker(), "Premium")
+        self.assertEqual(other_worker(time.time() + plans.VERSION_TIMEOUT + 1), "Standard")
+
+
+class DomainListPagingTests(UnmanagedTablesMixin, TransactionTestCase):
+    databases = {'default', 'mail_data'}
+    unmanaged_models = (MailDomain, MailUser, MailAlias, DomainUsage)
+
+    def setUp(self):
+        cache.clear()
+        self.domain = MailDomain.objects.using('mail_data').create(name="example.com")
+        MailUser.objects.using('mail_data').bulk_create(
+            MailUser(uid=f"user{i:03d}@example.com", email=f"user{i:03d}@example.com", password='x',
+                     full_name=f"user{i:03d}", domain=self.domain)
+            for i in range(120)
+        )
+        # Repeated sources, so paging has to break ties on id
+        MailAlias.objects.using('mail_data').bulk_create(
+            MailAlias(domain=self.domain, source=f"team{i % 40}@example.com", destination=f"user{i:03d}@example.com",
+                      managed_by_platform=True)
+            for i in range(130)
+        )
+        admin = User.objects.create_superuser('admin@example.com', 'admin@example.com', 'unused')
+        self.client.force_login(admin)
+
+    def walk(self, url_name, rows_key, next_key, **params):
+        response = self.client.get(reverse(url_name, args=[self.domain.id]), params)
+        rows = list(response.context[rows_key])
+        while response.context[next_key]:
+            response = self.client.get(f"{reverse(url_name, args=[self.domain.id])}?{response.context[next_key]}")
+            rows += response.context[rows_key]
+        return rows
+
+    def test_manage_domain_renders_first_pages_with_totals(self):
+        response = self.client.get(reverse('manage_domain', args=[self.domain.id]))
+        self.assertEqual(len(response.context['users']), views.LIST_PAGE_SIZE)
+        self.assertEqual(len(response.context['aliases']), views.LIST_PAGE_SIZE)
+        self.assertEqual(response.context['usage']['users_used'], 120)
+        self.assertEqual(response.context['usage']['aliases_used'], 130)
+        self.assertContains(response, 'hx-trigger="revealed"')
+
+    def test_pages_cover_every_row_once(self):
+        users = self.walk('user_list', 'users', 'users_next_query')
+        self.assertEqual([user.email for user in users], [f"user{i:03d}@example.com" for i in range(120)])
+
+        aliases = self.walk('alias_list', 'aliases', 'aliases_next_query')
+        self.assertEqual(len(aliases), 130)
+        self.assertEqual(len({alias.id for alias in aliases}), 130)
+        self.assertEqual([(a.source, a.id) for a in aliases], sorted((a.source, a.id) for a in aliases))
+
+    def test_search_filters_in_the_database(self):
+        users = self.walk('user_list', 'users', 'users_next_query', q="USER11")
+        self.assertEqual([user.email for user in users], [f"user11{i}@example.com" for i in range(10)])
+        aliases = self.walk('alias_list', 'aliases', 'aliases_next_query', q="team7@")
+        self.assertEqual({alias.destination for alias in aliases}, {"user007@example.com", "user047@example.com",
+                                                                     "user087@example.com", "user127@example.com"})
+
+    def test_unchanged_lists_answer_304(self):
+        url = reverse('alias_list', args=[self.domain.id])
+        response = self.client.get(url, HTTP_HX_REQUEST='true')
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+        with CaptureQueriesContext(connections['mail_data']) as queries:
+            response = self.client.get(url, HTTP_HX_REQUEST='true', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        # Answered from the domain and its counters row, without reading the aliases
+        self.assertEqual(len(queries), 2)
+
+        # An edit changes no counts but still moves the ETag
+        alias = MailAlias.objects.using('mail_data').order_by('id').first()
+        self.client.post(reverse('edit_alias', args=[alias.id]), {'destination': "new@example.net"}, HTTP_HX_REQUEST='true')
+        # The edit's flash message was consumed by its own response
+        response = self.client.get(url, HTTP_HX_REQUEST='true', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        user_url = reverse('user_list', args=[self.domain.id])
+        etag = self.client.get(user_url, HTTP_HX_REQUEST='true')['ETag']
+        # delete_user removes the maildir with sudo rm; keep it off the host
+        with mock.patch('core.views.subprocess.run') as run:
+            self.client.delete(reverse('delete_user', args=["user000@example.com"]), HTTP_HX_REQUEST='true')
+        run.assert_called_once()
+        response = self.client.get(user_url, HTTP_HX_REQUEST='true', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "user000@example.com")
+
+    def test_alias_mutations_return_row_deltas(self):
+        alias = MailAlias.objects.using('mail_data').order_by('id').first()
+
+        response = self.client.post(reverse('edit_alias', args=[alias.id]), {'destination': "new@example.net"},
+                                    HTTP_HX_REQUEST='true')
+        html = response.content.decode()
+        self.assertTrue(html.startswith(f'<tr id="alias-row-{alias.id}"'))
+        self.assertIn("new@example.net", html)
+        self.assertIn('<div id="alias-edit-modal" hx-swap-oob="true">', html)
+        self.assertNotIn('id="alias-rows"', html)
+
+        response = self.client.post(reverse('add_alias', args=[self.domain.id]),
+                                    {'source': "sales", 'destination': "user001@example.com"}, HTTP_HX_REQUEST='true')
+        html = response.content.decode()
+        self.assertIn("sales@example.com", html)
+        self.assertIn('id="alias-rows-empty" hx-swap-oob="delete"', html)
+        self.assertEqual(response.context['usage']['aliases_used'], 131)
+
+        response = self.client.post(reverse('delete_alias', args=[alias.id]), HTTP_HX_REQUEST='true')
+        html = response.content.decode()
+        self.assertIn('<div id="usage-meters" class="space-y-8" hx-swap-oob="true">', html)
+        self.assertIn('id="messages" hx-swap-oob="true"', html)
+        self.assertNotIn("<tr", html)
+        self.assertEqual(response.context['usage']['aliases_used'], 130)
+
+
+class DomainUsageTests(UnmanagedTablesMixin, TransactionTestCase):
+    databases = {'default', 'mail_data'}
+    unmanaged_models = (MailDomain, MailUser, MailAlias, DomainUsage)
+
+    def setUp(self):
+        cache.clear()
+        self.domain = MailDomain.objects.using('mail_data').create(name="example.com")
+        MailPlan.objects.create(name="Standard", quota_mb=100, max_users=3, max_aliases=1)
+        for i in range(2):
+            email = f"user{i}@example.com"
+            MailUser.objects.using('mail_data').create(uid=email, email=email, password='x', full_name=email,
+                                                       domain=self.domain, quota_kb=102400)
+        MailAlias.objects.using('mail_data').create(domain=self.domain, source="postmaster@example.com",
+                                                    destination="user0@example.com")
+        admin = User.objects.create_superuser('admin@example.com', 'admin@example.com', 'unused')
+        self.client.force_login(admin)
+
+    def add_user(self, username):
+        # Not through the host's provisiond socket
+        with mock.patch('core.views.provision.request_maildirs', return_value={'created': [], 'errors': {}}):
+            return self.client.post(reverse('add_user', args=[self.domain.id]), {'username': username},
+                                    HTTP_HX_REQUEST='true')
+
+    def test_counters_are_created_from_exact_counts(self):
+        usage = get_usage(self.domain)
+        self.assertEqual((usage.mailboxes, usage.aliases, usage.platform_aliases, usage.quota_kb), (2, 1, 0, 204800))
+        with self.assertNumQueries(1, using='mail_data'):
+            get_usage(self.domain)
+
+    def test_mutations_keep_counters_exact(self):
+        version = get_usage(self.domain).version
+        self.assertEqual(self.add_user("sales").context['usage']['users_used'], 3)
+        # The plan allows 3 mailboxes
+        self.add_user("extra")
+        self.assertFalse(MailUser.objects.using('mail_data').filter(email="extra@example.com").exists())
+
+        # Only platform-managed aliases count towards the plan's one alias
+        response = self.client.post(reverse('add_alias', args=[self.domain.id]),
+                                    {'source': "info", 'destination': "user0@example.com"}, HTTP_HX_REQUEST='true')
+        self.assertEqual(response.context['usage']['aliases_used'], 2)
+        self.client.post(reverse('add_alias', args=[self.domain.id]),
+                         {'source': "help", 'destination': "user0@example.com"}, HTTP_HX_REQUEST='true')
+        self.assertFalse(MailAlias.objects.using('mail_data').filter(source="help@example.com").exists())
+        with mock.patch('core.views.subprocess.run') as run:
+            self.client.delete(reverse('delete_user', args=["user1@example.com"]), HTTP_HX_REQUEST='true')
+        run.assert_called_once()
+
+        usage = get_usage(self.domain)
+        self.assertGreater(usage.version, version)
+        self.assertEqual(count_usage(self.domain), {
+            'mailboxes': usage.mailboxes, 'aliases': usage.aliases,
+            'platform_aliases': usage.platform_aliases, 'quota_kb': usage.quota_kb,
+        })
+        self.assertEqual((usage.mailboxes, usage.aliases, usage.platform_aliases), (2, 2, 1))
+
+
+class DoveadmStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like doveadm
+
+    def do_POST(self):
+        commands = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append((self.client_address, self.headers['Authorization'], commands))
+        replies = []
+        for name, parameters, tag in commands:
+            used = self.server.usage.get(parameters.get('user'))
+            if name in ('reload', 'quotaRecalc') or (name == 'quotaGet' and used is not None):
+                rows = []
+                if name == 'quotaGet':
+                    rows = [{'root': "User quota", 'type': 'STORAGE', 'value': str(used), 'limit': '102400',
+                             'percent': str(used * 100 // 102400)},
+                            {'root': "User quota", 'type': 'MESSAGE', 'value': '12', 'limit': '-', 'percent': '0'}]
+                replies.append(['doveadmResponse', rows, tag])
+            else:
+                replies.append(['error', {'type': 'exitCode', 'exitCode': 67}, tag])
+        body = json.dumps(replies).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DoveadmStub(ThreadingHTTPServer):
+    """Local stand-in for Dovecot's doveadm HTTP API; usage maps mailbox -> KiB used."""
+
+    def __init__(self, usage):
+        super().__init__(('127.0.0.1', 0), DoveadmStubHandler)
+        self.usage = usage
+        self.requests = []
+        self.url = f"http://127.0.0.1:{self.server_address[1]}/doveadm/v1"
+
+
+class MailMonitorTests(UnmanagedTablesMixin, TransactionTestCase):
+    """mail_monitor's SQL, run through pymysql against the test database as the daemon would."""
+    databases = {'default', 'mail_data'}
+    unmanaged_models = (MailDomain, MailUser, MailAlias, DomainStats, DomainUsage, ServerHealth, TrafficHourly, TrafficDaily)
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE log_checkpoints (
+                    path VARCHAR(255) NOT NULL PRIMARY KEY,
+                    inode BIGINT UNSIGNED NOT NULL,
+                    byte_offset BIGINT UNSIGNED NOT NULL DEFAULT 0,
+                    state_json MEDIUMTEXT NULL
+                )
+            """)
+
+    @classmethod
+    def tearDownClass(cls):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE log_checkpoints")
+        super().tearDownClass()
+
+    def setUp(self):
+        self.conn = self.monitor_db()
+        self.addCleanup(self.conn.close)
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM log_checkpoints")
+        super().tearDown()
+
+    def monitor_db(self):
+        settings = connection.settings_dict
+        return pymysql.connect(host=settings['HOST'], port=int(settings['PORT']), user=settings['USER'],
+                               password=settings['PASSWORD'], database=settings['NAME'],
+                               cursorclass=pymysql.cursors.DictCursor)
+
+    def query(self, sql):
+        with self.conn.cursor() as cursor:
+            cursor.execute(sql)
+            rows = cursor.fetchall()
+        self.conn.commit()
+        return rows
+
+    def test_compaction_rolls_up_complete_days_only(self):
+        today = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        cutoff = today - datetime.timedelta(days=mail_monitor.HOURLY_RETENTION_DAYS)
+        hours = [
+            (cutoff - datetime.timedelta(hours=1), 4),   # past retention: rolled up, then dropped
+            (cutoff, 1),                                 # oldest hour kept
+            (today - datetime.timedelta(days=1), 2),
+            (today - datetime.timedelta(hours=1), 3),
+            (today, 7),                                  # today is not complete yet
+        ]
+        with self.conn.cursor() as cursor:
+            mail_monitor.write_rollups(cursor, [("example.com", '', bucket, sent, 0, 0, 0, 0) for bucket, sent in hours])
+            # A day whose hours were dropped long ago stays as it is
+            cursor.execute("INSERT INTO traffic_daily (domain_name, mailbox, day, sent, received, bounced, deferred, rejected) "
+                           "VALUES ('example.com', '', %s, 9, 0, 0, 0, 0)", ((cutoff - datetime.timedelta(days=5)).date(),))
+            mail_monitor.compact_rollups(cursor)
+            # Re-running recomputes the same totals instead of adding to them
+            mail_monitor.compact_rollups(cursor)
+        self.conn.commit()
+
+        daily = {row['day']: row['sent'] for row in self.query("SELECT day, sent FROM traffic_daily")}
+        self.assertEqual(daily, {
+            (cutoff - datetime.timedelta(days=5)).date(): 9,
+            (cutoff - datetime.timedelta(days=1)).date(): 4,
+            cutoff.date(): 1,
+            (today - datetime.timedelta(days=1)).date(): 5,
+        })
+        self.assertEqual([row['bucket'] for row in self.query("SELECT bucket FROM traffic_hourly ORDER BY bucket")],
+                         [bucket for bucket, _ in hours[1:]])
+
+    def test_first_run_replaces_the_counters(self):
+        log = tempfile.NamedTemporaryFile('w', suffix='.log', delete=False)
+        self.addCleanup(os.unlink, log.name)
+        log.writelines(QueueCorrelatorTests.MESSAGE + QueueCorrelatorTests.DELIVERIES)
+        log.close()
+        MailDomain.objects.using('mail_data').create(name="example.com")
+        # Totals from before the upgrade, with no checkpoint yet
+        DomainStats.objects.using('mail_data').create(domain_name="example.com", sent_count=500, received_count=900)
+
+        with mock.patch.object(mail_monitor, 'get_db_connection', self.monitor_db), \
+                mock.patch.object(mail_monitor, 'MAIL_LOG', log.name):
+            mail_monitor.main()
+            stats = DomainStats.objects.using('mail_data').get(domain_name="example.com")
+            self.assertEqual((stats.sent_count, stats.received_count), (0, 1))
+
+            # From the checkpoint on, runs add to them
+            with open(log.name, 'a') as f:
+                f.write(postfix_line('07:05:00', 'qmgr', "ABC125: from=<alice@example.com>, size=10, nrcpt=1 (queue active)"))
+                f.write(postfix_line('07:05:01', 'smtp', "ABC125: to=<dave@example.org>, relay=mx.example.org[198.51.100.2]:25, "
+                                     "delay=1, dsn=2.0.0, status=sent (250 ok)"))
+            mail_monitor.main()
+            stats.refresh_from_db()
+            self.assertEqual((stats.sent_count, stats.received_count), (1, 1))
+        self.assertEqual(self.query("SELECT byte_offset FROM log_checkpoints")[0]['byte_offset'], os.path.getsize(log.name))
+
+    def test_backfill_merges_rotated_files_oldest_first(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        live = os.path.join(directory, 'mail.log')
+        sent = lambda clock, qid, sender: [
+            postfix_line(clock, 'qmgr', f"{qid}: from=<{sender}>, size=10, nrcpt=1 (queue active)"),
+            postfix_line(clock, 'smtp', f"{qid}: to=<x@example.org>, relay=mx.example.org[198.51.100.2]:25, "
+                         "delay=1, dsn=2.0.0, status=sent (250 ok)"),
+        ]
+        with gzip.open(live + '.2.gz', 'wt') as f:
+            f.writelines(sent('07:00:00', 'ABC121', "alice@example.com"))
+        with open(live + '.1', 'w') as f:
+            f.writelines(sent('08:00:00', 'ABC122', "alice@example.com") + sent('08:10:00', 'ABC123', "bob@example.com"))
+        with open(live, 'w') as f:
+            f.writelines(sent('09:00:00', 'ABC124', "alice@example.com"))
+            # Still queued when the backfill reads it
+            f.write(postfix_line('09:30:00', 'qmgr', "ABC125: from=<bob@example.com>, size=10, nrcpt=1 (queue active)"))
+
+        MailDomain.objects.using('mail_data').create(name="example.com")
+        DomainStats.objects.using('mail_data').create(domain_name="example.com", sent_count=500, received_count=900)
+        with self.conn.cursor() as cursor:
+            mail_monitor.write_rollups(cursor, [
+                ("example.com", '', datetime.datetime(2026, 1, 27, 5), 6, 0, 0, 0, 0),   # before the logs: kept
+                ("example.com", '', datetime.datetime(2026, 1, 28, 7), 50, 0, 0, 0, 0),  # rebuilt, not added to
+            ])
+        self.conn.commit()
+
+        with mock.patch.object(mail_monitor, 'get_db_connection', self.monitor_db), \
+                mock.patch.object(mail_monitor, 'MAIL_LOG', live):
+            mail_monitor.backfill(workers=3)
+
+        stats = DomainStats.objects.using('mail_data').get(domain_name="example.com")
+        self.assertEqual((stats.sent_count, stats.received_count, stats.top_sender), (4, 0, "alice@example.com"))
+        hourly = self.query("SELECT bucket, sent FROM traffic_hourly WHERE mailbox = '' ORDER BY bucket")
+        self.assertEqual([(row['bucket'].day, row['bucket'].hour, row['sent']) for row in hourly],
+                         [(27, 5, 6), (28, 7, 1), (28, 8, 2), (28, 9, 1)])
+        checkpoint = self.query("SELECT inode, byte_offset, state_json FROM log_checkpoints")[0]
+        self.assertEqual((checkpoint['inode'], checkpoint['byte_offset']), (os.stat(live).st_ino, os.path.getsize(live)))
+        self.assertEqual([item['qid'] for item in json.loads(checkpoint['state_json'])], ['ABC125'])
+
+
+class DoveadmClientTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.stub = DoveadmStub({f"user{i}@example.com": i * 1024 for i in range(250)})
+        threading.Thread(target=self.stub.serve_forever, daemon=True).start()
+        settings = override_settings(DOVEADM_URL=self.stub.url, DOVEADM_API_KEY="secret")
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def tearDown(self):
+        self.stub.shutdown()
+        self.stub.server_close()
+
+    def test_quotas_are_batched_and_cached(self):
+        emails = ["user1@example.com", "user50@example.com", "missing@example.com"]
+        quotas = doveadm.get_quotas(emails)
+        self.assertEqual(quotas["user50@example.com"], {'used': 50 * 1024 * 1024, 'limit': 102400 * 1024, 'percent': 50})
+        self.assertNotIn("missing@example.com", quotas)
+        self.assertEqual(len(self.stub.requests), 1)
+        self.assertEqual(self.stub.requests[0][1], "X-Dovecot-API c2VjcmV0")
+
+        self.assertEqual(doveadm.get_quotas(emails[:2]), {email: quotas[email] for email in emails[:2]})
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_large_domains_share_one_connection(self):
+        quotas = doveadm.get_quotas([f"user{i}@example.com" for i in range(250)])
+        self.assertEqual(len(quotas), 250)
+        self.assertEqual([len(commands) for _, _, commands in self.stub.requests], [100, 100, 50])
+        self.assertEqual(len({address for address, _, _ in self.stub.requests}), 1)
+
+    def test_reload_and_recalc_drop_cached_quotas(self):
+        doveadm.get_quotas(["user1@example.com"])
+        doveadm.reload()
+        self.assertEqual(doveadm.recalc_quotas(["user1@example.com"]), [])
+        doveadm.get_quotas(["user1@example.com"])
+        self.assertEqual([commands[0][0] for _, _, commands in self.stub.requests],
+                         ['quotaGet', 'reload', 'quotaRecalc', 'quotaGet'])
+
+    def test_unavailable_api_raises(self):
+        self.stub.shutdown()
+        self.stub.server_close()
+        with self.assertRaises(doveadm.DoveadmError):
+            doveadm.get_quotas(["user1@example.com"])
+
+    def test_reload_without_api_key_uses_the_command(self):
+        with override_settings(DOVEADM_API_KEY=""):
+            with mock.patch.object(doveadm, 'RELOAD_COMMAND', ('true',)):
+                doveadm.reload()
+            with mock.patch.object(doveadm, 'RELOAD_COMMAND', ('false',)), self.assertRaises(doveadm.DoveadmError):
+                doveadm.reload()
+        self.assertEqual(self.stub.requests, [])
+
+    def test_recalc_runs_in_the_background(self):
+        doveadm.get_quotas(["user1@example.com"])
+        thread = doveadm.recalc_quotas_later(["user1@example.com", "user2@example.com"])
+        self.assertIsNone(cache.get(doveadm.quota_key("user1@example.com")))
+        thread.join(5)
+        self.assertEqual([name for name, _, _ in self.stub.requests[1][2]], ['quotaRecalc', 'quotaRecalc'])
+
+
+class ProvisionTests(SimpleTestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base)
+        self.socket_path = os.path.join(self.base, 'provision.sock')
+        os.mkdir(os.path.join(self.base, 'vmail'))
+        # Owned by whoever runs the tests, so no root is needed
+        provisioner = provision.Provisioner(os.path.join(self.base, 'vmail'), pwd.getpwuid(os.getuid()).pw_name)
+        self.server = provision.ProvisionServer(self.socket_path, provisioner)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_creates_maildirs_in_one_request(self):
+        reply = provision.request_maildirs([('example.com', 'alice'), ('example.com', 'bob')], self.socket_path)
+        self.assertEqual(reply, {'created': ['alice@example.com', 'bob@example.com'], 'errors': {}})
+        for user in ('alice', 'bob'):
+            for sub in provision.MAILDIR_SUBDIRS:
+                path = os.path.join(self.base, 'vmail', 'example.com', user, sub)
+                self.assertTrue(os.path.isdir(path))
+                self.assertEqual(os.stat(path).st_mode & 0o777, 0o700)
+
+        again = provision.request_maildirs([('example.com', 'alice')], self.socket_path)
+        self.assertEqual(again, {'created': [], 'errors': {}})
+
+    def test_bad_names_and_obstacles_are_reported(self):
+        os.makedirs(os.path.join(self.base, 'vmail', 'example.com'))
+        open(os.path.join(self.base, 'vmail', 'example.com', 'carol'), 'w').close()
+        reply = provision.request_maildirs(
+            [('example.com', '..'), ('example.com', 'a/b'), ('example.com', 'carol'), ('example.com', 'dave')],
+            self.socket_path)
+        self.assertEqual(reply['created'], ['dave@example.com'])
+        self.assertEqual(sorted(reply['errors']), ['..@example.com', 'a/b@example.com', 'carol@example.com'])
+        self.assertTrue(os.path.isfile(os.path.join(self.base, 'vmail', 'example.com', 'carol')))
+
+    def test_unavailable_service_raises(self):
+        with self.assertRaises(provision.ProvisionError):
+            provision.request_maildirs([('example.com', 'alice')], os.path.join(self.base, 'missing.sock'))
+
+    def test_garbled_reply_raises(self):
+        garbled = os.path.join(self.base, 'garbled.sock')
+
+        class Truncating(socketserver.StreamRequestHandler):
+            def handle(self):
+                self.rfile.readline()
+                self.wfile.write(b'{"created": ["alice@exa\n')
+
+        server = socketserver.UnixStreamServer(garbled, Truncating)
+        self.addCleanup(server.server_close)
+        threading.Thread(target=server.handle_request, daemon=True).start()
+        with self.assertRaises(provision.ProvisionError):
+            provision.request_maildirs([('example.com', 'alice')], garbled)
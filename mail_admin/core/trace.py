@@ -0,0 +1,190 @@
+"""
+Message traces rebuilt from the log index (core.logindex), never from the
+live logs.
+
+trace() starts from an address, message-id or queue ID and follows links
+between indexed events: a queue ID ties the smtpd, cleanup, qmgr and
+delivery lines of one message together, a message-id ties in Rspamd's
+verdict, Dovecot's store and any re-queued copy, and a bounce line points
+at the queue ID of its non-delivery notice. Each message comes back as a
+MessageTrace of time-ordered stages with the delay between them, plus the
+alias hops (orig_to -> to) its deliveries went through.
+
+Plain Python (no Django imports), shared by log_index.py --trace and the
+trace page.
+"""
+import re
+from collections import namedtuple
+
+from .logindex import RETENTION_DAYS, RSPAMD_ACTION_RE, any_of
+from .maillog import DELIVERY_AGENTS, QUEUE_RE, parse_fields, relay_host
+
+# Messages shown per trace, and how far links are followed from the first matches
+MAX_MESSAGES = 20
+MAX_ROUNDS = 3
+SEED_LIMIT = 200
+LINK_LIMIT = 2000
+
+NOTIFICATION_RE = re.compile(r'notification: (?P<qid>\w+)$')
+LOCAL_AGENTS = frozenset(('lmtp', 'virtual', 'local'))
+
+Stage = namedtuple('Stage', 'time name program detail since_start since_previous')
+Stage.__doc__ = "One step of a message's path; the since_* delays are in seconds."
+Hop = namedtuple('Hop', 'original recipient status relay')
+Hop.__doc__ = "An alias expansion: mail for original was delivered to recipient (relay None for local delivery)."
+MessageTrace = namedtuple('MessageTrace', 'queue_id message_id sender client outcome duration stages hops')
+
+
+def matches(event, value):
+    """True when value is exactly one of the event's identifiers (FTS phrases also match substrings)."""
+    folded = value.lower()
+    return (event.queue_id == value or event.message_id == value
+            or (event.sender or '').lower() == folded
+            or folded in (event.recipient or '').lower().split())
+
+
+def trace(index, value, days=RETENTION_DAYS, max_messages=MAX_MESSAGES):
+    """
+    Returns: MessageTraces for the newest max_messages messages involving
+    value (address, message-id or queue ID), newest first.
+    Raises: sqlite3.Error for an unreadable index partition.
+    """
+    value = value.strip()
+    pairs = [(column, value) for column in ('queue_id', 'message_id', 'sender', 'recipient')]
+    seeds = [event for event in index.match(any_of(pairs), days, SEED_LIMIT) if matches(event, value)]
+
+    queue_ids, message_ids = {}, {}
+    for event in seeds:
+        if event.queue_id and len(queue_ids) < max_messages:
+            queue_ids.setdefault(event.queue_id)
+        if event.message_id:
+            message_ids.setdefault(event.message_id)
+    # NOQUEUE rejects have nothing to follow
+    loose = [event for event in reversed(seeds) if not (event.queue_id or event.message_id)]
+
+    # Every round re-reads all linked IDs, so the last read holds each message complete
+    # and in indexing order (which breaks ties between lines logged in the same second)
+    linked = []
+    for _ in range(MAX_ROUNDS + 1):
+        pairs = [('queue_id', qid) for qid in queue_ids] + [('message_id', mid) for mid in message_ids]
+        linked = [event for event in reversed(index.match(any_of(pairs), days, LINK_LIMIT))
+                  if event.queue_id in queue_ids or event.message_id in message_ids]
+        known = len(queue_ids) + len(message_ids)
+        for event in linked:
+            if event.message_id:
+                message_ids.setdefault(event.message_id)
+            if event.queue_id and len(queue_ids) < max_messages:
+                queue_ids.setdefault(event.queue_id)
+            notice = NOTIFICATION_RE.search(event.message) if event.program == 'postfix/bounce' else None
+            if notice and len(queue_ids) < max_messages:
+                queue_ids.setdefault(notice.group('qid'))
+        if len(queue_ids) + len(message_ids) == known:
+            break
+
+    traces = [build_trace(group) for group in group_events(linked + loose)]
+    traces.sort(key=lambda item: item.stages[0].time, reverse=True)
+    return traces[:max_messages]
+
+
+def group_events(events):
+    """
+    Split events into one time-ordered list per message: by queue ID, with
+    Dovecot and other queue-less events placed under the message carrying
+    their message-id that started last before them. Anything left (NOQUEUE
+    rejects) is a message of its own.
+    """
+    by_queue, loose = {}, []
+    for event in sorted(dict.fromkeys(events), key=lambda event: event.time):
+        if event.queue_id:
+            by_queue.setdefault(event.queue_id, []).append(event)
+        else:
+            loose.append(event)
+    groups = list(by_queue.values())
+    for event in loose:
+        candidates = [group for group in groups if event.message_id and any(
+            item.message_id == event.message_id for item in group)]
+        if not candidates:
+            groups.append([event])
+            continue
+        started = [group for group in candidates if group[0].time <= event.time] or candidates
+        target = max(started, key=lambda group: group[0].time)
+        target.append(event)
+        target.sort(key=lambda event: event.time)
+    return groups
+
+
+def stage_name(event, agent, status):
+    if event.source == 'rspamd':
+        return 'spam scan'
+    if event.source == 'dovecot':
+        return 'stored' if status == 'saved' else status or event.program
+    if status == 'rejected':
+        return 'rejected'
+    if agent == 'smtpd':
+        return 'connect'
+    if agent == 'pickup':
+        return 'local submission'
+    if agent == 'qmgr':
+        return status or 'queued'
+    if agent == 'bounce':
+        return 'bounce notice'
+    if agent in DELIVERY_AGENTS and status:
+        if status == 'sent':
+            return 'delivered' if agent in LOCAL_AGENTS else 'relayed'
+        return status
+    return agent
+
+
+def build_trace(group):
+    stages, hops, outcomes = [], [], []
+    first = previous = group[0].time
+    for event in group:
+        agent = event.program.rpartition('/')[2]
+        detail = event.message
+        queued = QUEUE_RE.match(event.message) if event.source == 'postfix' else None
+        if queued:
+            detail = queued.group('rest')
+        if event.source == 'rspamd':
+            verdict = RSPAMD_ACTION_RE.search(event.message)
+            detail = f"{verdict.group('action')}, score {verdict.group('score')}" if verdict else event.status or ''
+        elif queued and agent in DELIVERY_AGENTS and event.status:
+            fields = parse_fields(queued.group('rest'))
+            outcomes.append(event.status)
+            if fields.get('orig_to') and fields.get('to') and fields['orig_to'].lower() != fields['to'].lower():
+                relay = relay_host(fields.get('relay')) if agent not in LOCAL_AGENTS else None
+                hops.append(Hop(fields['orig_to'], fields['to'], event.status, relay))
+        elif event.status == 'rejected':
+            outcomes.append('rejected')
+        stages.append(Stage(
+            time=event.time,
+            name=stage_name(event, agent, event.status),
+            program=event.program,
+            detail=detail,
+            since_start=(event.time - first).total_seconds(),
+            since_previous=(event.time - previous).total_seconds(),
+        ))
+        previous = event.time
+
+    known = lambda field: next((getattr(event, field) for event in group if getattr(event, field)), None)
+    return MessageTrace(
+        queue_id=known('queue_id'),
+        message_id=known('message_id'),
+        sender=next((event.sender for event in group if event.source == 'postfix' and event.sender is not None), None),
+        client=known('client'),
+        outcome=outcome(outcomes),
+        duration=(group[-1].time - first).total_seconds(),
+        stages=stages,
+        hops=hops,
+    )
+
+
+def outcome(statuses):
+    """One word for a message's fate from its delivery statuses, in order."""
+    if not statuses:
+        return 'in progress'
+    for final in ('rejected', 'bounced', 'expired'):
+        if final in statuses:
+            return final
+    if statuses[-1] == 'deferred':
+        return 'deferred'
+    return 'delivered'
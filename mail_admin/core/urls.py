@@ -24,6 +24,9 @@ urlpatterns = [
     path('server-health/', views.server_health, name='server_health'),
     path('audit-logs/', views.audit_logs, name='audit_logs'),
     path('system-logs/', views.system_logs, name='system_logs'),
+    path('system-logs/stream/', views.system_logs_stream, name='system_logs_stream'),
+    path('log-search/', views.log_search, name='log_search'),
+    path('log-search/trace/', views.message_trace, name='message_trace'),
     path('plans/', views.manage_plans, name='manage_plans'),
     path('plans/delete/<int:plan_id>/', views.delete_plan, name='delete_plan'),
     path('admins/', views.manage_admins, name='manage_admins'),
@@ -0,0 +1,69 @@
+"""
+Maintained per-domain usage counters (the domain_usage table).
+
+The platform's writes adjust the counters inside the same mail_data
+transaction as the users/aliases rows they change, so plan limit checks and
+usage meters read one row instead of counting. Writers outside the app
+(migration scripts, manual SQL) cause drift, which mail_monitor's
+reconcile_usage() corrects periodically.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+
+from .models import DomainUsage, MailAlias, MailUser
+
+
+def count_usage(domain):
+    """Exact counters for a domain, counted from users and aliases."""
+    users = MailUser.objects.using('mail_data').filter(domain=domain).aggregate(
+        mailboxes=Count('pk'), quota_kb=Sum('quota_kb'))
+    aliases = MailAlias.objects.using('mail_data').filter(domain=domain).aggregate(
+        aliases=Count('pk'), platform_aliases=Count('pk', filter=Q(managed_by_platform=True)))
+    return {
+        'mailboxes': users['mailboxes'],
+        'quota_kb': users['quota_kb'] or 0,
+        'aliases': aliases['aliases'],
+        'platform_aliases': aliases['platform_aliases'],
+    }
+
+
+def get_usage(domain, for_update=False):
+    """
+    The domain's DomainUsage row, created from exact counts on first use.
+
+    for_update=True locks the row until the caller's
+    transaction.atomic(using='mail_data') block ends, so a limit check and
+    the write it guards cannot interleave with another request's. Callers
+    that go on to adjust_usage() must fetch the row before their write.
+    """
+    rows = DomainUsage.objects.using('mail_data')
+    if for_update:
+        rows = rows.select_for_update()
+    usage = rows.filter(domain_name=domain.name).first()
+    if usage is None:
+        try:
+            with transaction.atomic(using='mail_data'):
+                DomainUsage.objects.using('mail_data').create(domain_name=domain.name, **count_usage(domain))
+        except IntegrityError:
+            pass  # Created by a concurrent request
+        usage = rows.get(domain_name=domain.name)
+    return usage
+
+
+def adjust_usage(domain, **deltas):
+    """
+    Add deltas (e.g. mailboxes=1, quota_kb=-1048576) to a domain's counters.
+    Without deltas only the version moves, for edits that change no counts.
+    """
+    DomainUsage.objects.using('mail_data').filter(domain_name=domain.name).update(
+        version=F('version') + 1,
+        **{field: F(field) + delta for field, delta in deltas.items()},
+    )
+
+
+def set_mailbox_quota(domain, quota_kb):
+    """Counters after every mailbox of the domain was set to quota_kb."""
+    DomainUsage.objects.using('mail_data').filter(domain_name=domain.name).update(
+        version=F('version') + 1,
+        quota_kb=F('mailboxes') * quota_kb,
+    )
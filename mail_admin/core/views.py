@@ -5,20 +5,38 @@ from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_http_methods
 from django.contrib import messages
-from django.http import HttpResponse, HttpResponseForbidden
-from .models import MailDomain, MailUser, MailAlias, AdminLog, DomainStats, ServerHealth, MailPlan, DomainAllocation, DomainAssignment
+from django.http import HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from .models import MailDomain, MailUser, MailAlias, AdminLog, DomainStats, ServerHealth, MailPlan, DomainAllocation, DomainAssignment, TrafficHourly, TrafficDaily
 from .auth_backend import CheckMailServerBackend
+from .plans import current_version as plans_version, get_plan_catalog, invalidate_plan_catalog
+from .authz import current_version as authz_version, get_authz
+from . import doveadm, logstream, provision, services
+from .usage import adjust_usage, get_usage, set_mailbox_quota
+from .journal import JournalReader, syslog_line
+from .logtail import tail_lines
+from .logindex import RETENTION_DAYS as LOG_INDEX_DAYS, LogIndex
+from .trace import trace as trace_messages
 import secrets
+import sqlite3
 import string
 import os
 import shutil
 import subprocess
-import shlex
 import re
 from passlib.hash import sha512_crypt
 import requests
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 import json
+import time
+from django.db.models import IntegerField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import urlencode
+from django.utils.safestring import mark_safe
+import datetime
 import logging
 
 logger = logging.getLogger(__name__)
@@ -38,37 +56,6 @@ def generate_password(length=16):
     alphabet = string.ascii_letters + string.digits + "!@#$%^&*()-_=+"
     return ''.join(secrets.choice(alphabet) for i in range(length))
 
-def get_managed_domains(user):
-    """
-    Get a list of domain names that the user is allowed to manage.
-    Returns: list of strings (domain names).
-    """
-    if user.is_superuser:
-        # Superuser can manage ALL domains
-        return list(MailDomain.objects.using('mail_data').values_list('name', flat=True))
-        
-    # Check for explicit DomainAssignment
-    assigned_domains = list(DomainAssignment.objects.filter(user=user).values_list('domain_name', flat=True))
-    if assigned_domains:
-        return assigned_domains
-        
-    # Legacy Fallback: infer from email
-    try:
-        domain_part = user.username.split('@')[1]
-        if MailDomain.objects.using('mail_data').filter(name=domain_part).exists():
-            return [domain_part]
-    except IndexError:
-        pass
-        
-    return []
-
-def is_protected_account(email):
-    """
-    Returns True if the email belongs to a Django superuser.
-    This prevents domain admins from managing superuser mail accounts.
-    """
-    return User.objects.filter(username=email, is_superuser=True).exists()
-
 def verify_turnstile(token):
     """Verify Cloudflare Turnstile token."""
     if not token:
@@ -94,15 +81,264 @@ def verify_turnstile(token):
 
 def get_effective_plan(domain_name):
     """
-    Get the effective MailPlan for a domain.
+    Get the effective MailPlan for a domain, from the cached plan catalog.
     Falls back to 'Standard' if no allocation exists.
     """
+    return get_plan_catalog().plan_for(domain_name)
+
+def get_effective_plans(domain_names):
+    """
+    Bulk get_effective_plan().
+    Returns: dict of domain name -> MailPlan (or None).
+    """
+    return get_plan_catalog().plans_for(domain_names)
+
+TRAFFIC_FIELDS = ('sent', 'received', 'bounced', 'deferred', 'rejected')
+# Spans up to this long are summed from hourly buckets; longer ones use daily rows.
+HOURLY_SPAN = datetime.timedelta(hours=48)
+
+def traffic_totals(since, group_by='domain_name', **filters):
+    """
+    Sum traffic rollup buckets from `since` until now.
+    Filters default to domain totals (mailbox=''); pass mailbox__gt='' for per-mailbox rows.
+    Returns: dict of group_by value -> {'sent', 'received', 'bounced', 'deferred', 'rejected'}.
+    """
+    if not any(key.startswith('mailbox') for key in filters):
+        filters['mailbox'] = ''
+    now = timezone.now()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    sums = {field: Sum(field) for field in TRAFFIC_FIELDS}
+
+    hourly = TrafficHourly.objects.using('mail_data').filter(**filters)
+    if since >= now - HOURLY_SPAN:
+        querysets = [hourly.filter(bucket__gte=since)]
+    else:
+        # Complete days from the daily table, today so far from the hourly one
+        daily = TrafficDaily.objects.using('mail_data').filter(day__gte=since.date(), day__lt=today.date(), **filters)
+        querysets = [daily, hourly.filter(bucket__gte=today)]
+
+    totals = {}
+    for queryset in querysets:
+        for row in queryset.values(group_by).annotate(**sums):
+            entry = totals.setdefault(row[group_by], dict.fromkeys(TRAFFIC_FIELDS, 0))
+            for field in TRAFFIC_FIELDS:
+                entry[field] += row[field] or 0
+    return totals
+
+DASHBOARD_PAGE_SIZE = 50
+# sort option -> (annotation or field, descending)
+DASHBOARD_SORTS = {
+    'name_asc': ('name', False),
+    'name_desc': ('name', True),
+    'usage_high': ('sent_24h', True),
+    'usage_low': ('sent_24h', False),
+    'sent_high': ('sent', True),
+    'received_high': ('received', True),
+}
+
+def annotate_domain_traffic(domains, since):
+    """
+    Annotates a MailDomain queryset with sent, received, top_sender and
+    stats_updated from domain_stats and sent_24h/received_24h summed from
+    traffic_hourly since `since`.
+    Counts are coalesced to 0 so they sort and compare like plain columns.
+    """
+    stats = DomainStats.objects.using('mail_data').filter(domain_name=OuterRef('name'))
+    hourly = (TrafficHourly.objects.using('mail_data')
+              .filter(domain_name=OuterRef('name'), mailbox='', bucket__gte=since)
+              .values('domain_name'))
+
+    def recent(field):
+        total = hourly.annotate(total=Sum(field)).values('total')
+        return Coalesce(Subquery(total, output_field=IntegerField()), 0)
+
+    return domains.annotate(
+        sent=Coalesce(Subquery(stats.values('sent_count')[:1]), 0),
+        received=Coalesce(Subquery(stats.values('received_count')[:1]), 0),
+        top_sender=Subquery(stats.values('top_sender')[:1]),
+        stats_updated=Subquery(stats.values('updated_at')[:1]),
+        sent_24h=recent('sent'),
+        received_24h=recent('received'),
+    )
+
+def keyset_page(queryset, sort_by, after, size):
+    """
+    One page of `queryset` ordered by DASHBOARD_SORTS[sort_by], with name as
+    the tie-breaker. `after` is the cursor returned for the previous page
+    ("<value>:<name>", or just the name for name sorts); an unparseable
+    cursor starts from the beginning.
+    Returns: (list of rows, cursor for the next page or None).
+    """
+    key, descending = DASHBOARD_SORTS[sort_by]
+    if key == 'name':
+        queryset = queryset.order_by('-name' if descending else 'name')
+        if after:
+            queryset = queryset.filter(**{'name__lt' if descending else 'name__gt': after})
+    else:
+        queryset = queryset.order_by(f"-{key}" if descending else key, 'name')
+        value, _, name = after.partition(':')
+        try:
+            value = int(value)
+        except ValueError:
+            name = None
+        if name:
+            beyond = f"{key}__lt" if descending else f"{key}__gt"
+            queryset = queryset.filter(Q(**{beyond: value}) | Q(**{key: value, 'name__gt': name}))
+
+    rows = list(queryset[:size + 1])
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    last = rows[-1]
+    cursor = last.name if key == 'name' else f"{getattr(last, key)}:{last.name}"
+    return rows, cursor
+
+def domain_cards(domains):
+    """
+    Dashboard row data for MailDomains annotated by annotate_domain_traffic().
+    Returns: list of dicts, in the order given.
+    """
+    effective_plans = get_effective_plans([dom.name for dom in domains])
+
+    domain_list = []
+    for dom in domains:
+        plan_obj = effective_plans[dom.name]
+        current_plan = plan_obj.name if plan_obj else "Custom"
+        display_max_users = plan_obj.max_users if plan_obj else dom.max_users
+        display_max_aliases = plan_obj.max_aliases if plan_obj else dom.max_aliases
+
+        domain_list.append({
+            'id': dom.id,
+            'name': dom.name,
+            'plan_id': plan_obj.id if plan_obj else None,
+            'stats_updated': dom.stats_updated,
+            'max_users': display_max_users,
+            'max_aliases': display_max_aliases,
+            'is_active': dom.is_active,
+            'sent': dom.sent,
+            'received': dom.received,
+            'sent_24h': dom.sent_24h,
+            'received_24h': dom.received_24h,
+            'top_sender': dom.top_sender or "N/A",
+            'plan_name': current_plan
+        })
+    return domain_list
+
+# Keys carry the traffic window's hour, so entries rarely outlive it by much
+CARD_TIMEOUT = 2 * 3600
+
+def render_domain_rows(request, cards, since):
+    """
+    Rendered partials/domain_row.html for each domain_cards() entry, fetched
+    from the cache in one get_many() and rendered only on a miss. A card only
+    changes with its plan (and the plan catalog), the limits it shows (a
+    plan-less domain's own), is_active, its domain_stats row (mail_monitor
+    writes it together with the hourly traffic) or the hour the last-24h
+    window starts in, so those make up the key.
+    Returns: list of HTML strings, in the order given.
+    """
+    catalog_version = plans_version()
+    viewer = 'super' if request.user.is_superuser else 'admin'
+    window = since.strftime('%Y%m%d%H')
+
+    def key(card):
+        stamp = card['stats_updated'].timestamp() if card['stats_updated'] else 0
+        return (f"domain_card:{catalog_version}:{viewer}:{card['id']}:{card['plan_id']}:"
+                f"{card['max_users']}:{card['max_aliases']}:{int(card['is_active'])}:{stamp}:{window}")
+
+    keys = [key(card) for card in cards]
+    cached = cache.get_many(keys)
+    missing = {}
+    for k, card in zip(keys, cards):
+        if k not in cached:
+            missing[k] = render_to_string('partials/domain_row.html', {'dom': card}, request=request)
+    if missing:
+        cache.set_many(missing, CARD_TIMEOUT)
+        cached.update(missing)
+    return [mark_safe(cached[k]) for k in keys]
+
+def next_page_query(request, cursor):
+    """The current querystring with `after` set to cursor, or None when there is no next page."""
+    if not cursor:
+        return None
+    params = request.GET.copy()
+    params['after'] = cursor
+    return params.urlencode()
+
+LIST_PAGE_SIZE = 50
+
+def list_page(queryset, order, after, size=LIST_PAGE_SIZE):
+    """
+    One keyset page of queryset ordered by the `order` fields (together unique).
+    `after` is the JSON cursor returned for the previous page; an invalid one
+    starts from the beginning.
+    Returns: (list of rows, cursor for the next page or None).
+    """
+    queryset = queryset.order_by(*order)
     try:
-        alloc = DomainAllocation.objects.select_related('plan').get(domain_name=domain_name)
-        return alloc.plan
-    except DomainAllocation.DoesNotExist:
-        # Fallback to Standard
-        return MailPlan.objects.filter(name="Standard").first()
+        values = json.loads(after) if after else None
+    except ValueError:
+        values = None
+    if isinstance(values, list) and len(values) == len(order):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        beyond = Q()
+        for i, field in enumerate(order):
+            beyond |= Q(**dict(zip(order[:i], values[:i])), **{f"{field}__gt": values[i]})
+        queryset = queryset.filter(beyond)
+
+    rows = list(queryset[:size + 1])
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    cursor = json.dumps([getattr(rows[-1], field) for field in order])
+    return rows, cursor
+
+HEALTH_TRENDS = (('cpu', 'CPU'), ('ram', 'Memory'), ('disk', 'Disk'), ('load', 'Load (1m)'), ('iowait', 'I/O Wait'))
+
+def health_trends(hours=24):
+    """
+    Hourly trend per metric from the server_health summary rows.
+    Hourly averages are weighted by sample count; p95 and max are the worst
+    period values within the hour.
+    Returns: list of {'key', 'label', 'avg', 'p95', 'max', 'hours': [{'hour', 'avg', 'p95', 'max', 'height'}]}.
+    """
+    columns = [f"{key}_{stat}" for key, _ in HEALTH_TRENDS for stat in ('avg', 'p95', 'max')]
+    rows = list(ServerHealth.objects.using('mail_data')
+                .filter(updated_at__gte=timezone.now() - datetime.timedelta(hours=hours), sample_count__gt=0)
+                .order_by('updated_at')
+                .values('updated_at', 'sample_count', *columns))
+
+    buckets = {}
+    for row in rows:
+        hour = row['updated_at'].replace(minute=0, second=0, microsecond=0)
+        buckets.setdefault(hour, []).append(row)
+
+    # Load has no fixed ceiling; scale its bars to the core count
+    scale = {'load': 100.0 / (os.cpu_count() or 1)}
+    trends = []
+    for key, label in HEALTH_TRENDS:
+        series = []
+        for hour, hour_rows in buckets.items():
+            weight = sum(row['sample_count'] for row in hour_rows)
+            avg = sum((row[f"{key}_avg"] or 0) * row['sample_count'] for row in hour_rows) / weight
+            p95 = max(row[f"{key}_p95"] or 0 for row in hour_rows)
+            series.append({
+                'hour': hour,
+                'avg': round(avg, 1),
+                'p95': round(p95, 1),
+                'max': round(max(row[f"{key}_max"] or 0 for row in hour_rows), 1),
+                'height': min(100, round(p95 * scale.get(key, 1))),
+            })
+        total_weight = sum(row['sample_count'] for row in rows)
+        trends.append({
+            'key': key,
+            'label': label,
+            'avg': round(sum((row[f"{key}_avg"] or 0) * row['sample_count'] for row in rows) / total_weight, 1) if total_weight else None,
+            'p95': max((point['p95'] for point in series), default=None),
+            'max': max((point['max'] for point in series), default=None),
+            'hours': series,
+        })
+    return trends
 
 # --- Views ---
 
@@ -141,9 +377,9 @@ def logout_view(request):
 @login_required
 def dashboard(request):
     """Main Dashboard: Lists all domains the user is allowed to manage."""
-    user_managed_domains = get_managed_domains(request.user)
+    authz = get_authz(request)
     
-    if not user_managed_domains and not request.user.is_superuser:
+    if not authz.domains and not authz.is_superuser:
         messages.error(request, "You do not have administrative access to any domains.")
         return render(request, 'dashboard_super.html', {'domains': []}) 
 
@@ -154,95 +390,84 @@ def dashboard(request):
     if request.user.is_superuser:
         domains = MailDomain.objects.using('mail_data').all()
     else:
-        domains = MailDomain.objects.using('mail_data').filter(name__in=user_managed_domains)
+        domains = MailDomain.objects.using('mail_data').filter(name__in=authz.managed_domains)
 
-    domain_list = []
-    for dom in domains:
-        stats = DomainStats.objects.using('mail_data').filter(domain_name=dom.name).first()
-        plan_obj = get_effective_plan(dom.name)
-        current_plan = plan_obj.name if plan_obj else "Custom"
-        display_max_users = plan_obj.max_users if plan_obj else dom.max_users
-        display_max_aliases = plan_obj.max_aliases if plan_obj else dom.max_aliases
-            
-        domain_list.append({
-            'id': dom.id,
-            'name': dom.name,
-            'max_users': display_max_users,
-            'max_aliases': display_max_aliases,
-            'is_active': dom.is_active,
-            'sent': stats.sent_count if stats else 0,
-            'received': stats.received_count if stats else 0,
-            'top_sender': stats.top_sender if stats else "N/A",
-            'plan_name': current_plan
-        })
-        
-    query = request.GET.get('q', '').lower()
+    query = request.GET.get('q', '').strip().lower()
     status_filter = request.GET.get('status', 'all')
     sort_by = request.GET.get('sort', 'name_asc')
+    if sort_by not in DASHBOARD_SORTS:
+        sort_by = 'name_asc'
+    after = request.GET.get('after', '')
 
     if query:
-        domain_list = [d for d in domain_list if query in d['name'].lower()]
-        
+        domains = domains.filter(name__icontains=query)
     if status_filter == 'active':
-        domain_list = [d for d in domain_list if d['is_active']]
+        domains = domains.filter(is_active=True)
     elif status_filter == 'suspended':
-        domain_list = [d for d in domain_list if not d['is_active']]
+        domains = domains.filter(is_active=False)
+    domain_count = None if after else domains.count()
 
-    sort_key = 'name'
-    reverse = False
-    
-    if sort_by == 'name_desc':
-        sort_key = 'name'
-        reverse = True
-    elif sort_by == 'usage_high':
-        sort_key = 'sent' 
-        reverse = True
-    elif sort_by == 'usage_low':
-        sort_key = 'sent'
-        reverse = False
-        
-    domain_list.sort(key=lambda x: x[sort_key], reverse=reverse)
-    plans = MailPlan.objects.all()
-        
-    return render(request, 'dashboard_super.html', {
-        'domains': domain_list,
-        'plans': plans,
-        'health': health,
+    # Stats and last-24h traffic come along as subqueries, so sorting and
+    # paging on them happen in the database
+    since = timezone.now() - datetime.timedelta(hours=24)
+    domains = annotate_domain_traffic(domains, since).only('id', 'name', 'max_users', 'max_aliases', 'is_active')
+    page, next_cursor = keyset_page(domains, sort_by, after, DASHBOARD_PAGE_SIZE)
+    cards = domain_cards(page)
+
+    context = {
+        'domains': cards,
+        'domain_rows': render_domain_rows(request, cards, since),
+        'next_query': next_page_query(request, next_cursor),
         'current_q': query,
         'current_status': status_filter,
         'current_sort': sort_by
+    }
+    # "Load more" requests only need the next page of rows
+    if after and request.headers.get('HX-Request'):
+        return render(request, 'partials/domain_rows.html', context)
+
+    context.update({
+        'domain_count': domain_count,
+        'plans': get_plan_catalog().plans,
+        'health': health,
     })
+    return render(request, 'dashboard_super.html', context)
 
 @login_required
 def manage_domain(request, domain_id):
     """Single Domain Management View."""
     domain = get_object_or_404(MailDomain.objects.using('mail_data'), id=domain_id)
     
-    allowed_domains = get_managed_domains(request.user)
-    if domain.name not in allowed_domains:
+    if not get_authz(request).can_manage(domain.name):
         return HttpResponseForbidden("You do not have permission to manage this domain.")
         
     if not domain.is_active and not request.user.is_superuser:
         messages.error(request, f"Access Denied: The domain {domain.name} has been suspended.")
         return redirect('dashboard')
         
-    users = MailUser.objects.using('mail_data').filter(domain=domain).order_by('email')
+    users, users_cursor = list_page(domain_users(request, domain), USER_ORDER, None)
+    with_quota_usage(users)
+    aliases, aliases_cursor = list_page(domain_aliases(request, domain), ALIAS_ORDER, None)
     
-    # Loophole Fix: Domain admins must not see protected accounts (superusers)
-    if not request.user.is_superuser:
-        protected_emails = list(User.objects.filter(is_superuser=True).values_list('username', flat=True))
-        users = users.exclude(email__in=protected_emails)
+    usage = usage_summary(get_effective_plan(domain.name), get_usage(domain))
 
-    # Show ALL aliases (system aliases will be marked in template)
-    aliases = MailAlias.objects.using('mail_data').filter(domain=domain).order_by('source')
-    
-    # Resource Monitoring
-    plan = get_effective_plan(domain.name)
-    
+    return render(request, 'manage_domain.html', {
+        'domain': domain,
+        'users': users,
+        'users_next_query': next_page_query(request, users_cursor),
+        'aliases': aliases,
+        'aliases_next_query': next_page_query(request, aliases_cursor),
+        'usage': usage
+    })
+
+# --- HTMX Fragments ---
+
+def usage_summary(plan, counters):
+    """Usage meter data for partials/usage_meters.html from a DomainUsage row."""
     usage = {
-        'users_used': users.count(),
+        'users_used': counters.mailboxes,
         'users_limit': plan.max_users if plan else 0,
-        'aliases_used': aliases.count(),
+        'aliases_used': counters.aliases,
         'aliases_limit': plan.max_aliases if plan else 0,
         'quota_mb': plan.quota_mb if plan else 1024,
         'plan_name': plan.name if plan else "No Plan",
@@ -255,78 +480,128 @@ def manage_domain(request, domain_id):
         usage['aliases_percent'] = min(100, (usage['aliases_used'] / plan.max_aliases) * 100) if plan.max_aliases > 0 else 0
         usage['is_over_users'] = usage['users_used'] > plan.max_users
         usage['is_over_aliases'] = usage['aliases_used'] > plan.max_aliases
+    return usage
+
+def render_delta(request, template=None, context=None, domain=None, clears=None):
+    """
+    Response for a mutation: the affected row (if any), then out-of-band swaps
+    for the domain's usage meters (when domain is given), for the element id
+    `clears` (e.g. an empty-list placeholder) and for the messages area.
+    """
+    html = render_to_string(template, context, request=request) if template else ""
+    if domain is not None:
+        usage = usage_summary(get_effective_plan(domain.name), get_usage(domain))
+        html += render_to_string('partials/usage_meters.html', {'usage': usage, 'oob': True}, request=request)
+    if clears:
+        html += f'<tr id="{clears}" hx-swap-oob="delete"></tr>'
+    html += render_to_string('partials/messages.html', {}, request=request)
+    return HttpResponse(html)
+
+def with_quota_usage(users):
+    """Set .quota (a doveadm.get_quotas() entry, or None) on each MailUser for its usage bar."""
+    quotas = {}
+    if doveadm.is_configured():
+        try:
+            quotas = doveadm.get_quotas([user.email for user in users])
+        except doveadm.DoveadmError as e:
+            logger.warning(f"Mailbox quota usage unavailable: {e}")
+    for user in users:
+        user.quota = quotas.get(user.email)
+    return users
+
+def list_etag(request, domain, kind):
+    """
+    ETag for a domain's user or alias list fragments: the domain_usage
+    version (bumped by every mutation here), the viewer's authorization
+    version and, for users, the doveadm quota cache period. Flash messages
+    ride along in these responses, so none is given while any are pending.
+    """
+    if messages.get_messages(request):
+        return None
+    parts = [kind, domain.id, get_usage(domain).version, authz_version(), int(request.user.is_superuser)]
+    if kind == 'users' and doveadm.is_configured():
+        parts.append(int(time.time() // doveadm.QUOTA_TTL))
+    return 'W/"{}"'.format('-'.join(str(part) for part in parts))
+
+def not_modified(request, etag):
+    """A 304 (or 412) response when the browser's copy still matches etag, else None."""
+    return get_conditional_response(request, etag=etag) if etag else None
+
+def etag_response(response, etag):
+    """Attach etag (if any) and ask the browser to revalidate on every use."""
+    if etag:
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+USER_ORDER = ('email',)
+ALIAS_ORDER = ('source', 'id')
+
+def domain_users(request, domain, query=''):
+    """Mailboxes of a domain visible to request.user, optionally filtered by a search query."""
+    users = MailUser.objects.using('mail_data').filter(domain=domain)
     
-    return render(request, 'manage_domain.html', {
-        'domain': domain,
-        'users': users,
-        'aliases': aliases,
-        'usage': usage
-    })
+    # Loophole Fix: Domain admins must not see protected accounts (superusers)
+    if not request.user.is_superuser:
+        users = users.exclude(email__in=get_authz(request).protected)
+    if query:
+        users = users.filter(Q(email__icontains=query) | Q(name__icontains=query))
+    return users
 
-# --- HTMX Fragments ---
+def domain_aliases(request, domain, query=''):
+    """All aliases of a domain (system ones are marked in the template), optionally filtered by a search query."""
+    aliases = MailAlias.objects.using('mail_data').filter(domain=domain)
+    if query:
+        aliases = aliases.filter(Q(source__icontains=query) | Q(destination__icontains=query))
+    return aliases
 
 @login_required
 def user_list(request, domain_id):
-    """Return the updated user list for HTMX updates."""
+    """Return the updated user list (or, with ?after=, its next page of rows) for HTMX updates."""
     domain = get_object_or_404(MailDomain.objects.using('mail_data'), id=domain_id)
-    allowed_domains = get_managed_domains(request.user)
-    if domain.name not in allowed_domains:
+    if not get_authz(request).can_manage(domain.name):
          return HttpResponseForbidden()
-         
-    users = MailUser.objects.using('mail_data').filter(domain=domain).order_by('email')
-    
-    # Loophole Fix: Domain admins must not see protected accounts (superusers)
-    if not request.user.is_superuser:
-        protected_emails = list(User.objects.filter(is_superuser=True).values_list('username', flat=True))
-        users = users.exclude(email__in=protected_emails)
 
-    response_html = render_to_string('partials/user_list.html', {'users': users, 'domain': domain}, request=request)
+    etag = list_etag(request, domain, 'users')
+    unchanged = not_modified(request, etag)
+    if unchanged:
+        return unchanged
+
+    query = request.GET.get('q', '').strip()
+    after = request.GET.get('after')
+    users, cursor = list_page(domain_users(request, domain, query), USER_ORDER, after)
+    with_quota_usage(users)
+    context = {'users': users, 'domain': domain, 'users_next_query': next_page_query(request, cursor),
+               'current_q': query}
+    if after:
+        return etag_response(render(request, 'partials/user_rows.html', context), etag)
+
+    response_html = render_to_string('partials/user_list.html', context, request=request)
     response_html += render_to_string('partials/messages.html', {}, request=request)
-    return HttpResponse(response_html)
+    return etag_response(HttpResponse(response_html), etag)
 
 @login_required
 @require_http_methods(["POST"])
 def add_user(request, domain_id):
     domain = get_object_or_404(MailDomain.objects.using('mail_data'), id=domain_id)
     
-    allowed_domains = get_managed_domains(request.user)
-    if domain.name not in allowed_domains:
+    if not get_authz(request).can_manage(domain.name):
         return HttpResponseForbidden("Unauthorized")
     
     username = request.POST.get('username')
     display_name = request.POST.get('display_name')
     
-    # Check Plan Limits
-    plan = get_effective_plan(domain.name)
-    
-    if plan:
-        current_users = MailUser.objects.using('mail_data').filter(domain=domain).count()
-        if current_users >= plan.max_users:
-            messages.error(request, f"Plan Limit Reached: Your current plan only allows {plan.max_users} mailboxes.")
-            response_html = render_to_string('partials/messages.html', {}, request=request)
-            return HttpResponse(response_html)
-    
     if not username:
         return HttpResponse("Username required", status=400)
     
     # SECURITY: Validate username to prevent path traversal
     if not re.match(r'^[a-zA-Z0-9._-]+$', username):
         messages.error(request, "Invalid username. Only letters, numbers, dots, underscores, and hyphens are allowed.")
-        response_html = render_to_string('partials/messages.html', {}, request=request)
-        return HttpResponse(response_html)
+        return render_delta(request)
         
     email = f"{username}@{domain.name}"
     plan = get_effective_plan(domain.name)
     max_users = plan.max_users if plan else domain.max_users
-    
-    current_count = MailUser.objects.using('mail_data').filter(domain=domain).count()
-    if current_count >= max_users:
-        messages.error(request, f"Limit reached: This domain's plan is capped at {max_users} mailboxes.")
-        return user_list(request, domain_id)
-
-    if MailUser.objects.using('mail_data').filter(email=email).exists():
-        messages.error(request, f"User {email} already exists.")
-        return user_list(request, domain_id)
         
     password = generate_password()
     password_hash = sha512_crypt.using(rounds=5000).hash(password)
@@ -337,35 +612,47 @@ def add_user(request, domain_id):
     if plan:
         quota_kb = plan.quota_mb * 1024
         
-    MailUser.objects.using('mail_data').create(
-        uid=email,
-        email=email,
-        password=password_hash,
-        full_name=username,
-        name=display_name,
-        domain=domain,
-        quota_kb=quota_kb
-    )
+    with transaction.atomic(using='mail_data'):
+        # Check Plan Limits against the locked counters, so concurrent adds cannot both pass
+        if get_usage(domain, for_update=True).mailboxes >= max_users:
+            messages.error(request, f"Plan Limit Reached: Your current plan only allows {max_users} mailboxes.")
+            return render_delta(request)
+
+        if MailUser.objects.using('mail_data').filter(email=email).exists():
+            messages.error(request, f"User {email} already exists.")
+            return render_delta(request)
+
+        new_user = MailUser.objects.using('mail_data').create(
+            uid=email,
+            email=email,
+            password=password_hash,
+            full_name=username,
+            name=display_name,
+            domain=domain,
+            quota_kb=quota_kb
+        )
+        adjust_usage(domain, mailboxes=1, quota_kb=quota_kb)
     
-    maildir_path = f"/var/vmail/{domain.name}/{username}"
     try:
-        # Use sudo for operations in /var/vmail
-        subprocess.run(["/usr/bin/sudo", "/usr/bin/mkdir", "-p", maildir_path], check=True)
-        subprocess.run(["/usr/bin/sudo", "/usr/bin/chown", "-R", "vmail:vmail", f"/var/vmail/{domain.name}"], check=True)
-    except Exception as e:
+        # provisiond creates just this maildir, owned by vmail (no recursive chown of the domain)
+        result = provision.request_maildirs([(domain.name, username)], settings.PROVISION_SOCKET)
+        if result['errors']:
+            logger.error(f"Maildir creation failed for {email}: {result['errors']}")
+    except provision.ProvisionError as e:
+        # Dovecot still creates the maildir on first delivery; don't show technical details to user
         logger.error(f"Maildir creation failed for {email}: {e}")
-        # Don't show technical details to user
 
     audit_log(request.user, "CREATE", email, f"Name: {display_name}")
     messages.success(request, f"User {email} created. Password: {password}", extra_tags=f"pwd_copy:{password}")
     
-    return user_list(request, domain_id)
+    return render_delta(request, 'partials/user_row.html', {'user': new_user, 'domain': domain},
+                        domain=domain, clears='user-rows-empty')
 
 @login_required
 @require_http_methods(["POST"])
 def add_alias(request, domain_id):
     domain = get_object_or_404(MailDomain.objects.using('mail_data'), id=domain_id)
-    if domain.name not in get_managed_domains(request.user):
+    if not get_authz(request).can_manage(domain.name):
         return HttpResponseForbidden("Unauthorized")
     
     source_username = request.POST.get('source')
@@ -377,64 +664,82 @@ def add_alias(request, domain_id):
     # SECURITY: Validate source username chars
     if not re.match(r'^[a-zA-Z0-9._-]+$', source_username):
          messages.error(request, "Invalid source username.")
-         return alias_list(request, domain_id)
+         return render_delta(request)
          
     # SECURITY: Validate destination email format
     if not re.match(r'[^@]+@[^@]+\.[^@]+', destination):
          messages.error(request, "Invalid destination email address.")
-         return alias_list(request, domain_id)
+         return render_delta(request)
     
-    # Check Plan Limits
     plan = get_effective_plan(domain.name)
-    if plan:
-        current_aliases = MailAlias.objects.using('mail_data').filter(domain=domain, managed_by_platform=True).count()
-        if current_aliases >= plan.max_aliases:
+    source = f"{source_username}@{domain.name}"
+
+    with transaction.atomic(using='mail_data'):
+        # Check Plan Limits (platform-managed aliases only) against the locked counters
+        usage = get_usage(domain, for_update=True)
+        if plan and usage.platform_aliases >= plan.max_aliases:
             messages.error(request, f"Plan Limit Reached: Your current plan only allows {plan.max_aliases} aliases.")
-            response_html = render_to_string('partials/messages.html', {}, request=request)
-            return HttpResponse(response_html)
+            return render_delta(request)
 
-    source = f"{source_username}@{domain.name}"
+        if MailAlias.objects.using('mail_data').filter(source=source, destination=destination).exists():
+            messages.error(request, f"Alias {source} -> {destination} already exists.")
+            return render_delta(request)
 
-    if MailAlias.objects.using('mail_data').filter(source=source, destination=destination).exists():
-        messages.error(request, f"Alias {source} -> {destination} already exists.")
-        return alias_list(request, domain_id)
-        
-    MailAlias.objects.using('mail_data').create(source=source, destination=destination, domain=domain, managed_by_platform=True)
+        alias = MailAlias.objects.using('mail_data').create(source=source, destination=destination, domain=domain, managed_by_platform=True)
+        adjust_usage(domain, aliases=1, platform_aliases=1)
     audit_log(request.user, "CREATE_ALIAS", source, f"To: {destination}")
     messages.success(request, f"Alias {source} -> {destination} created.")
-    return alias_list(request, domain_id)
+    return render_delta(request, 'partials/alias_row.html', {'alias': alias, 'domain': domain},
+                        domain=domain, clears='alias-rows-empty')
 
 @login_required
 @require_http_methods(["POST"])
 def delete_alias(request, alias_id):
-    alias = get_object_or_404(MailAlias.objects.using('mail_data'), id=alias_id)
-    if alias.domain.name not in get_managed_domains(request.user):
+    alias = get_object_or_404(MailAlias.objects.using('mail_data').select_related('domain'), id=alias_id)
+    if not get_authz(request).can_manage(alias.domain.name):
         return HttpResponseForbidden("Unauthorized")
         
     source = alias.source
     dest = alias.destination
-    domain_id = alias.domain.id
-    alias.delete(using='mail_data')
+    domain = alias.domain
+    with transaction.atomic(using='mail_data'):
+        get_usage(domain, for_update=True)
+        alias.delete(using='mail_data')
+        adjust_usage(domain, aliases=-1, platform_aliases=-1 if alias.managed_by_platform else 0)
     audit_log(request.user, "DELETE_ALIAS", source, f"To: {dest}")
     messages.success(request, f"Alias {source} -> {dest} removed.")
-    return alias_list(request, domain_id)
+    # The row's own swap removes it
+    return render_delta(request, domain=domain)
 
 @login_required
 def alias_list(request, domain_id):
+    """Return the updated alias list (or, with ?after=, its next page of rows) for HTMX updates."""
     domain = get_object_or_404(MailDomain.objects.using('mail_data'), id=domain_id)
-    if domain.name not in get_managed_domains(request.user):
+    if not get_authz(request).can_manage(domain.name):
          return HttpResponseForbidden()
-    # Show ALL aliases (system aliases will be marked in template)
-    aliases = MailAlias.objects.using('mail_data').filter(domain=domain).order_by('source')
-    response_html = render_to_string('partials/alias_list.html', {'aliases': aliases, 'domain': domain}, request=request)
+
+    etag = list_etag(request, domain, 'aliases')
+    unchanged = not_modified(request, etag)
+    if unchanged:
+        return unchanged
+
+    query = request.GET.get('q', '').strip()
+    after = request.GET.get('after')
+    aliases, cursor = list_page(domain_aliases(request, domain, query), ALIAS_ORDER, after)
+    context = {'aliases': aliases, 'domain': domain, 'aliases_next_query': next_page_query(request, cursor),
+               'current_q': query}
+    if after:
+        return etag_response(render(request, 'partials/alias_rows.html', context), etag)
+
+    response_html = render_to_string('partials/alias_list.html', context, request=request)
     response_html += render_to_string('partials/messages.html', {}, request=request)
-    return HttpResponse(response_html)
+    return etag_response(HttpResponse(response_html), etag)
 
 @login_required
 def edit_alias_form(request, alias_id):
     """Return a modal form for editing an alias."""
-    alias = get_object_or_404(MailAlias.objects.using('mail_data'), id=alias_id)
-    if alias.domain.name not in get_managed_domains(request.user):
+    alias = get_object_or_404(MailAlias.objects.using('mail_data').select_related('domain'), id=alias_id)
+    if not get_authz(request).can_manage(alias.domain.name):
         return HttpResponseForbidden("Unauthorized")
     if not alias.managed_by_platform:
         return HttpResponseForbidden("System aliases cannot be edited.")
@@ -475,8 +780,8 @@ def edit_alias_form(request, alias_id):
 @require_http_methods(["POST"])
 def edit_alias(request, alias_id):
     """Update an alias's destination."""
-    alias = get_object_or_404(MailAlias.objects.using('mail_data'), id=alias_id)
-    if alias.domain.name not in get_managed_domains(request.user):
+    alias = get_object_or_404(MailAlias.objects.using('mail_data').select_related('domain'), id=alias_id)
+    if not get_authz(request).can_manage(alias.domain.name):
         return HttpResponseForbidden("Unauthorized")
     if not alias.managed_by_platform:
         return HttpResponseForbidden("System aliases cannot be edited.")
@@ -486,17 +791,21 @@ def edit_alias(request, alias_id):
     # SECURITY: Validate destination email format
     if not re.match(r'[^@]+@[^@]+\.[^@]+', new_destination):
         messages.error(request, "Invalid destination email address.")
-        return alias_list(request, alias.domain.id)
+        response = render_delta(request)
+        response['HX-Reswap'] = 'none'
+        return response
     
     old_dest = alias.destination
     alias.destination = new_destination
     alias.save(using='mail_data')
+    adjust_usage(alias.domain)  # No count changes, but the alias list did
     
     audit_log(request.user, "EDIT_ALIAS", alias.source, f"Changed: {old_dest} -> {new_destination}")
     messages.success(request, f"Alias {alias.source} updated to forward to {new_destination}.")
     
-    # Close modal via response
-    response = alias_list(request, alias.domain.id)
+    # The updated row, plus an emptied modal container to close the modal
+    response = render_delta(request, 'partials/alias_row.html', {'alias': alias, 'domain': alias.domain})
+    response.write('<div id="alias-edit-modal" hx-swap-oob="true"></div>')
     return response
 
 @login_required
@@ -508,7 +817,7 @@ def delete_user(request, email):
     except MailUser.DoesNotExist:
         return HttpResponse("User not found", status=404)
         
-    if domain.name not in get_managed_domains(request.user):
+    if not get_authz(request).can_manage(domain.name):
         return HttpResponseForbidden("Unauthorized")
     
     # SECURITY: Prevent self-deletion (lockout prevention)
@@ -517,7 +826,7 @@ def delete_user(request, email):
         return HttpResponseForbidden("Self-deletion is not permitted.")
         
     # Loophole Fix: Block domain admins from deleting superuser accounts
-    if is_protected_account(email) and not request.user.is_superuser:
+    if get_authz(request).is_protected(email) and not request.user.is_superuser:
         return HttpResponseForbidden("Cannot manage protected accounts.")
 
     # SECURITY: Validate email string format from DB to prevent path traversal
@@ -537,7 +846,10 @@ def delete_user(request, email):
         # We continue even if files fail, to ensure DB cleanup happens
 
     # 2. Mail DB Purge
-    user_to_delete.delete(using='mail_data')
+    with transaction.atomic(using='mail_data'):
+        get_usage(domain, for_update=True)
+        user_to_delete.delete(using='mail_data')
+        adjust_usage(domain, mailboxes=-1, quota_kb=-user_to_delete.quota_kb)
     
     # 3. Django Auth Purge (if they exist as a platform user)
     User.objects.filter(username=email).delete()
@@ -545,10 +857,8 @@ def delete_user(request, email):
     audit_log(request.user, "PURGE", email)
     messages.success(request, f"User {email} has been completely purged from the system.")
     
-    # Trigger full page reload to refresh resource usage stats
-    response = HttpResponse()
-    response['HX-Redirect'] = f"/domain/{domain.id}/manage/"
-    return response
+    # The row's own swap removes it; usage meters are refreshed out of band
+    return render_delta(request, domain=domain)
 
 @login_required
 @require_http_methods(["POST"])
@@ -559,11 +869,11 @@ def reset_password(request, email):
     except MailUser.DoesNotExist:
         return HttpResponse("User not found", status=404)
 
-    if domain.name not in get_managed_domains(request.user):
+    if not get_authz(request).can_manage(domain.name):
         return HttpResponseForbidden("Unauthorized")
         
     # Loophole Fix: Block domain admins from resetting superuser passwords
-    if is_protected_account(email) and not request.user.is_superuser:
+    if get_authz(request).is_protected(email) and not request.user.is_superuser:
         return HttpResponseForbidden("Cannot manage protected accounts.")
         
     password = generate_password()
@@ -598,21 +908,30 @@ def update_domain(request):
         domain.save(using='mail_data')
         
         new_quota_kb = plan.quota_mb * 1024
-        MailUser.objects.using('mail_data').filter(domain=domain).update(quota_kb=new_quota_kb)
+        with transaction.atomic(using='mail_data'):
+            get_usage(domain, for_update=True)
+            MailUser.objects.using('mail_data').filter(domain=domain).update(quota_kb=new_quota_kb)
+            set_mailbox_quota(domain, new_quota_kb)
         
         try:
-            subprocess.run(["/usr/bin/sudo", "/usr/sbin/doveadm", "reload"], check=True, timeout=10)
-        except Exception as e:
+            doveadm.reload()
+        except doveadm.DoveadmError as e:
             messages.warning(request, f"Quotas updated but Dovecot reload failed: {e}")
+        # Cached usage readings carry the old limits
+        emails = list(MailUser.objects.using('mail_data').filter(domain=domain).values_list('email', flat=True))
+        doveadm.recalc_quotas_later(emails)
         
         audit_log(request.user, "UPDATE_DOMAIN", domain.name, f"Plan: {plan.name}, Active: {is_active}")
         messages.success(request, f"Configuration for {domain.name} updated to {plan.name} Plan.")
     except (MailDomain.DoesNotExist, MailPlan.DoesNotExist):
         messages.error(request, "Domain or Plan not found.")
-        
-    response = HttpResponse("")
-    response['HX-Refresh'] = 'true'
-    return response
+        return render_delta(request)
+
+    # Replace just this domain's dashboard row, out of band
+    since = timezone.now() - datetime.timedelta(hours=24)
+    annotated = annotate_domain_traffic(MailDomain.objects.using('mail_data').filter(id=domain.id), since).get()
+    row = render_to_string('partials/domain_row.html', {'dom': domain_cards([annotated])[0], 'oob': True}, request=request)
+    return HttpResponse(row + render_to_string('partials/messages.html', {}, request=request))
 
 @login_required
 def monitor_domain(request, domain_id):
@@ -622,18 +941,43 @@ def monitor_domain(request, domain_id):
         
     domain = get_object_or_404(MailDomain.objects.using('mail_data'), id=domain_id)
     stats = DomainStats.objects.using('mail_data').filter(domain_name=domain.name).first()
-    
+
+    now = timezone.now()
+    no_traffic = dict.fromkeys(TRAFFIC_FIELDS, 0)
+    windows = []
+    for label, span in (("Last 24 hours", datetime.timedelta(hours=24)),
+                        ("Last 7 days", datetime.timedelta(days=7)),
+                        ("Last 30 days", datetime.timedelta(days=30))):
+        totals = traffic_totals(now - span, domain_name=domain.name)
+        windows.append({'label': label, **totals.get(domain.name, no_traffic)})
+
+    # Top senders over the last 7 days, from the per-mailbox buckets
+    mailbox_traffic = traffic_totals(now - datetime.timedelta(days=7), group_by='mailbox',
+                                     domain_name=domain.name, mailbox__gt='')
+    top_senders = sorted(
+        ({'email': mailbox, 'count': totals['sent']} for mailbox, totals in mailbox_traffic.items() if totals['sent']),
+        key=lambda sender: (-sender['count'], sender['email'])
+    )[:5]
+
+    # All-time heavy hitters from mail_monitor's sketches (approximate, bounded memory)
     metrics = {}
     if stats and stats.metrics_json:
         try:
             metrics = json.loads(stats.metrics_json)
-        except json.JSONDecodeError:
+        except ValueError:
             pass
-            
+    heavy_hitters = [
+        {'title': "Top Recipients", 'items': [(row['email'], row['count']) for row in metrics.get('top_recipients', [])]},
+        {'title': "Top Remote Relays", 'items': [(row['host'], row['count']) for row in metrics.get('top_relays', [])]},
+        {'title': "Top Client IPs", 'items': [(row['ip'], row['count']) for row in metrics.get('top_clients', [])]},
+    ]
+
     return render(request, 'monitor_domain.html', {
         'domain': domain,
         'stats': stats,
-        'metrics': metrics
+        'windows': windows,
+        'top_senders': top_senders,
+        'heavy_hitters': heavy_hitters,
     })
 
 @login_required
@@ -643,28 +987,15 @@ def server_health(request):
         return HttpResponse("Unauthorized", status=403)
         
     health_record = ServerHealth.objects.using('mail_data').order_by('-id').first()
-    services = {
-        'Postfix (MTA)': 'postfix',
-        'Dovecot (IMAP/POP)': 'dovecot',
-        'MariaDB (Database)': 'mariadb',
-        'Nginx (Web Server)': 'nginx',
-        'Mail Admin (Gunicorn)': 'mail-admin'
-    }
-    
-    status_results = []
-    for display_name, service_name in services.items():
-        try:
-            result = subprocess.run(['/usr/bin/systemctl', 'is-active', service_name], capture_output=True, text=True)
-            is_active = result.stdout.strip() == 'active'
-            status_results.append({
-                'name': display_name,
-                'status': 'Online' if is_active else 'Offline',
-                'active': is_active
-            })
-        except Exception as e:
-            status_results.append({'name': display_name, 'status': 'Error', 'active': False})
+    # Read from the cache kept by the background poller; never runs systemctl here
+    service_status = services.get_status()
 
-    return render(request, 'server_health.html', {'health': health_record, 'services': status_results})
+    return render(request, 'server_health.html', {
+        'health': health_record,
+        'services': service_status['services'],
+        'services_checked_at': service_status['checked_at'],
+        'trends': health_trends(),
+    })
 
 @login_required
 def audit_logs(request):
@@ -674,6 +1005,8 @@ def audit_logs(request):
     logs = AdminLog.objects.order_by('-timestamp')[:100]
     return render(request, 'audit_logs.html', {'logs': logs})
 
+LOG_FILES = {'mail': '/var/log/mail.log', 'nginx': '/var/log/nginx/error.log'}
+
 @login_required
 def system_logs(request):
     """View and stream system logs."""
@@ -694,31 +1027,26 @@ def system_logs(request):
     if service not in allowed_services:
         service = 'mail'
     
-    log_map = { 'mail': '/var/log/mail.log', 'nginx': '/var/log/nginx/error.log', 'app': 'journalctl -u mail-admin -n' }
-    
     log_content = ""
+    stream_cursor = None
     import html
     try:
         if service == 'app':
-            # SECURITY: Avoid shell=True by using list arguments
-            cmd = ["/usr/bin/sudo", "/usr/bin/journalctl", "-u", "mail-admin", "-n", str(lines), "--no-pager"]
+            # Structured journal entries; filtering happens here instead of a grep pipeline
+            reader = JournalReader(units=('mail-admin.service',), command=("/usr/bin/sudo", "/usr/bin/journalctl"))
+            newest = reader.tail(lines)
+            stream_cursor = newest[-1].cursor if newest else None
+            entries = [syslog_line(entry) for entry in newest]
             if filter_keyword:
-                # SECURITY: Use grep as a separate process, safely quoted
-                cmd_str = " ".join(cmd) + f" | grep -i {shlex.quote(filter_keyword)}"
-                result = subprocess.run(cmd_str, shell=True, capture_output=True, text=True)
-            else:
-                result = subprocess.run(cmd, capture_output=True, text=True)
-            log_content = result.stdout if result.returncode == 0 else f"Error: {result.stderr}"
+                needle = filter_keyword.lower()
+                entries = [line for line in entries if needle in line.lower()]
+            log_content = "\n".join(entries)
         else:
-            log_path = log_map.get(service, '/var/log/mail.log')
-            cmd = ["/usr/bin/sudo", "/usr/bin/tail", "-n", str(lines), log_path]
-            if filter_keyword:
-                # SECURITY: Sanitize filter_keyword with shlex.quote
-                cmd_str = " ".join(cmd) + f" | grep -i {shlex.quote(filter_keyword)}"
-                result = subprocess.run(cmd_str, shell=True, capture_output=True, text=True)
-            else:
-                result = subprocess.run(cmd, capture_output=True, text=True)
-            log_content = result.stdout if result.returncode == 0 else f"Error: {result.stderr}"
+            # Read backward from the end in-process (the app user is in adm); the live
+            # stream picks up right after the newest complete line shown here
+            newest, (inode, end) = tail_lines(LOG_FILES[service], lines, filter_keyword)
+            stream_cursor = f"{inode}:{end}"
+            log_content = "\n".join(newest)
     except Exception as e:
         log_content = f"Exception reading logs: {e}"
 
@@ -728,7 +1056,94 @@ def system_logs(request):
         safe_content = html.escape(log_content)
         return HttpResponse(f"<pre class='text-xs font-mono text-slate-300 bg-slate-900 p-4 rounded-xl overflow-x-auto'>{safe_content}</pre>")
 
-    return render(request, 'system_logs.html', {'log_content': log_content, 'current_service': service, 'current_lines': lines, 'current_filter': filter_keyword})
+    stream_query = urlencode({'service': service, 'filter': filter_keyword, 'cursor': stream_cursor or ''})
+    return render(request, 'system_logs.html', {'log_content': log_content, 'current_service': service, 'current_lines': lines, 'current_filter': filter_keyword,
+                                                'stream_query': stream_query})
+
+@login_required
+def system_logs_stream(request):
+    """Server-Sent Events: lines appended to a system log, as they are written."""
+    if not request.user.is_superuser:
+        return HttpResponse("Unauthorized", status=403)
+
+    service = request.GET.get('service', 'mail')
+    if service not in ('mail', 'nginx', 'app'):
+        service = 'mail'
+    filter_keyword = request.GET.get('filter', '')
+    # EventSource sends the last event id when it reconnects
+    cursor = request.headers.get('Last-Event-ID') or request.GET.get('cursor')
+
+    slot = logstream.acquire_slot()
+    if slot is None:
+        # An error status would stop EventSource for good; this makes it retry later
+        busy = logstream.sse('busy', ["Too many log streams are open; retrying shortly."], retry=logstream.BUSY_RETRY_MS)
+        return HttpResponse(busy, content_type='text/event-stream')
+
+    if service == 'app':
+        open_follower = lambda: logstream.JournalFollower(('mail-admin.service',), cursor)
+    else:
+        open_follower = lambda: logstream.FileFollower(LOG_FILES[service], cursor)
+    response = StreamingHttpResponse(
+        logstream.event_stream(open_follower, filter_keyword, slot=slot),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+    return response
+
+@login_required
+def log_search(request):
+    """Search indexed Postfix, Dovecot and Rspamd events (see log_index.py)."""
+    if not request.user.is_superuser:
+        return HttpResponse("Unauthorized", status=403)
+
+    query = request.GET.get('q', '').strip()
+    days = index_days(request)
+
+    index = LogIndex(settings.LOG_INDEX_DIR)
+    events, error, elapsed_ms = [], None, None
+    if query:
+        started = time.monotonic()
+        try:
+            events = index.search(query, days=days)
+        except sqlite3.Error as e:
+            error = f"Search failed: {e}"
+        elapsed_ms = round((time.monotonic() - started) * 1000)
+
+    return render(request, 'log_search.html', {
+        'query': query, 'days': days, 'day_choices': (1, 7, 14, LOG_INDEX_DAYS),
+        'events': events, 'error': error, 'elapsed_ms': elapsed_ms,
+        'indexed_days': len(index.days()),
+    })
+
+def index_days(request):
+    """The ?days= window for index searches, clamped to what the index keeps."""
+    try:
+        return min(max(int(request.GET.get('days', LOG_INDEX_DAYS)), 1), LOG_INDEX_DAYS)
+    except (ValueError, TypeError):
+        return LOG_INDEX_DAYS
+
+@login_required
+def message_trace(request):
+    """Delivery path of the messages for an address, message-id or queue ID, from the log index."""
+    if not request.user.is_superuser:
+        return HttpResponse("Unauthorized", status=403)
+
+    query = request.GET.get('q', '').strip()
+    days = index_days(request)
+    traces, error, elapsed_ms = [], None, None
+    if query:
+        started = time.monotonic()
+        try:
+            traces = trace_messages(LogIndex(settings.LOG_INDEX_DIR), query, days=days)
+        except sqlite3.Error as e:
+            error = f"Trace failed: {e}"
+        elapsed_ms = round((time.monotonic() - started) * 1000)
+
+    return render(request, 'message_trace.html', {
+        'query': query, 'days': days, 'day_choices': (1, 7, 14, LOG_INDEX_DAYS),
+        'traces': traces, 'error': error, 'elapsed_ms': elapsed_ms,
+    })
 
 @login_required
 def manage_plans(request):
@@ -750,6 +1165,8 @@ def manage_plans(request):
         else:
             MailPlan.objects.create(name=name, **defaults)
             action = "CREATED"
+        # update() skips the model signals
+        invalidate_plan_catalog()
             
         messages.success(request, f"Plan '{name}' {action} successfully.")
         return redirect('manage_plans')
@@ -0,0 +1,198 @@
+import argparse
+import fcntl
+import os
+import signal
+import time
+
+from core.logindex import RETENTION_DAYS, SEARCH_LIMIT, EventParser, LogIndex, load_checkpoints, save_checkpoints
+from core.logtail import LogCursor, LogWatcher, rotated_logs
+from core.maillog import QueueCorrelator, open_log
+from core.trace import MAX_MESSAGES, trace
+
+INDEX_DIR = os.environ.get("LOG_INDEX_DIR", "/var/lib/mail-admin/logindex")
+# Postfix and Dovecot share mail.log; Rspamd writes its own file
+SOURCES = ("/var/log/mail.log", "/var/log/rspamd/rspamd.log")
+
+# --follow mode
+FLUSH_INTERVAL = 5
+PRUNE_INTERVAL = 3600
+
+def checkpoints_path(index):
+    return os.path.join(index.directory, "checkpoints.json")
+
+def acquire_lock(index):
+    """
+    Exclusive lock on the index directory, so a one-off run and the --follow
+    daemon never write at the same time. Held until the returned file closes.
+    """
+    os.makedirs(index.directory, exist_ok=True)
+    lock = open(os.path.join(index.directory, ".lock"), "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return None
+    return lock
+
+def open_sources(checkpoints):
+    """A (LogCursor, EventParser) per source, resuming from the stored checkpoints."""
+    sources = []
+    for path in SOURCES:
+        saved = checkpoints.get(path) or {}
+        correlator = QueueCorrelator()
+        correlator.import_state(saved.get('pending'))
+        log_cursor = LogCursor(path, saved.get('inode'), saved.get('offset', 0))
+        sources.append((log_cursor, EventParser(correlator)))
+    return sources
+
+def save_sources(index, sources):
+    """Checkpoint every source; called only after the index commit it covers."""
+    checkpoints = {}
+    for log_cursor, parser in sources:
+        parser.correlator.sweep()
+        checkpoints[log_cursor.path] = {
+            'inode': log_cursor.inode,
+            'offset': log_cursor.offset,
+            'pending': parser.correlator.export_state(),
+        }
+    save_checkpoints(checkpoints_path(index), checkpoints)
+
+def index_new_lines(index, sources):
+    added = 0
+    for log_cursor, parser in sources:
+        added += index.add(parser.feed_lines(log_cursor.read_lines()))
+    return added
+
+def main(index):
+    """One pass: index what was logged since the last run, then drop expired days."""
+    lock = acquire_lock(index)
+    if lock is None:
+        print("Another log_index is running (follow mode?); skipping this run.")
+        return
+    try:
+        sources = open_sources(load_checkpoints(checkpoints_path(index)))
+        added = index_new_lines(index, sources)
+        index.commit()
+        save_sources(index, sources)
+        pruned = index.prune()
+        print(f"Indexed {added} events ({len(pruned)} expired day(s) removed)")
+    finally:
+        index.close()
+        lock.close()
+
+def follow(index, flush_interval=FLUSH_INTERVAL):
+    """
+    Keep indexing new lines as they are written, committing every
+    flush_interval seconds. SIGTERM/SIGINT commit and exit.
+    """
+    stop = []
+    def request_stop(signum, frame):
+        stop.append(signum)
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    lock = acquire_lock(index)
+    if lock is None:
+        print("Another log_index holds the lock; not starting.")
+        return
+    watcher = None
+    try:
+        sources = open_sources(load_checkpoints(checkpoints_path(index)))
+        # mail.log is by far the busiest; the other sources are read on every wake-up anyway
+        watcher = LogWatcher(SOURCES[0])
+        print(f"Following {', '.join(SOURCES)} ({watcher.mode}) into {index.directory}")
+        last_prune = 0
+        while not stop:
+            if index_new_lines(index, sources):
+                index.commit()
+                save_sources(index, sources)
+            if time.monotonic() - last_prune >= PRUNE_INTERVAL:
+                index.prune()
+                last_prune = time.monotonic()
+            watcher.wait(flush_interval)
+        print(f"Stopped on signal {stop[0]}")
+    finally:
+        if watcher:
+            watcher.close()
+        index.close()
+        lock.close()
+
+def backfill(index):
+    """
+    Rebuild the index from every rotated log plus the live ones, oldest
+    first, keeping only the retention window. Queue IDs are joined across
+    rotation boundaries since one parser reads a source's files in order.
+    """
+    lock = acquire_lock(index)
+    if lock is None:
+        print("Another log_index is running; stop log-index before backfilling.")
+        return
+    try:
+        index.clear()
+        sources = []
+        started = time.monotonic()
+        for path in SOURCES:
+            parser = EventParser()
+            for rotated in rotated_logs(path):
+                with open_log(rotated) as log:
+                    added = index.add(parser.feed_lines(log))
+                index.commit()
+                print(f"{os.path.basename(rotated)}: {added:,} events ({time.monotonic() - started:.0f}s elapsed)", flush=True)
+            if not os.path.exists(path):
+                continue
+            log_cursor = LogCursor(path, inode=os.stat(path).st_ino)
+            added = index.add(parser.feed_lines(log_cursor.read_lines()))
+            index.commit()
+            sources.append((log_cursor, parser))
+            print(f"{os.path.basename(path)}: {added:,} events ({time.monotonic() - started:.0f}s elapsed)", flush=True)
+        save_sources(index, sources)
+        print(f"Backfill complete: {len(index.days())} day(s) in {time.monotonic() - started:.0f}s")
+    finally:
+        index.close()
+        lock.close()
+
+def search(index, text, days, limit):
+    started = time.monotonic()
+    events = index.search(text, days=days, limit=limit)
+    for event in reversed(events):
+        print(f"{event.time:%Y-%m-%d %H:%M:%S} {event.program}: {event.message}")
+    print(f"{len(events)} event(s) in {(time.monotonic() - started) * 1000:.0f} ms")
+
+def print_trace(index, value, days, limit):
+    started = time.monotonic()
+    traces = trace(index, value, days=days, max_messages=limit)
+    for message in reversed(traces):
+        sender = '<>' if message.sender == '' else message.sender or '?'
+        print(f"{message.queue_id or 'NOQUEUE'}  {message.message_id or '-'}  from {sender}  "
+              f"[{message.outcome}, {message.duration:.1f}s]")
+        for stage in message.stages:
+            print(f"  {stage.time:%Y-%m-%d %H:%M:%S} +{stage.since_previous:>6.1f}s  {stage.name:<16} {stage.detail}")
+        for hop in message.hops:
+            print(f"  alias {hop.original} -> {hop.recipient} ({hop.status} via {hop.relay or 'local delivery'})")
+        print()
+    print(f"{len(traces)} message(s) in {(time.monotonic() - started) * 1000:.0f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index Postfix, Dovecot and Rspamd log events for search.")
+    parser.add_argument('--dir', default=INDEX_DIR, help="index directory (default: %(default)s)")
+    parser.add_argument('--follow', action='store_true', help="run as a daemon indexing lines as they are written")
+    parser.add_argument('--backfill', action='store_true',
+                        help="rebuild the index from all rotated logs and exit")
+    parser.add_argument('--search', metavar='QUERY',
+                        help="print matching events, oldest first (words must all match; from:, to:, qid:, ip: ...)")
+    parser.add_argument('--trace', metavar='ADDRESS|MESSAGE-ID|QUEUE-ID',
+                        help="print the path of each matching message through Postfix, Rspamd and Dovecot")
+    parser.add_argument('--days', type=int, default=RETENTION_DAYS, help="days to search back (default: %(default)s)")
+    parser.add_argument('--limit', type=int, default=SEARCH_LIMIT, help="newest matches to show (default: %(default)s)")
+    args = parser.parse_args()
+    index = LogIndex(args.dir)
+    if args.trace is not None:
+        print_trace(index, args.trace, args.days, min(args.limit, MAX_MESSAGES))
+    elif args.search is not None:
+        search(index, args.search, args.days, args.limit)
+    elif args.backfill:
+        backfill(index)
+    elif args.follow:
+        follow(index)
+    else:
+        main(index)
@@ -1,10 +1,17 @@
-import os
-import subprocess
 import pymysql
-import psutil
+import argparse
 import datetime
-import re
 import json
+import multiprocessing
+import os
+import signal
+import time
+
+from core.health import METRICS as HEALTH_METRICS, SUMMARY_STATS, HealthSampler
+from core.journal import POSTFIX_IDENTIFIERS, JournalReader
+from core.logtail import LogCursor, LogWatcher, rotated_logs
+from core.maillog import SKETCH_CAPACITY, SKETCHES, DomainAggregator, QueueCorrelator, open_log
+from core.sketch import SpaceSaving
 
 # Database Configuration (matches settings.py)
 DB_HOST = "127.0.0.1"
@@ -12,6 +19,29 @@ DB_USER = "mailuser"
 DB_PASS = "ChangeMe123!"
 DB_NAME = "mailserver"
 
+MAIL_LOG = "/var/log/mail.log"
+# log_checkpoints key for --journal runs (cursor instead of inode/offset)
+JOURNAL_CHECKPOINT = "journal:postfix"
+
+TOP_ITEMS_SHOWN = 5
+# Key naming each heavy hitter in metrics_json's top_* lists
+TOP_ITEM_LABELS = {'senders': 'email', 'recipients': 'email', 'relays': 'host', 'clients': 'ip'}
+
+ROLLUP_BATCH = 1000
+HOURLY_RETENTION_DAYS = 14
+
+HEALTH_SAMPLE_INTERVAL = 5
+HEALTH_PERIOD = 60
+HEALTH_RETENTION_DAYS = 30
+
+# --follow mode
+FLUSH_INTERVAL = 30
+FLUSH_EVENTS = 500
+# Longest wait between retries after a failed flush
+FLUSH_RETRY_MAX = 60
+COMPACT_INTERVAL = 3600
+RUN_LOCK = "mail_monitor"
+
 def get_db_connection():
     return pymysql.connect(
         host=DB_HOST,
@@ -21,100 +51,514 @@ def get_db_connection():
         cursorclass=pymysql.cursors.DictCursor
     )
 
-def get_domain_stats(domain):
-    """Calculate sent/received/top-sender via log parsing."""
-    try:
-        # Received: status=sent and to=<*@domain>
-        received_cmd = f"sudo grep 'to=<[^>]*@{domain}>' /var/log/mail.log | grep 'status=sent' | wc -l"
-        received_count = int(subprocess.check_output(received_cmd, shell=True).decode().strip())
-
-        # Sent: status=sent and from=<*@domain>
-        sent_cmd = f"sudo grep 'from=<[^>]*@{domain}>' /var/log/mail.log | grep 'status=sent' | wc -l"
-        sent_count = int(subprocess.check_output(sent_cmd, shell=True).decode().strip())
-
-        # Top 5 Senders for this domain
-        # Filter for from=<*@domain> ONLY to avoid cross-domain contamination
-        top_sender_cmd = f"sudo grep 'from=<[^>]*@{domain}>' /var/log/mail.log | sed -n 's/.*from=<\\([^>]*\\)>.*/\\1/p' | sort | uniq -c | sort -nr | head -n 5"
-        top_sender_raw = subprocess.check_output(top_sender_cmd, shell=True).decode().strip()
-        
-        top_senders_list = []
-        if top_sender_raw:
-            for line in top_sender_raw.split('\n'):
-                parts = line.strip().split()
-                if len(parts) >= 2:
-                    top_senders_list.append({
-                        'count': int(parts[0]),
-                        'email': parts[1]
-                    })
-
-        top_sender = top_senders_list[0]['email'] if top_senders_list else "N/A"
-
-        metrics = {
-            'top_senders': top_senders_list,
-            'last_updated': str(datetime.datetime.now())
-        }
+def load_checkpoint(cursor, path):
+    """
+    Return a LogCursor positioned where the previous run stopped, and a
+    QueueCorrelator holding the queue IDs that run had not finished joining.
+    """
+    correlator = QueueCorrelator()
+    cursor.execute("SELECT inode, byte_offset, state_json FROM log_checkpoints WHERE path = %s", (path,))
+    row = cursor.fetchone()
+    if not row:
+        return LogCursor(path), correlator
+    if row['state_json']:
+        correlator.import_state(json.loads(row['state_json']))
+    return LogCursor(path, inode=row['inode'], offset=row['byte_offset']), correlator
+
+def load_journal_checkpoint(cursor):
+    """Like load_checkpoint, for reading Postfix entries from the systemd journal."""
+    correlator = QueueCorrelator()
+    cursor.execute("SELECT state_json FROM log_checkpoints WHERE path = %s", (JOURNAL_CHECKPOINT,))
+    row = cursor.fetchone()
+    state = json.loads(row['state_json']) if row and row['state_json'] else {}
+    correlator.import_state(state.get('pending'))
+    return JournalReader(identifiers=POSTFIX_IDENTIFIERS, cursor=state.get('cursor')), correlator
+
+def save_checkpoint(cursor, log_cursor, correlator):
+    """Store the read position (a LogCursor, or a JournalReader's cursor) and pending queue IDs."""
+    correlator.sweep()
+    if isinstance(log_cursor, JournalReader):
+        row = (JOURNAL_CHECKPOINT, 0, 0,
+               json.dumps({'cursor': log_cursor.cursor, 'pending': correlator.export_state()}))
+    else:
+        row = (log_cursor.path, log_cursor.inode, log_cursor.offset, json.dumps(correlator.export_state()))
+    cursor.execute("""
+        INSERT INTO log_checkpoints (path, inode, byte_offset, state_json)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            inode = VALUES(inode),
+            byte_offset = VALUES(byte_offset),
+            state_json = VALUES(state_json)
+    """, row)
 
-        return {
-            'sent': sent_count,
-            'received': received_count,
-            'top_sender': top_sender,
+def merge_metrics(previous_json, sketches):
+    """
+    Fold this run's heavy-hitter sketches (senders, recipients, relays,
+    clients) into the ones stored in metrics_json. Sketches are bounded
+    (SKETCH_CAPACITY entries each) and mergeable, so totals carry across
+    runs without growing. Metrics from before the sketches existed seed
+    the sender sketch from their exact sender_counts.
+    """
+    stored = {}
+    if previous_json:
+        try:
+            stored = json.loads(previous_json)
+        except ValueError:
+            pass
+    if not isinstance(stored, dict):
+        stored = {}
+    stored_sketches = stored.get('sketches') or {}
+
+    metrics = {}
+    stored_json = {}
+    for name in SKETCHES:
+        if stored_sketches.get(name):
+            total = SpaceSaving.from_dict(stored_sketches[name], SKETCH_CAPACITY)
+        elif name == 'senders' and stored.get('sender_counts'):
+            total = SpaceSaving.from_counts(stored['sender_counts'], SKETCH_CAPACITY)
+        else:
+            total = SpaceSaving(SKETCH_CAPACITY)
+        if name in sketches:
+            total.merge(sketches[name])
+        label = TOP_ITEM_LABELS[name]
+        metrics[f'top_{name}'] = [{'count': count, label: item} for item, count, _error in total.top(TOP_ITEMS_SHOWN)]
+        stored_json[name] = total.to_dict()
+    metrics['sketches'] = stored_json
+    metrics['last_updated'] = str(datetime.datetime.now())
+    return metrics
+
+def build_stats(aggregator, previous_metrics=None, touched_only=False):
+    """
+    Turn an aggregator's counts into domain_stats row values.
+    previous_metrics maps domain name -> stored metrics_json, so heavy-hitter totals carry across runs.
+    touched_only skips domains this aggregator saw no events for.
+    """
+    previous_metrics = previous_metrics or {}
+    active = aggregator.active_domains() if touched_only else None
+    stats = {}
+    for name, result in aggregator.results().items():
+        if active is not None and name not in active:
+            continue
+        metrics = merge_metrics(previous_metrics.get(name), result['sketches'])
+        top_senders = metrics['top_senders']
+        stats[name] = {
+            'sent': result['sent'],
+            'received': result['received'],
+            'top_sender': top_senders[0]['email'] if top_senders else "N/A",
             'metrics_json': json.dumps(metrics)
         }
-    except Exception as e:
-        print(f"Error getting stats for {domain}: {e}")
-        return {'sent': 0, 'received': 0, 'top_sender': "Error", 'metrics_json': '{}'}
-
-def get_server_health():
-    """Get system health metrics."""
-    cpu = psutil.cpu_percent(interval=1)
-    ram = psutil.virtual_memory().percent
-    disk = psutil.disk_usage('/').percent
-    
+    return stats
+
+def get_domain_stats(domain_names, lines, previous_metrics=None, correlator=None):
+    """
+    Calculate sent/received/top-sender for every domain in one pass over the given lines.
+    Deliveries are joined to their sender by queue ID (see core.maillog.QueueCorrelator).
+    Returns: (dict of domain name -> row values for domain_stats, hourly rollup rows).
+    """
+    aggregator = DomainAggregator(domain_names, correlator).feed_lines(lines)
+    return build_stats(aggregator, previous_metrics), aggregator.rollup_rows()
+
+def write_rollups(cursor, rows):
+    """Add hourly bucket counts to traffic_hourly in batched upserts."""
+    for start in range(0, len(rows), ROLLUP_BATCH):
+        cursor.executemany("""
+            INSERT INTO traffic_hourly (domain_name, mailbox, bucket, sent, received, bounced, deferred, rejected)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                sent = sent + VALUES(sent),
+                received = received + VALUES(received),
+                bounced = bounced + VALUES(bounced),
+                deferred = deferred + VALUES(deferred),
+                rejected = rejected + VALUES(rejected)
+        """, rows[start:start + ROLLUP_BATCH])
+
+def compact_rollups(cursor):
+    """
+    Roll complete (UTC) days of traffic_hourly into traffic_daily, then drop
+    hourly buckets older than HOURLY_RETENTION_DAYS.
+    Daily rows are recomputed from every hour still on hand, so re-running is
+    harmless; days whose hourly rows are already gone are left untouched.
+    """
+    today = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    cursor.execute("""
+        INSERT INTO traffic_daily (domain_name, mailbox, day, sent, received, bounced, deferred, rejected)
+        SELECT domain_name, mailbox, DATE(bucket), SUM(sent), SUM(received), SUM(bounced), SUM(deferred), SUM(rejected)
+        FROM traffic_hourly
+        WHERE bucket < %s
+        GROUP BY domain_name, mailbox, DATE(bucket)
+        ON DUPLICATE KEY UPDATE
+            sent = VALUES(sent),
+            received = VALUES(received),
+            bounced = VALUES(bounced),
+            deferred = VALUES(deferred),
+            rejected = VALUES(rejected)
+    """, (today,))
+    cursor.execute("DELETE FROM traffic_hourly WHERE bucket < %s",
+                   (today - datetime.timedelta(days=HOURLY_RETENTION_DAYS),))
+
+def reconcile_usage(cursor):
+    """
+    Recount domain_usage from users and aliases. The app adjusts the counters
+    as it writes, so this only corrects drift from changes made outside it
+    (scripts, manual SQL); version moves only for rows that actually changed.
+    """
+    cursor.execute("""
+        INSERT INTO domain_usage (domain_name, mailboxes, aliases, platform_aliases, quota_kb)
+        SELECT d.name,
+            (SELECT COUNT(*) FROM users u WHERE u.domain_id = d.id),
+            (SELECT COUNT(*) FROM aliases a WHERE a.domain_id = d.id),
+            (SELECT COUNT(*) FROM aliases a WHERE a.domain_id = d.id AND a.managed_by_platform),
+            (SELECT COALESCE(SUM(u.quota_kb), 0) FROM users u WHERE u.domain_id = d.id)
+        FROM domains d
+        ON DUPLICATE KEY UPDATE
+            version = IF(mailboxes <> VALUES(mailboxes) OR aliases <> VALUES(aliases)
+                         OR platform_aliases <> VALUES(platform_aliases) OR quota_kb <> VALUES(quota_kb),
+                         version + 1, version),
+            mailboxes = VALUES(mailboxes),
+            aliases = VALUES(aliases),
+            platform_aliases = VALUES(platform_aliases),
+            quota_kb = VALUES(quota_kb)
+    """)
+    cursor.execute("DELETE FROM domain_usage WHERE domain_name NOT IN (SELECT name FROM domains)")
+
+def clear_rollups(cursor, since):
+    """Drop hourly and daily rollups from `since` on, ahead of a rebuild."""
+    cursor.execute("DELETE FROM traffic_hourly WHERE bucket >= %s", (since,))
+    cursor.execute("DELETE FROM traffic_daily WHERE day >= %s", (since.date(),))
+
+def get_server_health(sampler):
+    """Summarise the health samples taken since the last call, plus uptime."""
+    health = sampler.summary()
+
     # Get uptime
     with open('/proc/uptime', 'r') as f:
         uptime_seconds = float(f.readline().split()[0])
-        uptime_string = str(datetime.timedelta(seconds=int(uptime_seconds)))
+        health['uptime'] = str(datetime.timedelta(seconds=int(uptime_seconds)))
+    return health
+
+def write_health(cursor, health):
+    """One server_health row: period averages in the legacy columns plus min/avg/max/p95 per metric."""
+    columns = ['cpu_usage', 'ram_usage', 'disk_usage', 'uptime', 'sample_count', 'period_seconds']
+    values = [health['cpu']['avg'], health['ram']['avg'], health['disk']['avg'], health['uptime'],
+              health['samples'], int(health['seconds'])]
+    for metric in HEALTH_METRICS:
+        for stat in SUMMARY_STATS:
+            columns.append(f"{metric}_{stat}")
+            values.append(round(health[metric][stat], 2))
+    cursor.execute(f"""
+        INSERT INTO server_health ({', '.join(columns)})
+        VALUES ({', '.join(['%s'] * len(columns))})
+    """, values)
+
+def prune_health(cursor):
+    cursor.execute("DELETE FROM server_health WHERE updated_at < NOW() - INTERVAL %s DAY",
+                   (HEALTH_RETENTION_DAYS,))
+
+def acquire_run_lock(conn):
+    """
+    Take the server-wide advisory lock so a cron run and a --follow daemon
+    never both consume the log. Held until the connection closes; asking
+    again on the connection that holds it succeeds.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT GET_LOCK(%s, 0) AS acquired", (RUN_LOCK,))
+        return bool(cursor.fetchone()['acquired'])
+
+def load_domain_names(cursor):
+    cursor.execute("SELECT name FROM domains")
+    return [row['name'] for row in cursor.fetchall()]
+
+def flush_stats(cursor, domains, aggregator, log_cursor, fresh):
+    """
+    Write one batch of parsed counts: domain_stats, hourly rollups and the
+    log checkpoint, all in the caller's transaction.
+    With fresh=True (no previous checkpoint) the counters are replaced instead of added to.
+    """
+    if not aggregator.events and not fresh:
+        # Nothing to add (idle follow-mode flush); just move the checkpoint
+        save_checkpoint(cursor, log_cursor, aggregator.correlator)
+        return
+
+    # A fresh run rewrites every domain; otherwise only domains with new events are touched
+    previous_metrics = {}
+    if not fresh:
+        active_names = aggregator.active_domains()
+        active = [name for name in domains if name.lower() in active_names]
+        if active:
+            cursor.execute("SELECT domain_name, metrics_json FROM domain_stats WHERE domain_name IN %s", (active,))
+            previous_metrics = {row['domain_name'].lower(): row['metrics_json'] for row in cursor.fetchall()}
+    all_stats = build_stats(aggregator, previous_metrics, touched_only=not fresh)
+
+    # Write the domain rows in one batch
+    values = []
+    for name in domains:
+        stats = all_stats.get(name.lower())
+        if stats:
+            values.append((name, stats['sent'], stats['received'], stats['top_sender'], stats['metrics_json']))
+
+    if fresh:
+        counters = "sent_count = VALUES(sent_count), received_count = VALUES(received_count)"
+    else:
+        counters = ("sent_count = sent_count + VALUES(sent_count), "
+                    "received_count = received_count + VALUES(received_count)")
+    if values:
+        cursor.executemany(f"""
+            INSERT INTO domain_stats (domain_name, sent_count, received_count, top_sender, metrics_json)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                {counters},
+                top_sender = VALUES(top_sender),
+                metrics_json = VALUES(metrics_json)
+        """, values)
 
+    # Time-bucketed history (rollup rows carry lower-cased names; store the canonical one)
+    canonical = {name.lower(): name for name in domains}
+    write_rollups(cursor, [(canonical[row[0]],) + row[1:] for row in aggregator.rollup_rows()])
+
+    # Checkpoint commits in the same transaction as the counters it covers
+    save_checkpoint(cursor, log_cursor, aggregator.correlator)
+
+def main(journal=False):
+    """
+    One pass over what was logged since the last run. With journal=True,
+    Postfix entries are read from the systemd journal (resuming from the
+    stored cursor) instead of mail.log; use one source per server.
+    """
+    conn = get_db_connection()
+    try:
+        if not acquire_run_lock(conn):
+            print("Another mail_monitor is running (follow mode?); skipping this run.")
+            return
+        # CPU and I/O wait are measured across the run instead of sleeping for them
+        sampler = HealthSampler()
+        with conn.cursor() as cursor:
+            # 1. Parse only what was appended since the last checkpoint.
+            # Without a checkpoint this is a full read, and the totals are replaced instead of added to.
+            domains = load_domain_names(cursor)
+            # is_fresh is taken before reading, which moves the cursor
+            if journal:
+                log_cursor, correlator = load_journal_checkpoint(cursor)
+                fresh = log_cursor.is_fresh
+                aggregator = DomainAggregator(domains, correlator).feed_entries(log_cursor.entries())
+                progress = f"{log_cursor.count} journal entries"
+            else:
+                log_cursor, correlator = load_checkpoint(cursor, MAIL_LOG)
+                fresh = log_cursor.is_fresh
+                aggregator = DomainAggregator(domains, correlator).feed_lines(log_cursor.read_lines())
+                progress = f"{log_cursor.bytes_read} new bytes"
+
+            # 2. Counters, rollups and checkpoint in one transaction
+            flush_stats(cursor, domains, aggregator, log_cursor, fresh)
+            compact_rollups(cursor)
+            reconcile_usage(cursor)
+
+            # 3. Update Server Health
+            write_health(cursor, get_server_health(sampler))
+            prune_health(cursor)
+
+        conn.commit()
+        print(f"Stats updated at {datetime.datetime.now()} ({progress})")
+    finally:
+        conn.close()
+
+def follow(flush_interval=FLUSH_INTERVAL, flush_events=FLUSH_EVENTS):
+    """
+    Tail mail.log and keep counters in memory, flushing them every
+    flush_interval seconds or flush_events deliveries, whichever comes
+    first. Health is sampled every HEALTH_SAMPLE_INTERVAL seconds and a
+    server_health summary row written every HEALTH_PERIOD.
+    SIGTERM/SIGINT flush and exit.
+    """
+    stop = []
+    def request_stop(signum, frame):
+        stop.append(signum)
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    conn = get_db_connection()
+    watcher = None
+    try:
+        if not acquire_run_lock(conn):
+            print("Another mail_monitor holds the lock; not starting.")
+            return
+        with conn.cursor() as cursor:
+            domains = load_domain_names(cursor)
+            log_cursor, correlator = load_checkpoint(cursor, MAIL_LOG)
+        conn.commit()
+        fresh = log_cursor.is_fresh
+
+        watcher = LogWatcher(MAIL_LOG)
+        print(f"Following {MAIL_LOG} ({watcher.mode}), flushing every {flush_interval}s or {flush_events} events")
+        sampler = HealthSampler(HEALTH_SAMPLE_INTERVAL)
+
+        aggregator = DomainAggregator(domains, correlator)
+        last_flush = last_compact = last_health = time.monotonic()
+        failures = 0
+        retry_at = 0
+        while True:
+            sampler.maybe_sample()
+            backlog = False
+            for line in log_cursor.read_lines():
+                aggregator.feed(line)
+                if aggregator.events >= flush_events:
+                    # Stop mid-file; the cursor offset covers exactly what was fed
+                    backlog = True
+                    break
+
+            now = time.monotonic()
+            timed = now - last_flush >= flush_interval
+            if (backlog or timed or stop) and (now >= retry_at or stop):
+                try:
+                    conn.ping(reconnect=True)
+                    # Still ours unless we reconnected and someone else took it meanwhile
+                    if not acquire_run_lock(conn):
+                        print("Run lock taken by another mail_monitor after reconnecting; stopping.")
+                        return
+                    with conn.cursor() as cursor:
+                        if now - last_health >= HEALTH_PERIOD or stop:
+                            write_health(cursor, get_server_health(sampler))
+                            last_health = now
+                        flush_stats(cursor, domains, aggregator, log_cursor, fresh)
+                        if now - last_compact >= COMPACT_INTERVAL:
+                            compact_rollups(cursor)
+                            prune_health(cursor)
+                            reconcile_usage(cursor)
+                            last_compact = now
+                        domains = load_domain_names(cursor)
+                    conn.commit()
+                except pymysql.Error as e:
+                    # Keep the in-memory counts and retry, backing off while the database is down
+                    failures += 1
+                    delay = min(FLUSH_RETRY_MAX, 2 ** failures)
+                    retry_at = now + delay
+                    print(f"Flush failed, retrying in {delay}s: {e}")
+                    try:
+                        conn.rollback()
+                    except pymysql.Error:
+                        pass
+                    if stop:
+                        raise
+                else:
+                    failures = 0
+                    fresh = False
+                    aggregator = DomainAggregator(domains, correlator)
+                last_flush = now
+
+            if stop:
+                print(f"Stopped on signal {stop[0]} ({log_cursor.bytes_read} bytes read)")
+                return
+            if not backlog or failures:
+                watcher.wait(max(0.1, min(1.0, flush_interval - (time.monotonic() - last_flush))))
+    finally:
+        if watcher:
+            watcher.close()
+        conn.close()
+
+def backfill_file(job):
+    """
+    Pool worker: aggregate one log file on its own.
+    Returns picklable partial results; for the live log also the position
+    read up to and the queue IDs still pending there, for the checkpoint.
+    """
+    path, domains, live = job
+    started = time.monotonic()
+    aggregator = DomainAggregator(domains)
+    position = pending = None
+    if live:
+        log_cursor = LogCursor(path, inode=os.stat(path).st_ino)
+        aggregator.feed_lines(log_cursor.read_lines())
+        position = (log_cursor.inode, log_cursor.offset)
+        pending = aggregator.correlator.export_state()
+    else:
+        with open_log(path) as log:
+            aggregator.feed_lines(log)
     return {
-        'cpu': cpu,
-        'ram': ram,
-        'disk': disk,
-        'uptime': uptime_string
+        'path': path,
+        'lines': aggregator.lines,
+        'seconds': time.monotonic() - started,
+        'counts': aggregator.export_counts(),
+        'rollups': aggregator.rollup_rows(),
+        'position': position,
+        'pending': pending,
     }
 
-def main():
+def backfill(workers=None):
+    """
+    Rebuild domain_stats and the traffic rollups from every rotated mail.log
+    plus the live one, one worker process per file.
+
+    Partial results are merged in file order (oldest first), so the outcome
+    does not depend on which worker finishes first. Each file's hourly rows
+    are written as soon as it is merged; only the per-domain totals are held
+    for the whole run. Everything lands in one transaction together with a
+    checkpoint at the end of the live log, so --follow or the next cron run
+    carries on from there. Queue IDs that straddle a rotation boundary are
+    not joined across files.
+    """
+    paths = rotated_logs(MAIL_LOG)
+    if os.path.exists(MAIL_LOG):
+        paths.append(MAIL_LOG)
+    if not paths:
+        print(f"No logs found at {MAIL_LOG}*")
+        return
+
     conn = get_db_connection()
     try:
+        if not acquire_run_lock(conn):
+            print("Another mail_monitor is running; stop mail-monitor before backfilling.")
+            return
         with conn.cursor() as cursor:
-            # 1. Update Server Health
-            health = get_server_health()
-            cursor.execute("""
-                INSERT INTO server_health (cpu_usage, ram_usage, disk_usage, uptime)
-                VALUES (%s, %s, %s, %s)
-            """, (health['cpu'], health['ram'], health['disk'], health['uptime']))
-
-            # 2. Get Domains
-            cursor.execute("SELECT name FROM domains")
-            domains = cursor.fetchall()
-
-            for dom in domains:
-                name = dom['name']
-                stats = get_domain_stats(name)
-                
-                cursor.execute("""
-                    INSERT INTO domain_stats (domain_name, sent_count, received_count, top_sender, metrics_json)
-                    VALUES (%s, %s, %s, %s, %s)
-                    ON DUPLICATE KEY UPDATE
-                        sent_count = VALUES(sent_count),
-                        received_count = VALUES(received_count),
-                        top_sender = VALUES(top_sender),
-                        metrics_json = VALUES(metrics_json)
-                """, (name, stats['sent'], stats['received'], stats['top_sender'], stats['metrics_json']))
+            domains = load_domain_names(cursor)
+        canonical = {name.lower(): name for name in domains}
+        aggregator = DomainAggregator(domains)
+        log_cursor = LogCursor(MAIL_LOG)
+        cleared = False
+
+        workers = workers or min(len(paths), os.cpu_count() or 1)
+        print(f"Backfilling {len(paths)} file(s) for {len(domains)} domain(s) with {workers} worker(s)")
+        started = time.monotonic()
+        jobs = [(path, domains, path == MAIL_LOG) for path in paths]
+        with multiprocessing.Pool(workers, maxtasksperchild=1) as pool, conn.cursor() as cursor:
+            for done, result in enumerate(pool.imap(backfill_file, jobs), 1):
+                aggregator.merge_counts(result['counts'])
+                rows = result['rollups']
+                if rows and not cleared:
+                    clear_rollups(cursor, min(row[2] for row in rows))
+                    cleared = True
+                write_rollups(cursor, [(canonical[row[0]],) + row[1:] for row in rows])
+                if result['position']:
+                    log_cursor = LogCursor(MAIL_LOG, *result['position'])
+                    aggregator.correlator.import_state(result['pending'])
+                print(f"[{done}/{len(paths)}] {os.path.basename(result['path'])}: "
+                      f"{result['lines']:,} lines in {result['seconds']:.1f}s "
+                      f"({time.monotonic() - started:.0f}s elapsed)", flush=True)
 
+        with conn.cursor() as cursor:
+            flush_stats(cursor, domains, aggregator, log_cursor, fresh=True)
+            compact_rollups(cursor)
         conn.commit()
-        print(f"Stats updated at {datetime.datetime.now()}")
+        print(f"Backfill complete: {aggregator.events:,} deliveries in {time.monotonic() - started:.0f}s")
     finally:
         conn.close()
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Collect mail and server statistics.")
+    parser.add_argument('--follow', action='store_true',
+                        help="run as a daemon tailing mail.log instead of a single pass")
+    parser.add_argument('--flush-interval', type=float, default=FLUSH_INTERVAL,
+                        help="seconds between flushes in follow mode")
+    parser.add_argument('--flush-events', type=int, default=FLUSH_EVENTS,
+                        help="flush early after this many deliveries in follow mode")
+    parser.add_argument('--journal', action='store_true',
+                        help="read Postfix entries from the systemd journal instead of mail.log")
+    parser.add_argument('--backfill', action='store_true',
+                        help="rebuild stats from all rotated logs (mail.log.N[.gz|.zst]) and exit")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="worker processes for --backfill (default: one per file, up to the CPU count)")
+    args = parser.parse_args()
+    if args.backfill:
+        backfill(args.workers)
+    elif args.follow:
+        follow(args.flush_interval, args.flush_events)
+    else:
+        main(journal=args.journal)
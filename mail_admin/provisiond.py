@@ -0,0 +1,45 @@
+"""
+Privileged maildir provisioning service (mail-provision.service).
+
+Runs as root and listens on a Unix socket that only the app's group can
+use. The web app and the migration scripts ask it to create
+<base>/<domain>/<user>/{cur,new,tmp} owned by vmail; see core/provision.py
+for the protocol and batching.
+"""
+import argparse
+import grp
+import os
+import signal
+import threading
+
+from core.provision import OWNER, SOCKET_PATH, VMAIL_BASE, ProvisionServer, Provisioner
+
+
+def serve(socket_path, base, owner, group):
+    """Create maildirs for the web app until SIGTERM/SIGINT. Must run as root to chown."""
+    provisioner = Provisioner(base, owner)
+    server = ProvisionServer(socket_path, provisioner, grp.getgrnam(group).gr_gid if group else None)
+
+    def request_stop(signum, frame):
+        # shutdown() waits for serve_forever(), so it cannot run on this (the serving) thread
+        threading.Thread(target=server.shutdown).start()
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    print(f"Provisioning maildirs under {base} for {owner} on {socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+    print(f"Stopped after {provisioner.batches} batch(es)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Privileged maildir provisioning service.")
+    parser.add_argument('--socket', default=SOCKET_PATH, help="Unix socket to listen on (default: %(default)s)")
+    parser.add_argument('--base', default=VMAIL_BASE, help="maildir root (default: %(default)s)")
+    parser.add_argument('--owner', default=OWNER, help="user owning the maildirs (default: %(default)s)")
+    parser.add_argument('--group', default=None, help="group allowed to connect to the socket")
+    args = parser.parse_args()
+    serve(args.socket, args.base, args.owner, args.group)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Render-time benchmark for the super admin dashboard, cold vs warm cache.
+
+Creates a throwaway test database (like manage.py test), fills it with
+synthetic domains, stats and plans, and times full dashboard requests with
+the cache cleared before each one (cold) and with cached domain rows, plan
+catalog and authorization snapshot (warm).
+Usage: DJANGO_SETTINGS_MODULE=config.settings python3 scripts/benchmarks/bench_dashboard.py [--domains 1000] [--repeat 20]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'mail_admin'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+import django
+
+django.setup()
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+
+from core.models import DomainAllocation, DomainStats, MailDomain, MailPlan, ServerHealth, TrafficDaily, TrafficHourly
+
+UNMANAGED = (MailDomain, DomainStats, ServerHealth, TrafficHourly, TrafficDaily)
+
+
+def populate(domain_count):
+    with connection.schema_editor() as editor:
+        for model in UNMANAGED:
+            editor.create_model(model)
+    MailPlan.objects.create(name="Standard", max_users=10, max_aliases=20)
+    premium = MailPlan.objects.create(name="Premium", max_users=50, max_aliases=100)
+    names = [f"tenant{i}.co.zw" for i in range(domain_count)]
+    MailDomain.objects.using('mail_data').bulk_create(MailDomain(name=name) for name in names)
+    DomainStats.objects.using('mail_data').bulk_create(
+        DomainStats(domain_name=name, sent_count=i * 7, received_count=i * 3, top_sender=f"info@{name}")
+        for i, name in enumerate(names)
+    )
+    DomainAllocation.objects.bulk_create(DomainAllocation(domain_name=name, plan=premium) for name in names[::3])
+
+
+def time_requests(client, repeat, clear):
+    timings = []
+    for _ in range(repeat):
+        if clear:
+            cache.clear()
+        start = time.perf_counter()
+        response = client.get(reverse('dashboard'))
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.status_code
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--domains', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        populate(args.domains)
+        admin = User.objects.create_superuser('admin@example.com', 'admin@example.com', 'unused')
+        client = Client()
+        client.force_login(admin)
+
+        cold = time_requests(client, args.repeat, clear=True)
+        time_requests(client, 1, clear=False)
+        warm = time_requests(client, args.repeat, clear=False)
+
+        print(f"{args.domains} domains, {args.repeat} requests each")
+        print(f"{'cache':>6} {'median (ms)':>12} {'min (ms)':>10}")
+        for label, timings in (('cold', cold), ('warm', warm)):
+            print(f"{label:>6} {statistics.median(timings) * 1000:>12.1f} {min(timings) * 1000:>10.1f}")
+    finally:
+        with connection.schema_editor() as editor:
+            for model in reversed(UNMANAGED):
+                editor.delete_model(model)
+        runner.teardown_databases(old_config)
+
+
+if __name__ == "__main__":
+    main()
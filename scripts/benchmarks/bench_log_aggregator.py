@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for the single-pass mail.log aggregator.
+
+Generates a synthetic Postfix log and measures lines/sec and wall time for
+10, 100 and 1,000 domains.
+Usage: python3 scripts/benchmarks/bench_log_aggregator.py [--lines 500000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'mail_admin'))
+
+from core.maillog import DomainAggregator, open_log
+
+EXTERNAL_DOMAINS = ["gmail.com", "yahoo.com", "outlook.com", "icloud.com", "protonmail.com"]
+
+
+def synthetic_log(path, domains, line_count, seed=42):
+    """Write a Postfix-style log with a realistic mix of noise and delivery lines."""
+    rng = random.Random(seed)
+    written = 0
+    with open(path, 'w') as f:
+        while written < line_count:
+            queue_id = f"{rng.getrandbits(40):010X}"
+            pid = rng.randint(1000, 99999)
+            local = rng.choice(domains)
+            user = f"user{rng.randint(1, 40)}@{local}"
+            remote = f"contact{rng.randint(1, 500)}@{rng.choice(EXTERNAL_DOMAINS)}"
+            stamp = f"Jan 28 07:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}"
+            outbound = rng.random() < 0.5
+            sender, rcpt = (user, remote) if outbound else (remote, user)
+            agent = "smtp" if outbound else "lmtp"
+            relay = "gmail-smtp-in.l.google.com[142.250.1.27]:25" if outbound else "mail.local[private/dovecot-lmtp]"
+            f.write(f"{stamp} mail postfix/smtpd[{pid}]: connect from unknown[10.0.0.{rng.randint(1, 254)}]\n")
+            f.write(f"{stamp} mail postfix/cleanup[{pid + 1}]: {queue_id}: message-id=<{queue_id}@mail.local>\n")
+            f.write(f"{stamp} mail postfix/qmgr[900]: {queue_id}: from=<{sender}>, size={rng.randint(900, 90000)}, nrcpt=1 (queue active)\n")
+            f.write(f"{stamp} mail postfix/{agent}[{pid + 2}]: {queue_id}: to=<{rcpt}>, relay={relay}, "
+                    f"delay=0.4, delays=0.1/0/0.1/0.2, dsn=2.0.0, status=sent (250 2.0.0 OK)\n")
+            f.write(f"{stamp} mail postfix/qmgr[900]: {queue_id}: removed\n")
+            f.write(f"{stamp} mail dovecot: imap-login: Login: user=<{user}>, method=PLAIN, rip=10.0.0.9\n")
+            written += 6
+    return written
+
+
+def run(domain_count, line_count):
+    domains = [f"tenant{i}.co.zw" for i in range(domain_count)]
+    with tempfile.NamedTemporaryFile(suffix='.log', delete=False) as tmp:
+        path = tmp.name
+    try:
+        lines = synthetic_log(path, domains, line_count)
+        start = time.perf_counter()
+        aggregator = DomainAggregator(domains)
+        with open_log(path) as log:
+            aggregator.feed_lines(log)
+        aggregator.results()
+        elapsed = time.perf_counter() - start
+    finally:
+        os.unlink(path)
+    return lines, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lines', type=int, default=500000)
+    args = parser.parse_args()
+
+    print(f"{'domains':>8} {'lines':>10} {'wall (s)':>10} {'lines/sec':>12}")
+    for domain_count in (10, 100, 1000):
+        lines, elapsed = run(domain_count, args.lines)
+        print(f"{domain_count:>8} {lines:>10} {elapsed:>10.3f} {lines / elapsed:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,14 @@ import secrets
 import string
 import pymysql
 
+# Maildir provisioning lives in the Django project (core/ modules are Django-free)
+for candidate in (os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'mail_admin'), '/opt/mail_admin'):
+    if os.path.isdir(os.path.join(candidate, 'core')):
+        sys.path.insert(0, candidate)
+        break
+
+from core.provision import create_maildirs
+
 # Configuration
 DB_HOST = "localhost"
 DB_USER = "mailuser"
@@ -87,14 +95,14 @@ def add_domain(conn):
         return cursor.lastrowid
 
 def add_user(conn, domain_id, username, passwords_file):
-    """Add a user to the database."""
+    """Add a user to the database. Returns: True when the user was created."""
     email = f"{username}@{DOMAIN}"
     
     with conn.cursor() as cursor:
         cursor.execute("SELECT 1 FROM users WHERE mail = %s", (email,))
         if cursor.fetchone():
             print(f"  ⚠ User {email} already exists, skipping...")
-            return
+            return False
     
     password = generate_password()
     password_hash = hash_password(password)
@@ -106,14 +114,10 @@ def add_user(conn, domain_id, username, passwords_file):
         """, (email, email, password_hash, username, email, domain_id))
     conn.commit()
     
-    # Create maildir
-    maildir = f"{VMAIL_BASE}/{DOMAIN}/{username}"
-    subprocess.run(["mkdir", "-p", maildir], check=True)
-    subprocess.run(["chown", "-R", "vmail:vmail", f"{VMAIL_BASE}/{DOMAIN}"], check=True)
-    
     # Save password
     passwords_file.write(f"{email}: {password}\n")
     print(f"  ✓ Created {email}")
+    return True
 
 def main():
     print("=" * 60)
@@ -135,11 +139,15 @@ def main():
             f.write(f"# Generated: {subprocess.check_output(['date']).decode().strip()}\n")
             f.write("# " + "=" * 50 + "\n\n")
             
-            for username in USERS:
-                add_user(conn, domain_id, username, f)
+            created = [username for username in USERS if add_user(conn, domain_id, username, f)]
         
         os.chmod(passwords_path, 0o600)
         
+        # One request for every new maildir: only their own directories are chowned, never the whole domain
+        result = create_maildirs([(DOMAIN, username) for username in created], base=VMAIL_BASE)
+        for address, error in result['errors'].items():
+            print(f"  ✗ Maildir for {address}: {error}")
+        
         print("\n" + "=" * 60)
         print("✅ MIGRATION SETUP COMPLETE")
         print("=" * 60)
@@ -2,7 +2,15 @@
 """
 Migration script for zimpricecheck.com to zimprices mail server.
 """
-import os, subprocess, secrets, string, pymysql
+import os, subprocess, secrets, string, sys, pymysql
+
+# Maildir provisioning lives in the Django project (core/ modules are Django-free)
+for candidate in (os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'mail_admin'), '/opt/mail_admin'):
+    if os.path.isdir(os.path.join(candidate, 'core')):
+        sys.path.insert(0, candidate)
+        break
+
+from core.provision import create_maildirs
 
 DB_HOST, DB_USER, DB_NAME = "localhost", "mailuser", "mailserver"
 VMAIL_BASE, DOMAIN = "/var/vmail", "zimpricecheck.com"
@@ -49,6 +57,7 @@ def main():
     
     # Create users
     passwords_path = os.path.expanduser(f"~/{DOMAIN.replace('.', '_')}_passwords.txt")
+    created = []
     with open(passwords_path, "w") as f:
         f.write(f"# Passwords for {DOMAIN}\n\n")
         for user in USERS:
@@ -68,15 +77,16 @@ def main():
                 )
             conn.commit()
             
-            # Create maildir
-            mdir = f"{VMAIL_BASE}/{DOMAIN}/{user}"
-            subprocess.run(["mkdir", "-p", mdir], check=True)
-            subprocess.run(["chown", "-R", "vmail:vmail", f"{VMAIL_BASE}/{DOMAIN}"], check=True)
+            created.append(user)
             
             f.write(f"{email}: {pw}\n")
             print(f"✓ Created {email}")
     
     os.chmod(passwords_path, 0o600)
+    # One request for every new maildir: only their own directories are chowned, never the whole domain
+    result = create_maildirs([(DOMAIN, user) for user in created], base=VMAIL_BASE)
+    for address, error in result['errors'].items():
+        print(f"✗ Maildir for {address}: {error}")
     print(f"\n✅ MIGRATION SETUP COMPLETE. Passwords saved to: {passwords_path}")
     conn.close()
 
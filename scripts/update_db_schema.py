@@ -29,7 +29,84 @@ def migrate():
                 print("Column metrics_json added.")
             else:
                 print("Column metrics_json already exists.")
-                
+
+            # Per-file read positions for mail_monitor's incremental parsing
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS log_checkpoints (
+                    path VARCHAR(255) NOT NULL PRIMARY KEY,
+                    inode BIGINT UNSIGNED NOT NULL,
+                    byte_offset BIGINT UNSIGNED NOT NULL DEFAULT 0,
+                    state_json MEDIUMTEXT NULL,
+                    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """)
+            # Pending Postfix queue IDs carried between runs
+            cursor.execute("ALTER TABLE log_checkpoints ADD COLUMN IF NOT EXISTS state_json MEDIUMTEXT NULL")
+            conn.commit()
+            print("Table log_checkpoints ready.")
+
+            # Time-bucketed traffic history. mailbox = '' holds the domain total.
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS traffic_hourly (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    domain_name VARCHAR(255) NOT NULL,
+                    mailbox VARCHAR(255) NOT NULL DEFAULT '',
+                    bucket DATETIME NOT NULL,
+                    sent INT UNSIGNED NOT NULL DEFAULT 0,
+                    received INT UNSIGNED NOT NULL DEFAULT 0,
+                    bounced INT UNSIGNED NOT NULL DEFAULT 0,
+                    deferred INT UNSIGNED NOT NULL DEFAULT 0,
+                    rejected INT UNSIGNED NOT NULL DEFAULT 0,
+                    UNIQUE KEY uniq_traffic_hourly (domain_name, mailbox, bucket),
+                    KEY idx_traffic_hourly_bucket (bucket)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS traffic_daily (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    domain_name VARCHAR(255) NOT NULL,
+                    mailbox VARCHAR(255) NOT NULL DEFAULT '',
+                    day DATE NOT NULL,
+                    sent INT UNSIGNED NOT NULL DEFAULT 0,
+                    received INT UNSIGNED NOT NULL DEFAULT 0,
+                    bounced INT UNSIGNED NOT NULL DEFAULT 0,
+                    deferred INT UNSIGNED NOT NULL DEFAULT 0,
+                    rejected INT UNSIGNED NOT NULL DEFAULT 0,
+                    UNIQUE KEY uniq_traffic_daily (domain_name, mailbox, day),
+                    KEY idx_traffic_daily_day (day)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """)
+            conn.commit()
+            print("Tables traffic_hourly / traffic_daily ready.")
+
+            # Per-period health summaries (min/avg/max/p95) from core.health.HealthSampler
+            health_columns = ["sample_count INT NULL", "period_seconds INT NULL"] + [
+                f"{metric}_{stat} FLOAT NULL"
+                for metric in ('cpu', 'ram', 'disk', 'load', 'iowait')
+                for stat in ('min', 'avg', 'max', 'p95')
+            ]
+            for column in health_columns:
+                cursor.execute(f"ALTER TABLE server_health ADD COLUMN IF NOT EXISTS {column}")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_server_health_updated ON server_health (updated_at)")
+            conn.commit()
+            print("Table server_health summary columns ready.")
+
+            # Per-domain usage counters, kept by the app and reconciled by mail_monitor
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS domain_usage (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    domain_name VARCHAR(255) NOT NULL UNIQUE,
+                    mailboxes INT NOT NULL DEFAULT 0,
+                    aliases INT NOT NULL DEFAULT 0,
+                    platform_aliases INT NOT NULL DEFAULT 0,
+                    quota_kb BIGINT NOT NULL DEFAULT 0,
+                    version BIGINT NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                )
+            """)
+            conn.commit()
+            print("Table domain_usage ready.")
+
     except Exception as e:
         print(f"Migration Failed: {e}")
         sys.exit(1)
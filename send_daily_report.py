@@ -1,61 +1,58 @@
 #!/usr/bin/env python3
 """
-Generate and send daily email usage report using pflogsum.
+Generate and send daily email usage report from the Postfix journal entries.
 Target recipients: garikaib@gmail.com, garikai@zimpricecheck.com
 Schedule: Daily at 8:00 Africa/Harare (06:00 UTC)
 """
 
-import subprocess
 import datetime
+import os
 import smtplib
+import sys
+from collections import Counter
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+# Shared parsers live in the Django project (core/ modules are Django-free)
+for candidate in (os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mail_admin'), '/opt/mail_admin'):
+    if os.path.isdir(os.path.join(candidate, 'core')):
+        sys.path.insert(0, candidate)
+        break
+
+from core.journal import POSTFIX_IDENTIFIERS, JournalReader
+from core.maillog import QueueCorrelator
+
 RECIPIENTS = ["garikaib@gmail.com", "garikai@zimpricecheck.com"]
 SUBJECT = f"Daily Email Usage Report - {datetime.date.today() - datetime.timedelta(days=1)}"
-LOG_FILE = "/var/log/mail.log.1" # Analysis for the previous day (log rotated daily)
-
-# Fallback to current log if rotated log doesn't exist
-import os
-if not os.path.exists(LOG_FILE):
-    LOG_FILE = "/var/log/mail.log"
 
-def get_pflogsum_report():
-    # Use journalctl to get yesterday's logs in traditional syslog format
-    # This is much more reliable than parsing ISO 8601 files directly
-    cmd = "sudo journalctl --since yesterday --until today --output=short | pflogsumm"
-    
-    try:
-        # Run via shell to support piping
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True, check=True)
-        return result.stdout
-    except subprocess.CalledProcessError as e:
-        return f"Error running pflogsumm via journalctl: {e}\nOutput: {e.output}\nStderr: {e.stderr}"
-    except Exception as e:
-        return f"Unexpected error: {str(e)}"
+def yesterdays_entries():
+    """Postfix journal entries from local midnight yesterday to midnight today."""
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+    reader = JournalReader(
+        identifiers=POSTFIX_IDENTIFIERS,
+        since=today - datetime.timedelta(days=1),
+        until=today,
+        command=("sudo", "journalctl"),
+    )
+    return reader.entries()
 
-def parse_top_senders(report_text, limit=10):
-    lines = report_text.splitlines()
-    senders = []
-    in_senders_section = False
-    
-    for line in lines:
-        if "senders by message count" in line.lower():
-            in_senders_section = True
-            continue
-        if in_senders_section and "recipients by message count" in line.lower():
-            in_senders_section = False
-            break
-        
-        if in_senders_section and line.strip():
-            # Example line: "    123   user@domain.com"
-            parts = line.split()
-            if len(parts) >= 2 and parts[0].isdigit():
-                senders.append((int(parts[0]), parts[1]))
-    
-    # Sort by count descending and take top N
-    senders.sort(key=lambda x: x[0], reverse=True)
-    return senders[:limit]
+def count_senders(entries, limit=10):
+    """
+    Messages per sender address, counting each queue ID once (the same
+    measure as pflogsumm's "senders by message count").
+    Returns: list of (count, sender) tuples, highest first.
+    """
+    correlator = QueueCorrelator()
+    counted = set()
+    senders = Counter()
+    for entry in entries:
+        for event in correlator.feed_record(entry.time, entry.identifier, entry.message):
+            # Rejected mail never entered the queue
+            if not event.sender or event.status == 'rejected' or event.queue_id in counted:
+                continue
+            counted.add(event.queue_id)
+            senders[event.sender.lower()] += 1
+    return [(count, sender) for sender, count in senders.most_common(limit)]
 
 def format_html_table(senders):
     html = """
@@ -81,7 +78,7 @@ def format_html_table(senders):
     
     html += """
     </table>
-    <p>Generated by pflogsumm report.</p>
+    <p>Generated from the Postfix journal.</p>
     </body>
     </html>
     """
@@ -105,9 +102,12 @@ def send_email(html_content):
         print(f"❌ Failed to send email: {e}")
 
 def main():
-    report = get_pflogsum_report()
-    top_senders = parse_top_senders(report)
-    
+    try:
+        top_senders = count_senders(yesterdays_entries())
+    except Exception as e:
+        print(f"❌ Failed to read the journal: {e}")
+        top_senders = []
+
     if not top_senders:
         print("No stats found for yesterday.")
         html_report = "<html><body><h2>No email stats found for yesterday.</h2></body></html>"
@@ -115,7 +115,6 @@ def main():
         html_report = format_html_table(top_senders)
     
     send_email(html_report)
-    # print(report) # Debug: print full report to stdout
 
 if __name__ == "__main__":
     main()
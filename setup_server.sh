@@ -41,6 +41,8 @@ ssh -t "$REMOTE_USER@$REMOTE_HOST" << 'EOF'
     echo "=========================================="
     sudo mkdir -p /opt/mail_admin
     sudo chown ubuntu:ubuntu /opt/mail_admin
+    # Read access to mail.log and the nginx logs for the live log stream
+    sudo usermod -aG adm ubuntu
 
     echo "=========================================="
     echo "3. Setting up Python Virtual Environment"
@@ -62,7 +64,8 @@ ssh -t "$REMOTE_USER@$REMOTE_HOST" << 'EOF'
         pymysql \
         gunicorn \
         requests \
-        psutil
+        psutil \
+        redis
 
     echo "=========================================="
     echo "4. Configuring Systemd Service"
@@ -78,7 +81,10 @@ Group=ubuntu
 WorkingDirectory=/opt/mail_admin
 Environment="PATH=/opt/mail_admin/venv/bin:/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"
 EnvironmentFile=/opt/mail_admin/.env
-ExecStart=/opt/mail_admin/venv/bin/gunicorn --workers 3 --bind 127.0.0.1:8000 config.wsgi:application
+# Generated DOVEADM_API_KEY (step 5), kept apart so uploading .env or deploying never replaces it
+EnvironmentFile=-/etc/mail-admin/doveadm.env
+# Threads (gthread) so live log streams do not tie up whole workers
+ExecStart=/opt/mail_admin/venv/bin/gunicorn --workers 3 --threads 4 --bind 127.0.0.1:8000 config.wsgi:application
 
 [Install]
 WantedBy=multi-user.target
@@ -113,6 +119,27 @@ plugin {
 }
 QUOTA_EOF
 
+    # doveadm HTTP API on localhost for reloads and live quota usage (core/doveadm.py).
+    # The key goes to its own env file, loaded by mail-admin.service after .env
+    DOVEADM_ENV=/etc/mail-admin/doveadm.env
+    sudo mkdir -p /etc/mail-admin
+    if ! sudo grep -qs '^DOVEADM_API_KEY=' $DOVEADM_ENV; then
+        echo "DOVEADM_API_KEY=$(openssl rand -hex 24)" | sudo tee $DOVEADM_ENV > /dev/null
+    fi
+    sudo chmod 0600 $DOVEADM_ENV
+    DOVEADM_API_KEY=$(sudo grep '^DOVEADM_API_KEY=' $DOVEADM_ENV | cut -d= -f2)
+    cat << DOVEADM_EOF | sudo tee /etc/dovecot/conf.d/95-doveadm-api.conf > /dev/null
+doveadm_api_key = $DOVEADM_API_KEY
+service doveadm {
+  inet_listener http {
+    address = 127.0.0.1
+    port = 8080
+  }
+}
+DOVEADM_EOF
+    sudo chmod 0640 /etc/dovecot/conf.d/95-doveadm-api.conf
+    sudo chown root:dovecot /etc/dovecot/conf.d/95-doveadm-api.conf
+
     sudo systemctl restart dovecot || true
 
     echo "=========================================="
@@ -125,26 +152,87 @@ QUOTA_EOF
     fi
 
     echo "=========================================="
-    echo "7. Configuring Mail Monitoring Cron"
+    echo "7. Configuring Mail Monitoring Daemon"
     echo "=========================================="
-    CRON_JOB="0 * * * * cd /opt/mail_admin && /opt/mail_admin/venv/bin/python3 mail_monitor.py >> /var/log/mail_monitor.log 2>&1"
-    (sudo crontab -l 2>/dev/null | grep -v "mail_monitor.py"; echo "$CRON_JOB") | sudo crontab -
+    # Replaces the old hourly cron: tails mail.log and flushes stats every 30s
+    (sudo crontab -l 2>/dev/null | grep -v "mail_monitor.py") | sudo crontab -
+    cat << 'MONITOR_CONF' | sudo tee /etc/systemd/system/mail-monitor.service
+[Unit]
+Description=Mail Admin log follower (mail.log -> domain_stats)
+After=network.target mariadb.service
+
+[Service]
+WorkingDirectory=/opt/mail_admin
+ExecStart=/opt/mail_admin/venv/bin/python3 mail_monitor.py --follow
+Restart=on-failure
+RestartSec=10
+KillSignal=SIGTERM
+TimeoutStopSec=30
+
+[Install]
+WantedBy=multi-user.target
+MONITOR_CONF
+
+    # Full-text index of mail.log and rspamd.log events behind the Log Search page
+    cat << 'INDEX_CONF' | sudo tee /etc/systemd/system/log-index.service
+[Unit]
+Description=Mail Admin log indexer (mail.log, rspamd.log -> SQLite FTS5)
+After=network.target
+
+[Service]
+User=ubuntu
+SupplementaryGroups=adm _rspamd
+StateDirectory=mail-admin/logindex
+WorkingDirectory=/opt/mail_admin
+ExecStartPre=/bin/sh -c 'test -f /var/lib/mail-admin/logindex/checkpoints.json || /opt/mail_admin/venv/bin/python3 log_index.py --backfill'
+ExecStart=/opt/mail_admin/venv/bin/python3 log_index.py --follow
+Restart=on-failure
+RestartSec=10
+KillSignal=SIGTERM
+TimeoutStartSec=infinity
+TimeoutStopSec=30
+
+[Install]
+WantedBy=multi-user.target
+INDEX_CONF
+
+    # Root helper that creates maildirs owned by vmail for the app (replaces sudo mkdir + chown -R)
+    cat << 'PROVISION_CONF' | sudo tee /etc/systemd/system/mail-provision.service
+[Unit]
+Description=Mail Admin maildir provisioning service
+After=local-fs.target
+
+[Service]
+RuntimeDirectory=mail-admin
+RuntimeDirectoryMode=0755
+WorkingDirectory=/opt/mail_admin
+ExecStart=/opt/mail_admin/venv/bin/python3 provisiond.py --group ubuntu
+Restart=on-failure
+RestartSec=5
+KillSignal=SIGTERM
+
+[Install]
+WantedBy=multi-user.target
+PROVISION_CONF
+
+    sudo systemctl daemon-reload
+    sudo systemctl enable --now mail-monitor
+    sudo systemctl enable --now log-index
+    sudo systemctl enable --now mail-provision
 
     echo "=========================================="
     echo "8. Configuring Sudoers for Platform Operations"
     echo "=========================================="
     cat << 'SUDOERS' | sudo tee /etc/sudoers.d/mail-admin
 # Mail Admin Platform - Restricted Commands
-ubuntu ALL=(ALL) NOPASSWD: /usr/bin/mkdir -p /var/vmail/*
-ubuntu ALL=(ALL) NOPASSWD: /usr/bin/chown -R vmail\:vmail /var/vmail/*
 ubuntu ALL=(ALL) NOPASSWD: /usr/bin/rm -rf /var/vmail/*
 ubuntu ALL=(ALL) NOPASSWD: /usr/bin/journalctl -u mail-admin *
-ubuntu ALL=(ALL) NOPASSWD: /usr/bin/tail -n * /var/log/mail.log
-ubuntu ALL=(ALL) NOPASSWD: /usr/bin/tail -n * /var/log/nginx/error.log
+ubuntu ALL=(ALL) NOPASSWD: /usr/bin/journalctl -u mail-admin.service *
 ubuntu ALL=(ALL) NOPASSWD: /usr/bin/systemctl is-active *
 ubuntu ALL=(ALL) NOPASSWD: /usr/bin/systemctl stop mail-admin
 ubuntu ALL=(ALL) NOPASSWD: /usr/bin/systemctl start mail-admin
 ubuntu ALL=(ALL) NOPASSWD: /usr/bin/systemctl restart mail-admin
+ubuntu ALL=(ALL) NOPASSWD: /usr/bin/systemctl restart mail-monitor
 ubuntu ALL=(ALL) NOPASSWD: /usr/sbin/doveadm reload
 ubuntu ALL=(ALL) NOPASSWD: /opt/mail_admin/venv/bin/python3 /opt/mail_admin/mail_monitor.py
 SUDOERS
@@ -157,6 +245,7 @@ SUDOERS
     echo ""
     echo "Next steps:"
     echo "1. Upload your .env file to /opt/mail_admin/.env"
+    echo "   (leave DOVEADM_API_KEY out of it: the generated key is in /etc/mail-admin/doveadm.env)"
     echo "2. Run ./deploy.sh to deploy your application code"
     echo "3. Configure Nginx and SSL certificates"
 EOF